@@ -0,0 +1,79 @@
+import re
+
+from mk2 import events
+
+try:
+    from mk2 import user_client
+except ImportError:
+    # the client needs urwid and pyperclip
+    user_client = None
+
+
+LINES = [
+    ("INFO", "Steve[/127.0.0.1:51234] logged in with entity id 42 at (0.5, 64.0, 0.5)"),
+    ("INFO", "<Steve> anyone want to trade diamonds"),
+    ("INFO", "§a[Shop] §fSteve bought §e64 diamonds"),
+    ("WARN", "Can't keep up! Is the server overloaded?"),
+    ("ERROR", "Could not pass event PlayerMoveEvent to ExamplePlugin v1.0"),
+    ("INFO", "&6[Broadcast] &cServer restarting in &l5 &r&cminutes"),
+    ("INFO", "Steve lost connection: Disconnected"),
+]
+
+# mark2.regex.* from the default config, and the client's lost-connection
+PATTERNS = {
+    'join': r"(?P<username>[A-Za-z0-9_]{1,16}).*\[\/(?P<ip>[0-9.:%]*)\] logged in with entity id .+",
+    'quit': r"(?P<username>[A-Za-z0-9_]{1,16}) lost connection: (?P<reason>.+)",
+    'chat': r"<(?P<username>[A-Za-z0-9_]{1,16})> (?P<message>.+)",
+    'lost_connection': r".* lost connection: .*",
+}
+
+
+def messages():
+    return [events.Console(source='server', kind='raw', level=level, line=data, time="12:00:00").serialize()
+            for level, data in LINES]
+
+
+class Colorize:
+    def setup(self):
+        if user_client is None:
+            raise NotImplementedError
+        self.messages = messages()
+        self.lines = [user_client.console_repr(m) for m in self.messages]
+
+    def time_ansi_replace(self):
+        for line in self.lines:
+            user_client.ansi_replace(line)
+
+    def time_colorize(self):
+        for msg in self.messages:
+            user_client.colorize(msg)
+
+
+class Filter:
+    def setup(self):
+        if user_client is None:
+            raise NotImplementedError
+
+        # the same shape of predicate UserClientFactory.make_filters builds
+        def makefilter(p):
+            p = re.compile(p)
+            def _filter(msg):
+                m = p.match(msg['data'])
+                return m and m.end() == len(msg['data'])
+            return _filter
+        patterns = {k: makefilter(p) for k, p in PATTERNS.items()}
+
+        self.chat = user_client.LineFilter()
+        for name in ('chat', 'join', 'quit'):
+            self.chat.append(user_client.LineFilter.SHOW, patterns[name])
+        self.quiet = user_client.LineFilter()
+        self.quiet.append(user_client.LineFilter.HIDE, patterns['lost_connection'])
+        self.messages = messages()
+
+    def time_apply_chat(self):
+        for msg in self.messages:
+            self.chat.apply(msg)
+
+    def time_apply_quiet(self):
+        for msg in self.messages:
+            self.quiet.apply(msg)
@@ -0,0 +1,58 @@
+from mk2 import events
+
+
+LINES = [
+    "[12:00:01] [Server thread/INFO]: Steve joined the game",
+    "[12:00:02] [Async Chat Thread - #0/INFO]: <Steve> anyone want to trade diamonds",
+    "[12:00:03] [Server thread/WARN]: Can't keep up! Is the server overloaded? Running 2049ms or 40 ticks behind",
+    "[12:00:04] [Server thread/INFO]: Steve was slain by Zombie",
+    "[12:00:05] [Server thread/INFO]: [ExamplePlugin] Saved 120 regions",
+]
+
+PATTERNS = [
+    r"(?P<username>[A-Za-z0-9_]{1,16}) joined the game",
+    r"(?P<username>[A-Za-z0-9_]{1,16}) left the game",
+    r"<(?P<username>[A-Za-z0-9_]{1,16})> (?P<message>.+)",
+    r"Can't keep up!",
+    r"(?P<username>[A-Za-z0-9_]{1,16}) was slain by (?P<killer>\w+)",
+    r"Done \(",
+    r"Stopping server",
+    r".*",
+]
+
+
+class ServerOutput:
+    def time_construct(self):
+        for line in LINES:
+            events.ServerOutput(line=line)
+
+    def time_prefilter(self):
+        for line in LINES:
+            e = events.ServerOutput(line=line)
+            for pattern in PATTERNS:
+                e.prefilter(pattern)
+
+    def time_prefilter_level(self):
+        for line in LINES:
+            e = events.ServerOutput(line=line)
+            e.prefilter(r".*", level="WARN")
+
+
+class Dispatch:
+    params = [1, 10, 50]
+    param_names = ['handlers']
+
+    def setup(self, handlers):
+        self.dispatcher = events.EventDispatcher(lambda *a: None)
+        for i in range(handlers):
+            self.dispatcher.register(lambda e: None, events.ServerOutput,
+                                     pattern=PATTERNS[i % len(PATTERNS)])
+            self.dispatcher.register(lambda e: None, events.Console)
+
+    def time_server_output(self, handlers):
+        for line in LINES:
+            self.dispatcher.dispatch(events.ServerOutput(line=line))
+
+    def time_console(self, handlers):
+        for line in LINES:
+            self.dispatcher.dispatch(events.Console(source='server', line=line))
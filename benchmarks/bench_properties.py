@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+
+from mk2 import properties
+from mk2.fakeserver import DEATHS
+from mk2.services.console_tracking import DeathMatcher
+from mk2.shared import open_resource
+
+
+def write_lang(path, n=3000):
+    # a real language file has a few thousand keys, ~150 of them deaths
+    with open(path, 'w') as f:
+        for i in range(n):
+            f.write("block.minecraft.stone{0}=Stone {0}\n".format(i))
+        for i in range(15):
+            for k, v in sorted(DEATHS.items()):
+                f.write("{}.{}={} ({})\n".format(k, i, v, i))
+
+
+class Parse:
+    def setup(self):
+        self.tmp = tempfile.mkdtemp(prefix='mk2bench-')
+        with open_resource('resources/mark2.default.properties') as f:
+            text = f.read()
+        if isinstance(text, bytes):
+            text = text.decode('utf8')
+        # pad it out to the size of a heavily configured server
+        extra = "\n".join("plugin.example{0}.enabled=true\nplugin.example{0}.message=hello {0}, world"
+                          .format(i) for i in range(500))
+        self.mark2_properties = os.path.join(self.tmp, 'mark2.properties')
+        with open(self.mark2_properties, 'w') as f:
+            f.write(text + "\n" + extra + "\n")
+        self.lang = os.path.join(self.tmp, 'en_US.lang')
+        write_lang(self.lang)
+
+    def teardown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    # load() keeps what it has parsed, so these go to the parser directly
+    def time_mark2_properties(self):
+        with open(self.mark2_properties) as f:
+            properties.Mark2Properties(f)
+
+    def time_lang(self):
+        with open(self.lang) as f:
+            properties.Lang(f)
+
+    def time_load_unchanged(self):
+        properties.load(properties.Mark2Properties, self.mark2_properties)
+
+
+class Deaths:
+    def setup(self):
+        tmp = tempfile.mkdtemp(prefix='mk2bench-')
+        try:
+            write_lang(os.path.join(tmp, 'en_US.lang'))
+            with open(os.path.join(tmp, 'en_US.lang')) as f:
+                self.lang = properties.Lang(f)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def time_get_deaths(self):
+        list(self.lang.get_deaths())
+
+    def time_death_matcher(self):
+        DeathMatcher(self.lang.get_deaths())
+
+
+class DeathMatch:
+    lines = ["Steve joined the game",
+             "<Steve> anyone want to trade diamonds",
+             "Can't keep up! Is the server overloaded? Running 2049ms or 40 ticks behind",
+             "Steve was slain by Zombie (3)",
+             "Steve moved wrongly!"]
+
+    def setup(self):
+        Deaths.setup(self)
+        self.matcher = DeathMatcher(self.lang.get_deaths())
+
+    def time_match(self):
+        for line in self.lines:
+            self.matcher.match(line)
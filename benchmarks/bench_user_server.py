@@ -0,0 +1,131 @@
+import json
+
+from mk2 import events, framing
+from mk2.services.user_server import Scrollback, UserServerFactory
+
+
+class NullTransport:
+    disconnecting = False
+
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+
+def console_events(n):
+    return [events.Console(source='server', kind='raw', level='INFO',
+                           line="[12:00:{:02}] [Server thread/INFO]: <Steve> message number {}".format(i % 60, i))
+            for i in range(n)]
+
+
+def encoded(n):
+    """(json, compact json) pairs, as the scrollback keeps them."""
+    lines = [e.serialize() for e in console_events(n)]
+    return [(json.dumps(l).encode("utf-8"), framing.compact_line(l)) for l in lines]
+
+
+class ScrollbackPut:
+    params = [200, 5000, 20000]
+    param_names = ['length']
+
+    def setup(self, length):
+        self.scrollback = Scrollback(length)
+        for line in encoded(length):
+            self.scrollback.put(*line)
+        self.line, self.compact = encoded(1)[0]
+
+    def time_put(self, length):
+        self.scrollback.put(self.line, self.compact)
+
+    def time_get_all(self, length):
+        self.scrollback.get()
+
+    def time_get_last_100(self, length):
+        self.scrollback.get(last=100)
+
+    def time_get_since(self, length):
+        self.scrollback.get(since=self.scrollback.seq - 100)
+
+
+def factory(length):
+    manager = type('Manager', (), {})()
+    manager.events = events.EventDispatcher(lambda *a: None)
+    manager.config = {'mark2.scrollback.length': length}
+    f = UserServerFactory(manager)
+    # flushed by hand
+    f.clock = type('Clock', (), {'callLater': lambda s, *a: None})()
+    return f
+
+
+class SendHelper:
+    def setup(self):
+        self.protocol = factory(1000).buildProtocol(None)
+        self.protocol.makeConnection(NullTransport())
+        for line in encoded(1000):
+            self.protocol.factory.scrollback.put(*line)
+
+    def time_scrollback(self):
+        self.protocol.send_scrollback()
+
+
+class SendHelperFramed:
+    params = ['frames', 'compact', 'zlib', 'compact+zlib']
+    param_names = ['framing']
+
+    def setup(self, framing):
+        self.protocol = factory(1000).buildProtocol(None)
+        self.protocol.makeConnection(NullTransport())
+        for line in encoded(1000):
+            self.protocol.factory.scrollback.put(*line)
+        self.protocol.set_framing({'compact': 'compact' in framing, 'zlib': 'zlib' in framing})
+
+    def time_scrollback(self, framing):
+        self.protocol.send_scrollback()
+
+
+class Broadcast:
+    params = [1, 8, 32]
+    param_names = ['clients']
+
+    def setup(self, clients):
+        self.factory = factory(1000)
+        for _ in range(clients):
+            protocol = self.factory.buildProtocol(None)
+            protocol.makeConnection(NullTransport())
+        self.events = console_events(10)
+
+    def time_console(self, clients):
+        # ten lines in one reactor turn
+        for event in self.events:
+            self.factory.handle_console(event)
+        self.factory.flush()
+
+
+class BroadcastSubscribed:
+    """Clients split between two filters, of which most lines match one."""
+    params = [8, 32]
+    param_names = ['clients']
+
+    def setup(self, clients):
+        self.factory = factory(1000)
+        for i in range(clients):
+            protocol = self.factory.buildProtocol(None)
+            protocol.makeConnection(NullTransport())
+            if i % 2:
+                protocol.lineReceived(b'{"type": "subscribe", "levels": ["WARN", "ERROR"]}')
+            else:
+                protocol.lineReceived(b'{"type": "subscribe", "patterns": [".*<\\\\w+> .*"]}')
+        self.events = console_events(10)
+
+    def time_console(self, clients):
+        for event in self.events:
+            self.factory.handle_console(event)
+        self.factory.flush()
@@ -0,0 +1,152 @@
+"""
+Runs the benchmarks in this directory and compares them with the times in
+baseline.json. The suite is laid out the way asv expects (classes with
+`setup`, `params` and `time_*` methods), so it can also be run with asv,
+but this runner has no dependencies beyond mark2's own.
+
+    python -m benchmarks.run                 # run and compare
+    python -m benchmarks.run -k Dispatch     # only matching benchmarks
+    python -m benchmarks.run --save          # record a new baseline
+
+Saving replaces the baseline for every benchmark the run covered (all of
+them, or those matching -k), so ones that have been removed are dropped.
+
+Absolute times depend on the machine, so each run also times a fixed
+pure-python loop and the comparison is made on times relative to that.
+A benchmark more than --tolerance slower than its baseline is reported
+as a regression and the exit status is 1.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import sys
+import timeit
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+
+def calibrate():
+    def loop():
+        d = {}
+        for i in range(1000):
+            d[i % 10] = d.get(i % 10, 0) + i
+        return d
+    return measure(loop)
+
+
+def measure(fn, repeat=5):
+    """Returns the best time for one call of `fn`, in seconds."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def discover(pattern=None):
+    """Yields (name, callable) for each benchmark, with its class set up."""
+    import benchmarks
+    for info in pkgutil.iter_modules(benchmarks.__path__):
+        if not info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + info.name)
+        for cls_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            methods = sorted(m for m in dir(cls) if m.startswith('time_'))
+            if not methods:
+                continue
+            params = getattr(cls, 'params', None)
+            if params is None:
+                combos = [()]
+            elif params and isinstance(params[0], (list, tuple)):
+                combos = list(itertools.product(*params))
+            else:
+                combos = [(p,) for p in params]
+            for combo in combos:
+                suffix = "({})".format(", ".join(map(str, combo))) if combo else ""
+                names = ["{}.{}.{}{}".format(info.name[6:], cls_name, m, suffix) for m in methods]
+                if pattern and not any(pattern in n for n in names):
+                    continue
+                instance = cls()
+                try:
+                    if hasattr(instance, 'setup'):
+                        instance.setup(*combo)
+                except NotImplementedError:
+                    # asv's convention for "can't run here"
+                    for name in names:
+                        yield name, None
+                    continue
+                for name, m in zip(names, methods):
+                    if pattern and pattern not in name:
+                        continue
+                    method = getattr(instance, m)
+                    yield name, (lambda method=method, combo=combo: method(*combo))
+                if hasattr(instance, 'teardown'):
+                    instance.teardown(*combo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('-k', metavar='PATTERN', help='only run benchmarks whose name contains PATTERN')
+    parser.add_argument('--save', action='store_true', help='write the results to baseline.json')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower than the baseline counts as a regression (default 0.25)')
+    parser.add_argument('--baseline', default=BASELINE)
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    unit = calibrate()
+    results = {}
+    skipped = set()
+    regressions = []
+    print("calibration loop: {:.1f}us".format(unit * 1e6))
+    for name, fn in discover(args.k):
+        if fn is None:
+            print("{:<55} skipped".format(name))
+            skipped.add(name)
+            continue
+        t = measure(fn)
+        results[name] = t / unit
+        line = "{:<55} {:>10.2f}us".format(name, t * 1e6)
+        base = baseline.get('results', {}).get(name)
+        if base:
+            change = results[name] / base - 1
+            line += "  {:+.0%}".format(change)
+            if change > args.tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        # results from before are kept for benchmarks that were skipped here
+        # or left out by -k; any others that weren't run no longer exist
+        old = baseline.get('results', {})
+        merged = {k: v for k, v in old.items() if k in skipped or (args.k and args.k not in k)}
+        dropped = sorted(set(old) - set(merged) - set(results))
+        merged.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'unit': 'calibration loops', 'results': merged}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("saved {} results to {}".format(len(results), args.baseline))
+        if dropped:
+            print("dropped {} that no longer exist: {}".format(len(dropped), ", ".join(dropped)))
+
+    if regressions:
+        print("{} benchmark{} regressed by more than {:.0%}: {}".format(
+            len(regressions), "" if len(regressions) == 1 else "s", args.tolerance, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(HERE))
+    sys.exit(main())
@@ -1,36 +1,76 @@
+import bisect
 import inspect
-import itertools
 import sys
 import time
 import json
 
-from twisted.internet import reactor, task
-from twisted.internet.defer import succeed, maybeDeferred
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.python.failure import Failure
+
+from ..scheduler import Scheduler
 
 
 class _EventArg:
-    def __init__(self, default=None, required=False):
+    """An event argument. Values live in a slot on the event instance (see
+    EventMetaclass). If `lazy` names a method, an unset argument is filled in
+    by calling that method the first time it's read. If `normalize` is given,
+    values that are set are passed through it first."""
+
+    def __init__(self, default=None, required=False, lazy=None, normalize=None):
         self.default = default
         self.required = required
+        self.lazy = lazy
+        self.normalize = normalize
+        self.member = None
 
     def __get__(self, instance, owner):
         if instance is None:
             return self
-        return instance._args.get(self, self.default)
+        try:
+            return self.member.__get__(instance, owner)
+        except AttributeError:
+            if self.lazy is None:
+                return self.default
+        value = getattr(instance, self.lazy)()
+        self.member.__set__(instance, value)
+        return value
 
     def __set__(self, instance, value):
-        instance._args[self] = value
+        if self.normalize is not None:
+            value = self.normalize(value)
+        self.member.__set__(instance, value)
+
+    def setter(self):
+        """What Event.__init__ sets this argument with: the slot itself,
+        unless there's normalizing to do."""
+        return self.member if self.normalize is None else self
 
 
 class EventMetaclass(type):
+    def __new__(mcs, name, bases, dict_):
+        # give every argument declared on this class a slot to store its value in
+        args = [n for n, v in dict_.items() if isinstance(v, _EventArg)]
+        dict_['__slots__'] = tuple(dict_.get('__slots__', ())) + tuple('_arg_' + n for n in args)
+        return type.__new__(mcs, name, bases, dict_)
+
     def __init__(cls, name, bases, dict_):
+        for n, v in dict_.items():
+            if isinstance(v, _EventArg):
+                v.member = cls.__dict__['_arg_' + n]
         cls._contains = [n for n, v in inspect.getmembers(cls)
                          if isinstance(v, _EventArg)]
         cls._requires = [n for n in cls._contains if getattr(cls, n).required]
-        return type.__init__(cls, name, bases, dict)
+        cls._allowed = frozenset(cls._contains)
+        cls._members = {n: getattr(cls, n).setter() for n in cls._contains}
+        return type.__init__(cls, name, bases, dict_)
 
 
 class Event(metaclass=EventMetaclass):
+    # events keep a __dict__ so handlers can still hang extra attributes
+    # off them (e.g. event.handled); arguments themselves use slots
+    __slots__ = ('__dict__',)
+
     Arg = _EventArg
 
     EAT = 1
@@ -39,19 +79,21 @@ class Event(metaclass=EventMetaclass):
     doc = ''
 
     def __init__(self, d={}, **args):
-        args.update(d)
-        self._args = {}
-
-        missing = set(self._requires) - set(args.keys())
-        excess = set(args.keys()) - set(self._contains)
-        if missing:
-            raise Exception("Event type {} missing argument(s): {}"
-                            .format(self.__class__.__name__, ", ".join(missing)))
-        elif excess:
+        if d:
+            args.update(d)
+
+        for k in self._requires:
+            if k not in args:
+                missing = [k for k in self._requires if k not in args]
+                raise Exception("Event type {} missing argument(s): {}"
+                                .format(self.__class__.__name__, ", ".join(missing)))
+        if not self._allowed.issuperset(args):
+            excess = set(args) - self._allowed
             raise Exception("Event type {} got extraneous argument(s): {}"
                             .format(self.__class__.__name__, ", ".join(excess)))
+        members = self._members
         for k, v in args.items():
-            setattr(self, k, v)
+            members[k].__set__(self, v)
 
         self.setup()
 
@@ -124,68 +166,77 @@ EventPriority._HIGH   = EventPriority(70)
 
 
 class EventList:
+    """The handlers registered for one event type, highest priority first.
+
+    The handlers are kept in a tuple that is never modified in place: adding
+    or removing a handler builds a new tuple. A dispatch iterates over the
+    tuple it started with, so handlers can be (un)registered during dispatch
+    without copying the list for every event."""
+
     def __init__(self):
-        self._cache = None
         self._i = 0
-        self._istack = []
-        self._handlers = {}
+        self._handlers = ()
+        self._keys = ()
 
     def _invalidate(self):
-        self._cache = None
-
-    def _build_cache(self):
-        def key(i):
-            return i[1][0].priority
-        handlers = itertools.groupby(sorted(self._handlers.items(),
-                                            key=key,
-                                            reverse=True), key)
-        handlers = (l for group, l in handlers)
-        handlers = ((i,) + h for l in handlers for i, (p, h) in l)
-        self._cache = list(handlers)
-
-    def _get_cache(self):
-        if self._cache is None:
-            self._build_cache()
-        return self._cache
+        pass
 
     def _newid(self):
-        if self._istack:
-            return self._istack.pop()
-        else:
-            self._i += 1
-            return self._i
+        self._i += 1
+        return self._i
 
     def __iter__(self):
-        return (h for h in self.cache)
+        return iter(self._handlers)
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def select(self, event):
+        return iter(self._handlers)
 
     @property
-    def cache(self):
-        return list(self._get_cache())
+    def handlers(self):
+        return self._handlers
 
     def add_handler(self, priority, *a):
-        self._invalidate()
         i = self._newid()
-        self._handlers[i] = (priority, a)
+        # keys are negated priorities, so bisect_right puts the new handler
+        # after everything of the same priority
+        key = -priority.priority
+        index = bisect.bisect_right(self._keys, key)
+        self._handlers = self._handlers[:index] + ((i,) + a,) + self._handlers[index:]
+        self._keys = self._keys[:index] + (key,) + self._keys[index:]
+        self._invalidate()
         return i
 
     def remove_handler(self, id_):
-        assert id_ in self._handlers, "{} is not registered".format(id_)
+        for index, handler in enumerate(self._handlers):
+            if handler[0] == id_:
+                break
+        else:
+            raise AssertionError("{} is not registered".format(id_))
+        self._handlers = self._handlers[:index] + self._handlers[index + 1:]
+        self._keys = self._keys[:index] + self._keys[index + 1:]
         self._invalidate()
-        del self._handlers[id_]
-        self._istack.append(id_)
+
+Event.handler_list = EventList
 
 
 class EventDispatcher:
-    def __init__(self, error_handler):
+    def __init__(self, error_handler, clock=reactor):
         self.registered = {}
         self.error_handler = error_handler
+        self.scheduler = Scheduler(clock)
+        self.profiler = None
+        # the (event, callback) being run right now, for the watchdog
+        self.current = None
 
     def get(self, event_type):
         return self.registered.get(event_type, [])
 
     def register(self, callback, event_type, priority=None, **prefilter_args):
         if not event_type in self.registered:
-            self.registered[event_type] = EventList()
+            self.registered[event_type] = event_type.handler_list()
         d = self.registered[event_type]
 
         if priority is None:
@@ -213,19 +264,36 @@ class EventDispatcher:
         self.registered[event_type].remove_handler(id_)
 
     def _next_event(self, event, iter_, handled=False):
-        while True:
+        # handlers are called directly, one after the other; we only drop
+        # into a Deferred chain when a handler actually returns a Deferred
+        for id_, callback, args in iter_:
+            if not event.prefilter(**args):
+                continue
+            handled = True
+            outer, self.current = self.current, (event, callback)
             try:
-                id_, callback, args = next(iter_)
-            except StopIteration:
-                return succeed(handled)
-            if event.prefilter(**args):
-                break
-        r = maybeDeferred(callback, event)
-        # add them in this order so _done_event will still be called
-        # if there's an error
-        r.addErrback(self._event_errback, event, callback)
-        r.addCallback(self._done_event, event, id_, iter_)
-        return r
+                r = callback(event)
+            except Exception:
+                self.error_handler(event, callback, Failure())
+                continue
+            finally:
+                self.current = outer
+            if r is None:
+                continue
+            if inspect.iscoroutine(r):
+                r = Deferred.fromCoroutine(r)
+            if isinstance(r, Deferred):
+                # add them in this order so _done_event will still be called
+                # if there's an error
+                r.addErrback(self._event_errback, event, callback)
+                r.addCallback(self._done_event, event, id_, iter_)
+                return r
+            if type(r) is int:
+                if r & Event.UNREGISTER:
+                    self.registered[event.__class__].remove_handler(id_)
+                if r & Event.EAT:
+                    return succeed(True)
+        return succeed(handled)
 
     def _event_errback(self, failure, event, callback):
         self.error_handler(event, callback, failure)
@@ -239,26 +307,47 @@ class EventDispatcher:
         return self._next_event(event, iter_, True)
 
     def dispatch(self, event):
-        event_list = iter(self.get(event.__class__))
-        d = self._next_event(event, event_list)
+        event_list = self.registered.get(event.__class__)
+        if event_list is None:
+            event_list = iter(())
+        else:
+            event_list = event_list.select(event)
+            if self.profiler is not None:
+                event_list = self.profiler.wrap(event, event_list)
+        try:
+            d = self._next_event(event, event_list)
+        except Exception:
+            d = fail()
         d.addErrback(self._event_errback, event, self.dispatch)
         return d
     
-    def dispatch_delayed(self, event, delay):
-        t = reactor.callLater(delay, lambda: self.dispatch(event))
-        return t
-    
-    def dispatch_repeating(self, event, interval, now=False):
-        t = task.LoopingCall(lambda: self.dispatch(event))
-        t.start(interval, now)
-        return t
+    def dispatch_delayed(self, event, delay, **kw):
+        kw.setdefault('name', event.__class__.__name__)
+        return self.scheduler.call_later(delay, self.dispatch, event, **kw)
+
+    def dispatch_repeating(self, event, interval, now=False, **kw):
+        kw.setdefault('name', event.__class__.__name__)
+        return self.scheduler.call_repeating(interval, self.dispatch, event, now=now, **kw)
+
+
+_timestamp_cache = (None, None, None)
 
 
-def get_timestamp(t=None):
+def get_timestamp(t=None, now=None):
+    # formatting the date is the expensive part, and it only changes once a
+    # second, so keep the last result around. `now` is a time.time() to use
+    # instead of the current one
+    global _timestamp_cache
+    now = int(time.time() if now is None else now)
+    if now != _timestamp_cache[0]:
+        now_struct = time.localtime(now)
+        _timestamp_cache = (now,
+                            time.strftime("%Y-%m-%d %H:%M:%S", now_struct),
+                            time.strftime("%Y-%m-%d ", now_struct))
     if t is None:
-        return time.strftime("%Y-%m-%d %H:%M:%S")
+        return _timestamp_cache[1]
     elif len(t) == 8:
-        return time.strftime("%Y-%m-%d ") + t
+        return _timestamp_cache[2] + t
     else:
         return t
 
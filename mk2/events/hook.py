@@ -1,4 +1,73 @@
-from . import Event
+import bisect
+
+from . import Event, EventList
+
+
+class HookEventList(EventList):
+    """Handler list for Hook.
+
+    A hook is only ever dispatched by name, so handlers are indexed by name
+    and a dispatch only visits the handlers for that name. Public hooks
+    (~commands) are also kept in a table sorted by name, for help and prefix
+    lookup. Only commands registered with readonly=True, which don't change
+    anything, can be run by a prefix of their name."""
+
+    def __init__(self):
+        EventList.__init__(self)
+        self._ids = {}
+        self._index = {}
+        self._commands = None
+        self._readonly = None
+
+    def add_handler(self, priority, callback, args):
+        id_ = EventList.add_handler(self, priority, callback, args)
+        self._ids[id_] = (args['name'], args.get('public', False))
+        self._reindex(*self._ids[id_])
+        return id_
+
+    def remove_handler(self, id_):
+        EventList.remove_handler(self, id_)
+        self._reindex(*self._ids.pop(id_))
+
+    def _reindex(self, name, public):
+        handlers = tuple(h for h in self._handlers if h[2]['name'] == name)
+        if handlers:
+            self._index[name] = handlers
+        else:
+            self._index.pop(name, None)
+        if public:
+            self._commands = None
+
+    def select(self, event):
+        return iter(self._index.get(event.name, ()))
+
+    def commands(self, prefix=''):
+        """Returns (name, doc) for each public hook whose name starts with
+        `prefix`, sorted by name."""
+        if self._commands is None:
+            commands = {}
+            readonly = {}
+            for _, _, args in self._handlers:
+                if args.get('public', False):
+                    commands.setdefault(args['name'], args.get('doc') or '')
+                    readonly[args['name']] = readonly.get(args['name'], True) and args.get('readonly', False)
+            self._commands = tuple(sorted(commands.items()))
+            self._readonly = readonly
+        i = bisect.bisect_left(self._commands, (prefix,))
+        j = i
+        while j < len(self._commands) and self._commands[j][0].startswith(prefix):
+            j += 1
+        return list(self._commands[i:j])
+
+    def lookup(self, prefix):
+        """Returns the name of the command `prefix` is short for, or None,
+        and the names of all the commands it could be short for."""
+        if not prefix:
+            return None, []
+        matches = [name for name, _ in self.commands(prefix)]
+        if len(matches) == 1 and self._readonly[matches[0]]:
+            return matches[0], matches
+        return None, matches
 
 
 class Hook(Event):
@@ -6,6 +75,8 @@ class Hook(Event):
     is_command = Event.Arg()
     args       = Event.Arg()
     line       = Event.Arg()
+
+    handler_list = HookEventList
     
     def setup(self):
         if not self.name:
@@ -17,7 +88,7 @@ class Hook(Event):
                 if len(t) == 2:
                     self.args = t[1]
     
-    def prefilter(self, name, public=False, doc=None):
+    def prefilter(self, name, public=False, doc=None, readonly=False):
         if name != self.name:
             return False
         
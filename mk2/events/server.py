@@ -1,11 +1,139 @@
 import re
+import time
 
-from . import Event, get_timestamp
+from . import Event, EventList, get_timestamp
 
 # input/output
 output_exp = re.compile(
         r'^(?:\W|\[1G|\[K|)+(?:\d{4}-\d{2}-\d{2} |)\[?(\d{2}:\d{2}:\d{2})\]? \[?(?:[^\]]+?/|)([A-Z]+)\]:?\s*(.*)')
 
+
+_special = frozenset('.^$*+?{}[]\\|()')
+_quantifiers = frozenset('*+?{')
+
+
+def _has_branch(pattern):
+    """Return True if `pattern` has a `|` outside of any group or class."""
+    depth = 0
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif c == '[':
+            # skip the class; a leading ] or ^] is literal
+            i += 1
+            if i < n and pattern[i] == '^':
+                i += 1
+            if i < n and pattern[i] == ']':
+                i += 1
+            while i < n and pattern[i] != ']':
+                if pattern[i] == '\\':
+                    i += 1
+                i += 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def _literal_run(pattern, i):
+    """Collect the plain characters in `pattern` starting at `i`, stopping at
+    the first one that isn't guaranteed to match itself exactly once."""
+    out = []
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= n or pattern[i + 1].isalnum():
+                break
+            c, step = pattern[i + 1], 2
+        elif c in _special:
+            break
+        else:
+            step = 1
+        if i + step < n and pattern[i + step] in _quantifiers:
+            break
+        out.append(c)
+        i += step
+    return ''.join(out)
+
+
+def literal_screen(pattern):
+    """Work out a cheap test that every string `pattern` matches (with
+    re.match) must pass. Returns (prefix, substring), at most one of which
+    is non-empty: the match must start with `prefix`, or contain
+    `substring` somewhere."""
+    if _has_branch(pattern):
+        return '', ''
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    for lead in ('.*?', '.+?', '.*', '.+'):
+        if pattern.startswith(lead):
+            return '', _literal_run(pattern, len(lead))
+    return _literal_run(pattern, 0), ''
+
+
+class PatternEventList(EventList):
+    """Handler list for ServerOutput.
+
+    Patterns are compiled once when a handler is registered. Each one also
+    gets a literal prefix (or required substring) that is checked with plain
+    string operations before its regex ever runs, and handlers are grouped
+    by level and by the first character of their prefix, so a line only
+    visits the handlers that could possibly match it."""
+
+    def __init__(self):
+        EventList.__init__(self)
+        self._screens = {}
+        self._selections = {}
+
+    def _invalidate(self):
+        self._selections = {}
+
+    def add_handler(self, priority, callback, args):
+        pattern = args['pattern']
+        if isinstance(pattern, str):
+            prefix, substring = literal_screen(pattern)
+            pattern = re.compile(pattern)
+        else:
+            prefix, substring = '', ''
+        args = dict(args, pattern=pattern)
+        id_ = EventList.add_handler(self, priority, callback, args)
+        self._screens[id_] = (args.get('level'), prefix, substring)
+        return id_
+
+    def remove_handler(self, id_):
+        EventList.remove_handler(self, id_)
+        del self._screens[id_]
+
+    def _build_selection(self, level, first):
+        selection = []
+        for handler in self._handlers:
+            h_level, prefix, substring = self._screens[handler[0]]
+            if h_level and h_level != level:
+                continue
+            if prefix[:1] not in ('', first):
+                continue
+            selection.append((prefix, substring, handler))
+        return tuple(selection)
+
+    def select(self, event):
+        data = event.stripped
+        key = (event.level, data[:1])
+        selection = self._selections.get(key)
+        if selection is None:
+            if len(self._selections) > 1024:
+                self._selections = {}
+            selection = self._selections[key] = self._build_selection(*key)
+        return (handler for prefix, substring, handler in selection
+                if data.startswith(prefix) and substring in data)
+
+
 class ServerInput(Event):
     """Send data to the server's stdin. In plugins, a shortcut
     is available: self.send("say hello")"""
@@ -16,31 +144,53 @@ class ServerInput(Event):
 class ServerOutput(Event):
     """Issued when the server gives us a line on stdout. Note
     that to handle this, you must specify both the 'level'
-    (e.g. INFO or SEVERE) and a regex pattern to match"""
+    (e.g. INFO or SEVERE) and a regex pattern to match. If
+    continuation lines (e.g. a stack trace) were folded into
+    this event, they are in 'lines'; patterns only see 'line'"""
+
+    __slots__ = ('match', '_groups', '_stripped', '_now')
     
     line  = Event.Arg(required=True)
-    time  = Event.Arg()
-    level = Event.Arg()
-    data  = Event.Arg()
-    
+    time  = Event.Arg(lazy='_parse_time', normalize=get_timestamp)
+    level = Event.Arg(lazy='_parse_level')
+    data  = Event.Arg(lazy='_parse_data')
+    lines = Event.Arg(default=())
+
+    handler_list = PatternEventList
+
+    # time, level and data are only parsed out of the line when something
+    # reads them, but the time is when the line came in
     def setup(self):
-        m = output_exp.match(self.line)
-        if m:
-            g = m.groups()
-            self.time = g[0]
-            self.level= g[1]
-            self.data = g[2]
-        else:
-            self.level= "RAW"
-            self.data = self.line
-        
-        self.time = get_timestamp(self.time)
+        self._groups = None
+        self._stripped = None
+        self._now = time.time()
+
+    def _parse(self):
+        if self._groups is None:
+            m = output_exp.match(self.line)
+            self._groups = m.groups() if m else (None, "RAW", self.line)
+        return self._groups
+
+    def _parse_time(self):
+        return get_timestamp(self._parse()[0], self._now)
+
+    def _parse_level(self):
+        return self._parse()[1]
+
+    def _parse_data(self):
+        return self._parse()[2]
+
+    @property
+    def stripped(self):
+        if self._stripped is None:
+            self._stripped = self.data.strip()
+        return self._stripped
     
     def prefilter(self, pattern, level=None):
         if level and level != self.level:
             return False
         
-        m = re.match(pattern, self.data.strip())
+        m = re.match(pattern, self.stripped)
         if not m:
             return False
         
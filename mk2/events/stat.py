@@ -20,3 +20,10 @@ class StatPlayers(StatEvent):
 class StatProcess(StatEvent):
     cpu    = Event.Arg(required=True)
     memory = Event.Arg(required=True)
+
+
+#provider: watchdog
+class StatLag(StatEvent):
+    lag     = Event.Arg(required=True)
+    handler = Event.Arg()
+    stack   = Event.Arg()
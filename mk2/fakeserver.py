@@ -0,0 +1,281 @@
+"""
+A stand-in for a Minecraft server, for load testing mark2 without a server
+jar. It prints vanilla or Paper style log lines at a steady rate: joins,
+quits, chat, deaths, lag warnings and the occasional stack trace. It
+answers the usual console commands on stdin, and the legacy server list
+ping on the port in server.properties.
+
+To have mark2 run it instead of java, in the server's mark2.properties:
+
+    mark2.service.process.java-path=python3 -m mk2.fakeserver
+    mark2.service.process.server-args=--rate 10000
+    mark2.jar-path=fakeserver.jar
+
+JVM options, -jar and nogui are accepted and ignored. Run it once with
+--make-jar fakeserver.jar to write a jar containing a language file, so
+mark2 picks up the same death messages the fake server prints.
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import time
+import zipfile
+
+from twisted.internet import reactor, stdio, task
+from twisted.internet.protocol import Factory, Protocol
+from twisted.protocols.basic import LineReceiver
+
+
+VERSION = "1.20.1"
+
+DEATHS = {
+    "death.attack.arrow": "%1$s was shot by %2$s",
+    "death.attack.drown": "%1$s drowned",
+    "death.attack.explosion.player": "%1$s was blown up by %2$s",
+    "death.attack.fall": "%1$s hit the ground too hard",
+    "death.attack.inFire": "%1$s went up in flames",
+    "death.attack.lava": "%1$s tried to swim in lava",
+    "death.attack.mob": "%1$s was slain by %2$s",
+    "death.attack.player.item": "%1$s was slain by %2$s using %3$s",
+    "death.attack.starve": "%1$s starved to death",
+    "death.fell.accident.generic": "%1$s fell from a high place",
+}
+
+MOBS = ("Zombie", "Skeleton", "Creeper", "Spider", "Enderman", "Witch")
+ITEMS = ("Excalibur", "Stabby", "Sharpness5", "Bonk")
+WORDS = ("hello", "anyone", "want", "to", "trade", "diamonds", "lag", "base",
+         "where", "is", "the", "nether", "portal", "lol", "brb", "gg")
+
+STACK_TRACE = ["java.lang.NullPointerException: Cannot invoke \"Object.toString()\" because \"value\" is null"] + \
+              ["\tat com.example.plugin.Listener.onEvent{0}(Listener.java:{1})".format(i, 40 + i) for i in range(20)] + \
+              ["Caused by: java.lang.IllegalStateException: not ready",
+               "\tat com.example.plugin.Plugin.check(Plugin.java:12)",
+               "\t... 20 more"]
+
+
+def format_death(template, **names):
+    for i, k in enumerate(("username", "killer", "weapon")):
+        template = template.replace("%{}$s".format(i + 1), names.get(k, ""))
+    return template
+
+
+class FakeServer:
+    def __init__(self, rate=100, duration=0, style='vanilla', max_players=20, port=25565, seed=None):
+        self.rate = rate
+        self.duration = duration
+        self.style = style
+        self.max_players = max_players
+        self.port = port
+        self.random = random.Random(seed)
+        self.names = ["Player{}".format(i) for i in range(max_players * 2)]
+        self.online = []
+        self.saving = True
+        self.started = None
+        self.emitted = 0
+        self.out = None
+        self.loop = None
+        self.stopping = False
+
+    def line(self, message, level='INFO', thread='Server thread'):
+        t = time.strftime("%H:%M:%S")
+        if self.style == 'paper':
+            return "[{} {}]: {}".format(t, level, message)
+        return "[{}] [{}/{}]: {}".format(t, thread, level, message)
+
+    def write(self, lines):
+        self.out.write(("\n".join(lines) + "\n").encode('utf8'))
+
+    def start(self, out):
+        self.out = out
+        started = time.time()
+        self.write([
+            self.line("Starting minecraft server version {}".format(VERSION)),
+            self.line("Loading properties"),
+            self.line("Default game type: SURVIVAL"),
+            self.line("Starting Minecraft server on *:{}".format(self.port)),
+            self.line("Preparing level \"world\"")] +
+            [self.line("Preparing spawn area: {}%".format(p)) for p in range(0, 100, 10)] +
+            [self.line("Done ({:.3f}s)! For help, type \"help\"".format(time.time() - started + 1.5))])
+        self.started = time.time()
+
+        # write in batches every 10ms so high rates don't need a call per line
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.start(0.01)
+
+    def tick(self):
+        if self.duration and time.time() - self.started >= self.duration:
+            return self.stop()
+        due = int((time.time() - self.started) * self.rate) - self.emitted
+        if due > 0:
+            lines = []
+            while len(lines) < due:
+                lines.extend(self.activity())
+            self.emitted += len(lines)
+            self.write(lines)
+
+    def activity(self):
+        r = self.random.random()
+        name = self.random.choice(self.online) if self.online else None
+        if r < 0.08 or not self.online:
+            return self.join()
+        if r < 0.14:
+            return self.quit(name)
+        if r < 0.55:
+            words = " ".join(self.random.choice(WORDS) for _ in range(self.random.randint(1, 8)))
+            return [self.line("<{}> {}".format(name, words), thread='Async Chat Thread - #0')]
+        if r < 0.65:
+            key = self.random.choice(sorted(DEATHS))
+            return [self.line(format_death(DEATHS[key], username=name,
+                                           killer=self.random.choice(MOBS + tuple(self.online)),
+                                           weapon=self.random.choice(ITEMS)))]
+        if r < 0.72:
+            return [self.line("{} moved wrongly!".format(name), level='WARN')]
+        if r < 0.80:
+            behind = self.random.randint(2000, 9000)
+            return [self.line("Can't keep up! Is the server overloaded? Running {}ms or {} ticks behind"
+                              .format(behind, behind // 50), level='WARN')]
+        if r < 0.81:
+            return [self.line("Could not pass event PlayerMoveEvent to ExamplePlugin v1.0", level='ERROR')] + STACK_TRACE
+        return [self.line("[ExamplePlugin] Saved {} regions".format(self.random.randint(1, 500)))]
+
+    def join(self):
+        offline = [n for n in self.names if n not in self.online]
+        if not offline or len(self.online) >= self.max_players:
+            return self.quit(self.random.choice(self.online))
+        name = self.random.choice(offline)
+        self.online.append(name)
+        return [self.line("UUID of player {} is {:032x}".format(name, self.random.getrandbits(128)), thread='User Authenticator #1'),
+                self.line("{}[/127.0.0.1:{}] logged in with entity id {} at (0.5, 64.0, 0.5)".format(
+                    name, self.random.randint(40000, 60000), self.random.randint(1, 99999))),
+                self.line("{} joined the game".format(name))]
+
+    def quit(self, name):
+        self.online.remove(name)
+        return [self.line("{} lost connection: Disconnected".format(name)),
+                self.line("{} left the game".format(name))]
+
+    def command(self, line):
+        cmd, _, args = line.strip().partition(" ")
+        if cmd == 'stop':
+            return self.stop()
+        if cmd == 'save-off':
+            self.saving = False
+            o = ["Automatic saving is now disabled"]
+        elif cmd == 'save-on':
+            self.saving = True
+            o = ["Automatic saving is now enabled"]
+        elif cmd == 'save-all':
+            o = ["Saving the game (this may take a moment!)", "Saved the game"]
+        elif cmd == 'list':
+            o = ["There are {} of a max of {} players online: {}".format(
+                len(self.online), self.max_players, ", ".join(self.online))]
+        elif cmd == 'say':
+            o = ["[Server] {}".format(args)]
+        elif cmd == '':
+            return
+        else:
+            o = ["Unknown or incomplete command, see below for error"]
+        self.write([self.line(m) for m in o])
+
+    def stop(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        if self.loop and self.loop.running:
+            self.loop.stop()
+        self.write([self.line("Stopping the server"),
+                    self.line("Stopping server"),
+                    self.line("Saving players"),
+                    self.line("Saving worlds"),
+                    self.line("ThreadedAnvilChunkStorage: All dimensions are saved")])
+        reactor.callLater(0, reactor.stop)
+
+
+class ConsoleProtocol(LineReceiver):
+    delimiter = b'\n'
+
+    def __init__(self, server):
+        self.server = server
+
+    def connectionMade(self):
+        self.server.start(self.transport)
+
+    def lineReceived(self, line):
+        self.server.command(line.decode('utf8', 'replace'))
+
+    def connectionLost(self, reason):
+        # mark2 went away; a real server would keep going, but we're done
+        if not self.server.stopping:
+            self.server.stopping = True
+            if reactor.running:
+                reactor.stop()
+
+
+class LegacyPingProtocol(Protocol):
+    """Answers the pre-1.7 server list ping (0xFE 0x01)."""
+
+    def dataReceived(self, data):
+        if data[:1] != b'\xfe':
+            self.transport.loseConnection()
+            return
+        server = self.factory.server
+        fields = ["\xa71", "127", VERSION, "A Minecraft Server",
+                  str(len(server.online)), str(server.max_players)]
+        payload = "\x00".join(fields).encode('utf-16be')
+        self.transport.write(b'\xff' + struct.pack('>h', len(payload) // 2) + payload)
+        self.transport.loseConnection()
+
+
+def read_server_properties(path='server.properties'):
+    props = {}
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and line[0] not in '#!' and '=' in line:
+                    k, v = line.split('=', 1)
+                    props[k.strip()] = v.strip()
+    return props
+
+
+def make_jar(path):
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('assets/minecraft/lang/en_us.json', json.dumps(DEATHS, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mk2.fakeserver', allow_abbrev=False)
+    parser.add_argument('--rate', type=float, default=100, help='lines per second after startup')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds (0: run until stopped)')
+    parser.add_argument('--style', choices=('vanilla', 'paper'), default='vanilla')
+    parser.add_argument('--max-players', type=int, default=20)
+    parser.add_argument('--port', type=int, help='port to answer pings on (default: server.properties; 0 to disable)')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--make-jar', metavar='PATH', help='write a jar with a language file for mark2 to read, and exit')
+    # anything else (jvm options, -jar, nogui) is what mark2 would pass to java
+    args, _ = parser.parse_known_args(argv)
+
+    if args.make_jar:
+        make_jar(args.make_jar)
+        return 0
+
+    props = read_server_properties()
+    port = args.port if args.port is not None else int(props.get('server-port') or 25565)
+    server = FakeServer(args.rate, args.duration, args.style, args.max_players, port, args.seed)
+
+    if port:
+        factory = Factory.forProtocol(LegacyPingProtocol)
+        factory.server = server
+        reactor.listenTCP(port, factory, interface=props.get('server-ip') or '127.0.0.1')
+
+    stdio.StandardIO(ConsoleProtocol(server))
+    reactor.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
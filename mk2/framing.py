@@ -0,0 +1,136 @@
+"""
+The framed form of the attach protocol, which a client can ask for in its
+attach packet instead of newline-delimited json:
+
+    {"type": "attach", "user": "...", "framing": {"compact": true, "zlib": true}}
+
+The server answers with one last json line,
+
+    {"type": "framing", "compact": true, "zlib": true}
+
+and everything it sends after that is frames: a big-endian uint32 length,
+then a json packet of that length. With "zlib" the frames are one zlib
+stream, flushed after every write so nothing waits on the next one. With
+"compact", console lines are sent as arrays of their values in the order of
+FIELDS, rather than objects with the same key names on every line:
+
+    console packet      [seq, time, source, kind, level, user, line, data, class_name, {extras}]
+    scrollback line     [time, source, kind, level, user, line, data, class_name, {extras}]
+
+`data` is null when it's the same as `line`, and the trailing object, with
+any other keys, is left off if there aren't any. Everything else the server
+sends is still a json object, and what the client sends is unchanged.
+"""
+
+import json
+import struct
+import zlib
+
+
+FIELDS = ('time', 'source', 'kind', 'level', 'user', 'line', 'data', 'class_name')
+header = struct.Struct('>I')
+MAX_FRAME = 1 << 26
+
+
+def pack(line):
+    """Returns a console line (a dict, as Console.serialize gives) as the
+    list of its values."""
+    values = [line.get(f) for f in FIELDS]
+    if values[6] == values[5]:
+        values[6] = None
+    extras = {k: v for k, v in line.items() if k not in FIELDS}
+    if extras:
+        values.append(extras)
+    return values
+
+
+def unpack(values):
+    line = dict(zip(FIELDS, values))
+    if line.get('data') is None:
+        line['data'] = line.get('line')
+    if len(values) > len(FIELDS):
+        line.update(values[len(FIELDS)])
+    return line
+
+
+def compact_line(line):
+    """A console line (a dict, as Console.serialize gives) as compact json.
+    The user server does this once per line, as it arrives, so sending it
+    to a client is just a join."""
+    return json.dumps(pack(line), separators=(',', ':')).encode("utf-8")
+
+
+def compact_console(seq, line):
+    """A console packet, from its sequence number and its compact_line."""
+    return b'[' + (b'null' if seq is None else str(seq).encode()) + b',' + line[1:]
+
+
+def pack_console(packet):
+    """A console packet's json, as compact json."""
+    line = json.loads(packet.decode("utf-8"))
+    del line['type']
+    seq = line.pop('seq', None)
+    return compact_console(seq, compact_line(line))
+
+
+def expand(packet):
+    """The other end of the compact encoding: returns a packet as the
+    client would have got it in plain json."""
+    if isinstance(packet, list):
+        line = unpack(packet[1:])
+        line['type'] = 'console'
+        if packet[0] is not None:
+            line['seq'] = packet[0]
+        return line
+    if packet.get('type') == 'scrollback':
+        packet['lines'] = [unpack(l) if isinstance(l, list) else l for l in packet['lines']]
+    return packet
+
+
+def frame(payload):
+    return header.pack(len(payload)) + payload
+
+
+class Framer:
+    """The sending end of a connection."""
+
+    def __init__(self, compact=False, compress=False):
+        self.compact = compact
+        self.compressor = zlib.compressobj() if compress else None
+
+    def encode(self, data):
+        """Returns framed data ready to write, compressed if need be. Each
+        call is flushed, so it can be decoded without waiting for more."""
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Deframer:
+    """The receiving end of a connection: feed it data as it comes in, and
+    get back the packets that are complete."""
+
+    def __init__(self, compressed=False):
+        self.decompressor = zlib.decompressobj() if compressed else None
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        buffer = self.buffer
+        buffer += data
+        packets = []
+        i = 0
+        while len(buffer) - i >= header.size:
+            length, = header.unpack_from(buffer, i)
+            if length > MAX_FRAME:
+                raise ValueError("frame of {} bytes is too long".format(length))
+            end = i + header.size + length
+            if end > len(buffer):
+                break
+            packets.append(expand(json.loads(buffer[i + header.size:end].decode("utf-8"))))
+            i = end
+        # only whole frames are taken off the front, so a frame that comes
+        # in many pieces is only copied as it grows
+        del buffer[:i]
+        return packets
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from twisted.python import log
+
+
+class LangCache:
+    """Keeps the death messages parsed out of a server jar (or language
+    file) on disk, so they're only parsed once per jar rather than on every
+    start. Entries are named after a hash of the jar's contents, so servers
+    running the same jar share them; an index from each jar's path, size
+    and mtime to its hash saves re-hashing a jar that hasn't changed.
+
+    The cache lives in the shared path, which other users can write to, so
+    it's stored as gzipped json rather than anything that could run code
+    when it's loaded."""
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self, name):
+        try:
+            with gzip.open(os.path.join(self.path, name), 'rt', encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, EOFError, ValueError):
+            return None
+
+    def _write(self, name, data):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.' + name)
+            with gzip.open(os.fdopen(fd, 'wb'), 'wt', encoding='utf8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, os.path.join(self.path, name))
+        except OSError as e:
+            log.msg("couldn't write to the language cache: {}".format(e), system="mark2")
+
+    def digest(self, source):
+        """Returns the hash of `source`'s contents, which only has to be
+        worked out when its size or mtime has changed."""
+        source = os.path.realpath(source)
+        st = os.stat(source)
+        stamp = [st.st_size, st.st_mtime_ns]
+        index = self._read('index.json.gz')
+        if not isinstance(index, dict):
+            index = {}
+        entry = index.get(source)
+        if entry and entry[:2] == stamp:
+            return entry[2]
+
+        h = hashlib.sha1()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        index[source] = stamp + [h.hexdigest()]
+        # forget jars that have gone away
+        index = {k: v for k, v in index.items() if os.path.exists(k)}
+        self._write('index.json.gz', index)
+        return h.hexdigest()
+
+    def deaths(self, source, load):
+        """Returns the death messages for `source`, as Lang.get_deaths
+        would, calling `load` to parse it if they aren't cached. `load`
+        returns a Lang or None, in which case None is returned."""
+        try:
+            name = "{}.json.gz".format(self.digest(source))
+        except OSError:
+            lang = load()
+            return None if lang is None else list(lang.get_deaths())
+
+        entry = self._read(name)
+        if isinstance(entry, dict) and entry.get('version') == self.version:
+            deaths = entry.get('deaths')
+            return None if deaths is None else [(k, tuple(v)) for k, v in deaths]
+
+        lang = load()
+        deaths = None if lang is None else list(lang.get_deaths())
+        self._write(name, {'version': self.version, 'deaths': deaths})
+        return deaths
@@ -9,6 +9,7 @@ from twisted.python import log, logfile
 #mark2 things
 from . import events, plugins, properties
 from .events import EventPriority
+from .profiler import DispatchProfiler
 from .services import process
 from .shared import find_config, open_resource
 
@@ -43,6 +44,9 @@ class Manager(object):
             self.shutdown()
 
     def before_reactor_stop(self):
+        if self.events.profiler is not None:
+            for line in self.events.profiler.report(self.config['mark2.profile.top']):
+                log.msg(line, system="mark2")
         self.console("mark2 stopped.")
 
     def really_start(self):
@@ -70,6 +74,10 @@ class Manager(object):
         #start logging
         self.start_logging()
 
+        #start profiling
+        if self.config['mark2.profile.enabled']:
+            self.events.profiler = DispatchProfiler(self.config['mark2.profile.sample'])
+
         #chmod log and pid
         for ext in ('log', 'pid'):
             os.chmod(os.path.join(self.shared_path, "%s.%s" % (self.server_name, ext)), self.config.get_umask(ext))
@@ -178,14 +186,22 @@ class Manager(object):
     
     def send(self, line):
         self.events.dispatch(events.ServerInput(line=line))
+
+    def spawn_process(self, protocol, cmd):
+        return reactor.spawnProcess(protocol, cmd[0], cmd, env=None)
             
     #handlers
     def handle_server_output(self, event):
+        line, data = event.line, event.data
+        if event.lines:
+            rest = "\n".join(event.lines)
+            line = "{}\n{}".format(line, rest)
+            data = "{}\n{}".format(data, rest)
         self.events.dispatch(events.Console(source='server',
-                                            line=event.line,
+                                            line=line,
                                             time=event.time,
                                             level=event.level,
-                                            data=event.data))
+                                            data=data))
 
     def handle_console(self, event):
         for line in event.value().split("\n"):
@@ -214,9 +230,24 @@ class Manager(object):
     def handle_user_input(self, event):
         self.console(event.line, user=event.user, source="user")
         if event.line.startswith("~") or event.line.startswith("."):
-            handled = yield self.events.dispatch(events.Hook(line=event.line))
+            hook = events.Hook(line=event.line)
+            handled = yield self.events.dispatch(hook)
             if not handled:
-                self.console("unknown command.")
+                hooks = self.events.get(events.Hook)
+                name, matches = hooks.lookup(hook.name) if hooks else (None, [])
+                if name:
+                    yield self.events.dispatch(events.Hook(name=name,
+                                                           is_command=True,
+                                                           args=hook.args,
+                                                           line=event.line))
+                elif len(matches) == 1:
+                    # it might not be what they meant, and it changes things
+                    self.console("unknown command, did you mean ~{}?".format(matches[0]))
+                elif matches:
+                    self.console("ambiguous command, did you mean: {}".format(
+                        ", ".join("~" + name for name in matches)))
+                else:
+                    self.console("unknown command.")
         elif event.line.startswith('#'):
             pass
         else:
@@ -5,7 +5,6 @@ import pkg_resources
 import traceback
 import sys
 
-from twisted.internet import reactor
 
 from ..events import Hook, ServerInput, ServerStarted, ServerStopping
 
@@ -140,7 +139,6 @@ class Plugin(metaclass=PluginMetaclass):
         self.dispatch_delayed   = self.parent.events.dispatch_delayed
         self.dispatch_repeating = self.parent.events.dispatch_repeating
         
-        self._tasks = []
         self._events = []
         self._services = []
 
@@ -209,31 +207,33 @@ class Plugin(metaclass=PluginMetaclass):
         [setattr(self, k, v) for k, v in state.items()]
     
     def delayed_task(self, callback, delay, name=None):
-        hook = self._task(callback, name)
-        t = self.parent.events.dispatch_delayed(hook, delay)
-        t._stop = t.cancel
-        t._active = t.active
-        self._tasks.append(t)
+        hook, ident = self._task(callback, name)
+        return self.parent.events.dispatch_delayed(hook, delay, name=self._task_name(callback, name),
+                                                          owner=self, on_done=lambda: self._untask(ident))
 
     def repeating_task(self, callback, interval, name=None, now=False):
-        hook = self._task(callback, name)
-        t = self.parent.events.dispatch_repeating(hook, interval, now=now)
-        t._stop = t.stop
-        t._active = lambda: t.running
-        self._tasks.append(t)
+        hook, ident = self._task(callback, name)
+        return self.parent.events.dispatch_repeating(hook, interval, now=now, name=self._task_name(callback, name),
+                                                            owner=self, on_done=lambda: self._untask(ident))
     
     def _task(self, callback, name=None):
         if name is None:
             name = id(callback)
         hook = Hook(name=name)
-        self.parent.events.register(callback, Hook, name=name)
-        return hook
+        ident = self.register(callback, Hook, name=name)
+        return hook, ident
+
+    def _untask(self, ident):
+        if ident in self._events:
+            self.unregister(ident)
+
+    def _task_name(self, callback, name=None):
+        if name is None:
+            name = getattr(callback, '__name__', 'task')
+        return "{}.{}".format(self.name, name)
 
     def stop_tasks(self):
-        for t in self._tasks:
-            if t._active():
-                t._stop()
-        self._tasks = []
+        self.parent.events.scheduler.cancel_owner(self)
         
     def send(self, l):
         self.dispatch(ServerInput(line=l))
@@ -257,13 +257,12 @@ class Plugin(metaclass=PluginMetaclass):
                 self.console("Skipping cancelling of already cancelled or called event")
         
         def action_chain_i(i_name, i_delay, i_action):
-            t = reactor.callLater(i_delay, i_action) 
+            t = self.parent.events.scheduler.call_later(i_delay, i_action,
+                                                         name=self._task_name(callbackWarn),
+                                                         owner=self)
             callbackWarn(i_name)
             
-            t._stop = t.cancel
-            t._active = t.active
             delayed_call[0] = t
-            self._tasks.append(t)
         
         lastAction = callbackAction
         lastTime   = 0
@@ -33,6 +33,8 @@ class Log(Plugin):
             self.log += "{} {}\n".format(event.time, m.group(1))
         else:
             self.log += "{}\n".format(event.line)
+        for line in event.lines:
+            self.log += "{}\n".format(line)
     
     def logger(self, event):
         self.log += "{}\n".format(event.value())
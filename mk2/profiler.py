@@ -0,0 +1,114 @@
+import time
+
+
+class HandlerStats:
+    __slots__ = ('event', 'handler', 'offered', 'calls', 'total', 'max')
+
+    def __init__(self, event, handler):
+        self.event = event
+        self.handler = handler
+        self.offered = 0
+        self.calls = 0
+        self.total = 0
+        self.max = 0
+
+    @property
+    def reject_rate(self):
+        if not self.offered:
+            return 0.0
+        return 1 - self.calls / self.offered
+
+
+class _Timed:
+    """Stands in for a handler's callback during a sampled dispatch and
+    times it. Only the synchronous part of a handler is measured."""
+
+    __slots__ = ('stats', 'callback')
+
+    def __init__(self, stats, callback):
+        self.stats = stats
+        self.callback = callback
+
+    def __repr__(self):
+        return repr(self.callback)
+
+    def __call__(self, event):
+        start = time.perf_counter_ns()
+        try:
+            return self.callback(event)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            stats = self.stats
+            stats.calls += 1
+            stats.total += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+
+
+def describe(callback):
+    if isinstance(callback, _Timed):
+        # what the watchdog sees while a sampled dispatch is running
+        callback = callback.callback
+    name = getattr(callback, '__qualname__', None) or repr(callback)
+    plugin = getattr(getattr(callback, '__self__', None), 'name', None)
+    if isinstance(plugin, str):
+        return "{}:{}".format(plugin, name)
+    return name
+
+
+class DispatchProfiler:
+    """Records, per event type and handler, how often the handler was
+    offered an event, how often its prefilter let it through, and how long
+    it took. Only one in every `sample` dispatches is measured; the rest go
+    through untouched, so this is cheap enough to leave on."""
+
+    def __init__(self, sample=1):
+        self.sample = max(1, sample)
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+        self.dispatches = 0
+        self.countdown = self.sample
+        self.started = time.time()
+
+    def wrap(self, event, handlers):
+        self.countdown -= 1
+        if self.countdown:
+            return handlers
+        self.countdown = self.sample
+        self.dispatches += 1
+        return self._wrap(event.__class__, handlers)
+
+    def _wrap(self, event_type, handlers):
+        # keyed by what the handler is rather than its id, which changes
+        # every time it's registered again
+        for id_, callback, args in handlers:
+            key = (event_type, describe(callback))
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = HandlerStats(event_type.__name__, key[1])
+            stats.offered += 1
+            yield id_, _Timed(stats, callback), args
+
+    def top(self, n=10):
+        return sorted(self.stats.values(), key=lambda s: s.total, reverse=True)[:n]
+
+    def report(self, n=10):
+        o = ["dispatch profile: {} sampled dispatches (1 in {}) over {:.0f}s".format(
+            self.dispatches, self.sample, time.time() - self.started)]
+        top = self.top(n)
+        if not top:
+            return o
+        width = max(len(s.event) + len(s.handler) for s in top) + 1
+        o.append("{} | {:>7} | {:>6} | {:>9} | {:>8} | {:>8}".format(
+            "handler".ljust(width), "calls", "reject", "total ms", "mean us", "max ms"))
+        for s in top:
+            o.append("{} | {:>7} | {:>5.0%} | {:>9.1f} | {:>8.1f} | {:>8.2f}".format(
+                (s.event + " " + s.handler).ljust(width),
+                s.calls,
+                s.reject_rate,
+                s.total / 1e6,
+                s.total / s.calls / 1e3 if s.calls else 0,
+                s.max / 1e6))
+        return o
@@ -8,15 +8,74 @@ from functools import reduce
 from collections import OrderedDict
 
 
+# path -> (stamp, _Parsed) for every file load() has read, and
+# (cls, paths) -> (stamps, Properties) for the last result of each load()
+_parsed = {}
+_snapshots = {}
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _read(path, stamp, f=None):
+    cached = _parsed.get(path)
+    if cached is not None and cached[0] == stamp:
+        if f is not None:
+            f.close()
+        return cached[1]
+    if f is None:
+        with open(path) as f:
+            parsed = _Parsed.read(f)
+    else:
+        parsed = _Parsed.read(f)
+    _parsed[path] = (stamp, parsed)
+    return parsed
+
+
 def load(cls, *files):
-    o = None
+    """Loads each file in turn on top of the ones before it, skipping paths
+    that don't exist. A file object (e.g. a resource) starts again from
+    scratch. Files are only parsed again once they've changed, and if none
+    of them has the same object is returned, so it's read-only."""
+    layers = []
     for f in files:
         if isinstance(f, str):
-            if os.path.isfile(f):
-                with open(f) as f:
-                    o = cls(f, o)
+            path = os.path.abspath(f)
+            layers.append((path, _stamp(path), None))
+        else:
+            name = getattr(f, 'name', None)
+            path = os.path.abspath(name) if isinstance(name, str) else None
+            layers.append((path, _stamp(path) if path else None, f))
+
+    key = (cls, tuple(path for path, _, _ in layers))
+    stamps = tuple(stamp for _, stamp, _ in layers)
+    cacheable = all(path is not None for path, _, _ in layers)
+    if cacheable:
+        cached = _snapshots.get(key)
+        if cached is not None and cached[0] == stamps:
+            for _, _, f in layers:
+                if f is not None:
+                    f.close()
+            return cached[1]
+
+    o = None
+    for path, stamp, f in layers:
+        if f is None:
+            if stamp is not None:
+                o = cls(_read(path, stamp), o)
+        elif stamp is not None:
+            o = cls(_read(path, stamp, f), 0)
         else:
             o = cls(f, 0)
+    if cacheable:
+        _snapshots[key] = (stamps, o)
     return o
 
 
@@ -33,12 +92,177 @@ def load_jar(jar, *path):
     return None
 
 
+_escapes = {'t': '\t', 'n': '\n', 'r': '\r', 'f': '\f'}
+_whitespace = ' \t\f'
+_int = re.compile(r'^\-?\d+$')
+_special = re.compile(r'[\\:= \t\f]')
+
+
+def _unescape(inp):
+    """Handles backslash escapes in a key or value."""
+    i = inp.find('\\')
+    if i == -1:
+        return inp
+    out = []
+    start = 0
+    while i != -1:
+        out.append(inp[start:i])
+        c = inp[i + 1:i + 2]
+        if not c:
+            raise ValueError("Invalid escape sequence in input: %s" % inp)
+        if c in _escapes:
+            out.append(_escapes[c])
+            start = i + 2
+        elif c == 'u':
+            b = inp[i + 2:i + 6]
+            if len(b) < 4:
+                raise ValueError("Invalid escape sequence in input: %s" % inp)
+            out.append(chr(int(b, 16)))
+            start = i + 6
+        else:
+            out.append(c)
+            start = i + 2
+        i = inp.find('\\', start)
+    out.append(inp[start:])
+    return ''.join(out)
+
+
+def _backslashes(line, i):
+    """Returns the length of the run of backslashes starting at line[i]."""
+    j = i
+    while line[j:j + 1] == '\\':
+        j += 1
+    return j - i
+
+
+def _separator(line):
+    """Returns the start and end of the first unescaped separator in a
+    logical line: '=' or ':' with any whitespace before it, or a run of
+    whitespace. Whitespace after the separator is left on the value, and
+    an even run of backslashes next to it counts as part of it, as it did
+    with the regex this replaces."""
+    n = len(line)
+    p = 0
+    while True:
+        m = _special.search(line, p)
+        if m is None:
+            return None
+        p = q = m.start()
+        if line[p] == '\\':
+            r = _backslashes(line, p)
+            if r % 2:
+                # the character after an odd run is escaped
+                p += r + 1
+                continue
+            q = p + r
+            if q == n:
+                return None
+        c = line[q]
+        if c in ':=':
+            return p, q + 1
+        if c in _whitespace:
+            w = q + 1
+            while w < n and line[w] in _whitespace:
+                w += 1
+            r = _backslashes(line, w)
+            if r % 2 == 0 and w + r < n and line[w + r] in ':=' + _whitespace:
+                return p, w + r + 1
+            return p, w
+        p = q + 1
+
+
+def _logical_lines(d):
+    """Yields each logical line that isn't blank or a comment, with line
+    continuations joined up. Leading whitespace (and so blank lines) is
+    dropped from every line but the first."""
+    pieces = d.split('\n')
+    last = len(pieces) - 1
+    parts = None
+    head = None
+    for i, piece in enumerate(pieces):
+        if i:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+        if parts is None:
+            parts = []
+            head = piece
+        if i == last:
+            # no newline after this one, so it can't continue
+            parts.append(piece)
+            continued = False
+        else:
+            r = len(piece) - len(piece.rstrip('\\'))
+            parts.append(piece[:len(piece) - r])
+            continued = r % 2 == 1
+        if continued:
+            continue
+        if len(parts) == 1:
+            head = parts[0]
+        if head and head[0] not in '#!':
+            yield ''.join(parts)
+        parts = None
+    if parts is not None and head[0] not in '#!':
+        yield ''.join(parts)
+
+
+class _Parsed:
+    """The keys and values read from a file, before their types are worked
+    out (which depends on the files loaded before it)."""
+
+    __slots__ = ('pairs', 'json')
+
+    def __init__(self, pairs, json=False):
+        self.pairs = pairs
+        self.json = json
+
+    @classmethod
+    def read(cls, f):
+        # Try to load the file as json
+        if f.name.endswith(".json"):
+            try:
+                _json = json.load(f)
+                print("Loaded properties from input file as json")
+                f.close()
+                return cls(list(_json.items()), json=True)
+            except json.JSONDecodeError:
+                pass
+
+        if f.mode == "rb":
+            d = f.read().decode('utf-8')
+        else:
+            d = f.read()
+        f.close()
+
+        #Deal with Windows / Mac OS linebreaks
+        d = d.replace('\r\n', '\n')
+        d = d.replace('\r', '\n')
+
+        pairs = []
+        for line in _logical_lines(d):
+            #Split into k,v
+            sep = _separator(line)
+            if sep is None:
+                k, v = line, ""
+            else:
+                k, v = line[:sep[0]], line[sep[1]:]
+
+            k = _unescape(k).replace('-', '_')
+            pairs.append((k, _unescape(v)))
+        return cls(pairs)
+
+
 class Properties(OrderedDict):
+    _frozen = False
+
     def __init__(self, f, parent=None):
         OrderedDict.__init__(self)
+        # skip the read-only check while loading
+        setitem = OrderedDict.__setitem__
 
         if parent:
-            self.update(parent)
+            for k, v in parent.items():
+                setitem(self, k, v)
             self.types = OrderedDict(parent.types)
         else:
             self.types = {}
@@ -49,104 +273,58 @@ class Properties(OrderedDict):
             'string': lambda a: a
         }
 
-        c_seperator  = (':', '=')
-        c_whitespace = (' ', '\t', '\f')
-        c_escapes    = ('t','n','r','f')
-        c_comment    = ('#','!')
-
-        r_unescaped  = '(?<!\\\\)(?:\\\\\\\\)*'
-        r_whitespace = '[' + re.escape(''.join(c_whitespace)) + ']*'
-        r_seperator  = r_unescaped + r_whitespace + r_unescaped + '[' + re.escape(''.join(c_seperator + c_whitespace)) + ']'
-
-        #This handles backslash escapes in keys/values
-        def parse(inp):
-            token = list(inp)
-            out = ""
-            while len(token) > 0:
-                c = token.pop(0)
-                if c == '\\':
-                    try:
-                        c = token.pop(0)
-                        if c in c_escapes:
-                            out += ('\\' + c).encode('latin1') \
-                                             .decode('unicode-escape') \
-                                             .encode('latin1') \
-                                             .decode('utf-8')
-                        elif c == 'u':
-                            b = ""
-                            for i in range(4):
-                                b += token.pop(0)
-                            out += chr(int(b, 16))
-                            uni = True
-                        else:
-                            out += c
-                    except IndexError:
-                        raise ValueError("Invalid escape sequence in input: %s" % inp)
+        parsed = f if isinstance(f, _Parsed) else _Parsed.read(f)
+        if parsed.json:
+            for k, v in parsed.pairs:
+                setitem(self, k, v)
+        else:
+            for k, v in parsed.pairs:
+                if _int.match(v):
+                    ty = 'int'
+                elif v in ('true', 'false'):
+                    ty = 'bool'
+                elif v != '':
+                    ty = 'string'
+                elif k in self.types:
+                    ty = self.types[k]
                 else:
-                    out += c
+                    ty = 'string'
 
-            return out
-        
-        # Try to load the file as json
-        if f.name.endswith(".json"):
-            try:
-                _json = json.load(f)
-                for k, v in _json.items():
-                    self[k] = v
-                print("Loaded properties from input file as json")
-                f.close()
-                return
-            except json.JSONDecodeError:
-                pass
-        
-        if f.mode == "rb":
-            d = f.read().decode('utf-8')
-        else:
-            d = f.read()
+                self.types[k] = ty
+                setitem(self, k, decoder[ty](v))
+        self._frozen = True
 
-        #Deal with Windows / Mac OS linebreaks
-        d = d.replace('\r\n', '\n')
-        d = d.replace('\r', '\n')
-        #Strip leading whitespace
-        d = re.sub('(?m)\n\\s*', '\n', d)
-        #Split logical lines
-        d = re.split('(?m)' + r_unescaped + '\n', d)
-
-        for line in d:
-            #Strip comments and empty lines
-            if line == '' or line[0] in c_comment:
-                continue
+    def _check(self):
+        if self._frozen:
+            raise TypeError("{} can't be changed once loaded".format(self.__class__.__name__))
 
-            #Strip escaped newlines
-            line = re.sub('(?m)' + r_unescaped + '(\\\\\n)', '', line)
-            assert not '\n' in line
+    def __setitem__(self, k, v):
+        self._check()
+        OrderedDict.__setitem__(self, k, v)
 
-            #Split into k,v
-            x = re.split(r_seperator, line, maxsplit=1)
+    def __delitem__(self, k):
+        self._check()
+        OrderedDict.__delitem__(self, k)
 
-            #No seperator, parse as empty value.
-            if len(x) == 1:
-                k, v = x[0], ""
-            else:
-                k, v = x
-
-            k = parse(k).replace('-', '_')
-            v = parse(v)
-
-            if re.match(r'^\-?\d+$', v):
-                ty = 'int'
-            elif v in ('true', 'false'):
-                ty = 'bool'
-            elif v != '':
-                ty = 'string'
-            elif k in self.types:
-                ty = self.types[k]
-            else:
-                ty = 'string'
+    def update(self, *a, **k):
+        self._check()
+        OrderedDict.update(self, *a, **k)
 
-            self.types[k] = ty
-            self[k] = decoder[ty](v)
-        f.close()
+    def setdefault(self, k, default=None):
+        self._check()
+        return OrderedDict.setdefault(self, k, default)
+
+    def pop(self, *a):
+        self._check()
+        return OrderedDict.pop(self, *a)
+
+    def popitem(self, last=True):
+        self._check()
+        return OrderedDict.popitem(self, last)
+
+    def clear(self):
+        self._check()
+        OrderedDict.clear(self)
 
     def get_by_prefix(self, prefix):
         for k, v in self.items():
@@ -155,51 +333,69 @@ class Properties(OrderedDict):
 
 
 class Mark2Properties(Properties):
-    def get_plugins(self):
-        plugins = {}
-        enabled = []
-        for k, v in self.items():
-            m = re.match(r'^plugin\.(.+)\.(.+)$', k)
-            if m:
-                plugin, k2 = m.groups()
-                
-                if plugin not in plugins:
-                    plugins[plugin] = {}
-                
-                if k2 == 'enabled':
-                    if v:
-                        enabled.append(plugin)
-                else:
-                    plugins[plugin][k2] = v
+    _namespaces = None
+
+    def _index(self):
+        # a loaded config can't change, so it only needs splitting up by
+        # namespace once
+        if self._namespaces is None:
+            plugins = {}
+            enabled = []
+            services = {}
+            jvm = []
+            for k, v in self.items():
+                if k.startswith('plugin.'):
+                    m = re.match(r'^plugin\.(.+)\.(.+)$', k)
+                    if m:
+                        plugin, k2 = m.groups()
+
+                        if plugin not in plugins:
+                            plugins[plugin] = {}
+
+                        if k2 == 'enabled':
+                            if v:
+                                enabled.append(plugin)
+                        else:
+                            plugins[plugin][k2] = v
+                elif k.startswith('mark2.service.'):
+                    service, dot, k2 = k[14:].partition('.')
+                    if dot:
+                        services.setdefault(service, []).append((k2, v))
+                elif k.startswith('java.cli.'):
+                    m = re.match(r'^java\.cli\.([^\.]+)\.(.+)$', k)
+                    if m:
+                        jvm.append(m.groups() + (v,))
+            self._namespaces = ([(n, plugins[n]) for n in sorted(enabled)], services, jvm)
+        return self._namespaces
 
-        return [(n, plugins[n]) for n in sorted(enabled)]
+    def get_plugins(self):
+        return [(n, dict(c)) for n, c in self._index()[0]]
 
     def get_service(self, service):
-        return self.get_by_prefix('mark2.service.{}.'.format(service))
+        if '.' in service:
+            return self.get_by_prefix('mark2.service.{}.'.format(service))
+        return iter(self._index()[1].get(service, ()))
 
     def get_jvm_options(self):
         options = []
         if self.get('java.cli_prepend', '') != '':
             options.extend(shlex.split(self['java.cli_prepend']))
-        for k, v in self.items():
-            m = re.match(r'^java\.cli\.([^\.]+)\.(.+)$', k)
-            if m:
-                a, b = m.groups()
-                if a == 'D':
-                    if type(v) == bool:
-                        v = str(v).lower()
-                    options.append('-D%s=%s' % (b, v))
-                elif a == 'X':
-                    if type(v) == bool:
-                        v = str(v).lower()
-                    options.append('-X%s%s' % (b, v))
-                elif a == 'XX':
-                    if type(v) == bool:
-                        options.append('-XX:%s%s' % ('+' if v else '-', b))
-                    else:
-                        options.append('-XX:%s=%s' % (b, v))
+        for a, b, v in self._index()[2]:
+            if a == 'D':
+                if type(v) == bool:
+                    v = str(v).lower()
+                options.append('-D%s=%s' % (b, v))
+            elif a == 'X':
+                if type(v) == bool:
+                    v = str(v).lower()
+                options.append('-X%s%s' % (b, v))
+            elif a == 'XX':
+                if type(v) == bool:
+                    options.append('-XX:%s%s' % ('+' if v else '-', b))
                 else:
-                    print("Unknown JVM option type: {}".format(a))
+                    options.append('-XX:%s=%s' % (b, v))
+            else:
+                print("Unknown JVM option type: {}".format(a))
         if self.get('java.cli_extra', '') != '':
             options.extend(shlex.split(self['java.cli_extra']))
         return options
@@ -236,12 +432,12 @@ class ClientProperties(Properties):
 
 class Lang(Properties):
     def get_deaths(self):
-        seen = []
+        seen = set()
         for k, v in self.get_by_prefix('death.'):
             if v not in seen:
-                seen.append(v)
+                seen.add(v)
                 regex = reduce(lambda a, r: a.replace(*r),
-                               ((r"\%{}\$s".format(i + 1),
+                               ((re.escape("%{}$s".format(i + 1)),
                                  "(?P<{0}>[A-Za-z0-9]{{1,32}})".format(x))
                                 for i, x in enumerate(("username", "killer", "weapon"))),
                                re.escape(v))
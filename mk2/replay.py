@@ -0,0 +1,261 @@
+"""
+Record the raw output of a server session, and replay it through a real
+Manager to measure how fast mark2 gets through it.
+
+A recording is a gzipped stream of frames, one per chunk of output the
+server wrote: the time since the previous chunk in milliseconds and the
+chunk's length (both big-endian uint32), followed by the chunk itself.
+
+    python -m mk2.replay play session.mk2r [--config mark2.properties] [--speed N] [--json]
+    python -m mk2.replay from-log server.log session.mk2r [--rate N]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+
+from twisted.internet import reactor, error
+from twisted.python.failure import Failure
+
+from . import events, properties
+from .manager import Manager
+from .shared import open_resource
+
+
+MAGIC = b'mk2replay 1\n'
+frame = struct.Struct('>II')
+
+
+class Recorder:
+    def __init__(self, path, clock=time.monotonic):
+        self.clock = clock
+        self.last = clock()
+        self.f = gzip.open(path, 'wb')
+        self.f.write(MAGIC)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf8')
+        now = self.clock()
+        delay = int((now - self.last) * 1000)
+        self.last = now
+        self.f.write(frame.pack(delay, len(data)))
+        self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+
+def read_frames(path):
+    """Yields (delay in seconds, data) for each frame of a recording."""
+    with gzip.open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} isn't a mark2 recording".format(path))
+        while True:
+            header = f.read(frame.size)
+            if len(header) < frame.size:
+                return
+            delay, length = frame.unpack(header)
+            yield delay / 1000.0, f.read(length)
+
+
+def from_log(log_path, path, rate=0):
+    """Makes a recording from a plain log file, one line per frame, `rate`
+    lines a second (or all at once if rate is 0)."""
+    delay = 1.0 / rate if rate else 0
+    t = [0.0]
+    recorder = Recorder(path, clock=lambda: t[0])
+    with open(log_path, 'rb') as f:
+        for line in f:
+            t[0] += delay
+            recorder.write(line)
+    recorder.close()
+
+
+class ReplayTransport:
+    """Plays a recording into a ProcessProtocol in place of a real server
+    process, `speed` times faster than it was recorded (0 = no waiting)."""
+
+    def __init__(self, protocol, frames, speed=0):
+        self.protocol = protocol
+        self.frames = frames
+        self.speed = speed
+        self.written = []
+        self.pid = os.getpid()
+        self.call = None
+        self.ended = False
+
+    def start(self):
+        self.protocol.makeConnection(self)
+        self.next_frame()
+
+    def next_frame(self):
+        self.call = None
+        for delay, data in self.frames:
+            if self.speed and delay:
+                self.call = reactor.callLater(delay / self.speed, self.feed, data)
+            else:
+                self.call = reactor.callLater(0, self.feed, data)
+            return
+        self.end()
+
+    def feed(self, data):
+        self.protocol.childDataReceived(1, data)
+        self.next_frame()
+
+    def end(self, reason=None):
+        if self.ended:
+            return
+        self.ended = True
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        if reason is None:
+            reason = error.ProcessDone(0)
+        self.protocol.processEnded(Failure(reason))
+
+    def write(self, data):
+        self.written.append(data)
+        # a replayed server can't stop early, so do it at the next turn
+        if data.strip() in (b'stop', b'end'):
+            reactor.callLater(0, self.end)
+
+    def signalProcess(self, signal):
+        reactor.callLater(0, self.end, error.ProcessTerminated(signal=signal))
+
+    def loseConnection(self):
+        pass
+
+
+class ReplayManager(Manager):
+    """A Manager that runs in a scratch directory and gets its server output
+    from a recording instead of a java process. The time spent dispatching
+    each ServerOutput is recorded in `latencies` (seconds)."""
+
+    def __init__(self, recording, config=None, speed=0):
+        self.scratch = tempfile.mkdtemp(prefix='mk2replay-')
+        server_path = os.path.join(self.scratch, 'server')
+        os.mkdir(server_path)
+        jar_file = os.path.join(server_path, 'server.jar')
+        zipfile.ZipFile(jar_file, 'w').close()
+        open(os.path.join(server_path, 'server.properties'), 'w').close()
+        with open(os.path.join(server_path, 'mark2.properties'), 'w') as f:
+            f.write("mark2.service.ping.enabled=false\n")
+        open(os.path.join(self.scratch, 'replay.pid'), 'w').close()
+
+        Manager.__init__(self, self.scratch, 'replay', server_path, jar_file)
+        self.recording = recording
+        self.config_path = config
+        self.speed = speed
+        self.latencies = []
+        self.started_at = None
+        self.finished_at = None
+
+    def load_config(self):
+        self.config = properties.load(properties.Mark2Properties,
+                                      open_resource('resources/mark2.default.properties'),
+                                      self.config_path or '',
+                                      'mark2.properties')
+
+    def spawn_process(self, protocol, cmd):
+        dispatch = protocol.dispatch
+        latencies = self.latencies
+        clock = time.perf_counter
+
+        def timed_dispatch(event):
+            if event.__class__ is not events.ServerOutput:
+                return dispatch(event)
+            start = clock()
+            d = dispatch(event)
+            latencies.append(clock() - start)
+            return d
+
+        protocol.dispatch = timed_dispatch
+        transport = ReplayTransport(protocol, read_frames(self.recording), self.speed)
+        self.started_at = time.perf_counter()
+        reactor.callLater(0, transport.start)
+        return transport
+
+    def handle_server_stopped(self, event):
+        self.finished_at = time.perf_counter()
+        return Manager.handle_server_stopped(self, event)
+
+    def results(self):
+        latencies = sorted(self.latencies)
+        elapsed = (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6
+
+        return {
+            'lines': len(latencies),
+            'seconds': elapsed,
+            'lines_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_us': percentile(0.50),
+            'p99_us': percentile(0.99),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def cleanup(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mk2.replay')
+    sub = parser.add_subparsers(dest='command')
+
+    play = sub.add_parser('play', help='replay a recording through mark2 and report throughput')
+    play.add_argument('recording')
+    play.add_argument('--config', help='a mark2.properties with the plugins to load')
+    play.add_argument('--speed', type=float, default=0, help='replay speed; 0 is as fast as possible')
+    play.add_argument('--json', action='store_true', help='print the results as json')
+    play.add_argument('--keep', action='store_true', help="don't delete the scratch directory (with mark2's log)")
+
+    convert = sub.add_parser('from-log', help='make a recording from a log file')
+    convert.add_argument('log')
+    convert.add_argument('recording')
+    convert.add_argument('--rate', type=float, default=0, help='lines per second; 0 is all at once')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("a command is required: play or from-log")
+
+    if args.command == 'from-log':
+        from_log(args.log, args.recording, args.rate)
+        return 0
+
+    # mark2's logging takes over stdout once it starts
+    stdout = sys.stdout
+    cwd = os.getcwd()
+    recording = os.path.abspath(args.recording)
+    config = os.path.abspath(args.config) if args.config else None
+    mgr = ReplayManager(recording, config, args.speed)
+    try:
+        reactor.callWhenRunning(mgr.startup)
+        reactor.run()
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            mgr.cleanup()
+
+    results = mgr.results()
+    if args.json:
+        print(json.dumps(results), file=stdout)
+    else:
+        print("{lines} lines in {seconds:.2f}s: {lines_per_second:.0f} lines/s, "
+              "dispatch p50 {p50_us:.1f}us p99 {p99_us:.1f}us, peak rss {peak_rss_kb} KB".format(**results),
+              file=stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
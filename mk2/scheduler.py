@@ -0,0 +1,161 @@
+import heapq
+import itertools
+
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class Task:
+    """A handle on a call scheduled with Scheduler. It can be used like the
+    DelayedCall (active/cancel/getTime) or LoopingCall (running/stop) it
+    replaces."""
+
+    def __init__(self, scheduler, when, interval, callback, args, kwargs, name, owner, on_done):
+        self.scheduler = scheduler
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name
+        self.owner = owner
+        self.on_done = on_done
+        self.cancelled = False
+        self.finished = False
+
+    def __repr__(self):
+        return "<Task {!r} at {}>".format(self.name, self.when)
+
+    def active(self):
+        return not (self.cancelled or self.finished)
+
+    @property
+    def running(self):
+        return self.active()
+
+    def getTime(self):
+        return self.when
+
+    def cancel(self):
+        if self.active():
+            self.cancelled = True
+            self.scheduler._done(self)
+
+    stop = cancel
+
+
+class Scheduler:
+    """Runs every delayed and repeating call through one heap, with a single
+    reactor call armed for whichever is due first. Tasks can be named and
+    given an owner, so they can be listed and cancelled together."""
+
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._owners = {}
+        self._live = 0
+        self._call = None
+
+    def call_later(self, delay, callback, *args, name=None, owner=None, on_done=None, **kwargs):
+        return self._add(self.clock.seconds() + delay, None, callback, args, kwargs, name, owner, on_done)
+
+    def call_repeating(self, interval, callback, *args, now=False, name=None, owner=None, on_done=None, **kwargs):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        t = self._add(self.clock.seconds() + interval, interval, callback, args, kwargs, name, owner, on_done)
+        if now:
+            # like LoopingCall, the first call happens right away
+            self._call_task(t)
+        return t
+
+    def cancel_owner(self, owner):
+        for t in list(self._owners.get(owner, ())):
+            t.cancel()
+
+    def pending(self, owner=None):
+        """Returns the active tasks (optionally only those belonging to
+        `owner`), soonest first."""
+        tasks = [t for _, _, t in self._heap if t.active()]
+        if owner is not None:
+            tasks = [t for t in tasks if t.owner is owner]
+        return sorted(tasks, key=lambda t: t.when)
+
+    def __len__(self):
+        return self._live
+
+    def _add(self, when, interval, callback, args, kwargs, name, owner, on_done):
+        if name is None:
+            name = getattr(callback, '__qualname__', repr(callback))
+        t = Task(self, when, interval, callback, args, kwargs, name, owner, on_done)
+        self._live += 1
+        if owner is not None:
+            self._owners.setdefault(owner, set()).add(t)
+        self._push(t)
+        return t
+
+    def _push(self, t):
+        heapq.heappush(self._heap, (t.when, next(self._counter), t))
+        self._arm()
+
+    def _done(self, t):
+        self._live -= 1
+        if t.owner is not None:
+            owned = self._owners.get(t.owner)
+            if owned is not None:
+                owned.discard(t)
+                if not owned:
+                    del self._owners[t.owner]
+        # cancelled tasks are left in the heap and skipped when they come
+        # up; once they're the majority it's cheaper to rebuild it
+        if not self._live:
+            # nothing left to wait for, so the reactor call goes too
+            self._heap = []
+            self._arm()
+        elif len(self._heap) > 64 and self._live < len(self._heap) // 2:
+            self._heap = [e for e in self._heap if e[2].active()]
+            heapq.heapify(self._heap)
+        if t.on_done is not None:
+            t.on_done()
+
+    def _arm(self):
+        heap = self._heap
+        while heap and not heap[0][2].active():
+            heapq.heappop(heap)
+        if not heap:
+            if self._call is not None and self._call.active():
+                self._call.cancel()
+            self._call = None
+            return
+        when = heap[0][0]
+        if self._call is not None and self._call.active():
+            if self._call.getTime() <= when:
+                return
+            self._call.cancel()
+        self._call = self.clock.callLater(max(0, when - self.clock.seconds()), self._run)
+
+    def _call_task(self, t):
+        try:
+            t.callback(*t.args, **t.kwargs)
+        except Exception:
+            log.err(None, "scheduled task {!r} failed".format(t.name))
+
+    def _run(self):
+        self._call = None
+        now = self.clock.seconds()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, t = heapq.heappop(self._heap)
+            if not t.active():
+                continue
+            if t.interval is None:
+                t.finished = True
+            self._call_task(t)
+            if t.interval is None:
+                self._done(t)
+            elif t.active():
+                # keep the task's phase, skipping any intervals we missed
+                t.when += t.interval
+                if t.when <= now:
+                    t.when += t.interval * ((now - t.when) // t.interval + 1)
+                heapq.heappush(self._heap, (t.when, next(self._counter), t))
+        self._arm()
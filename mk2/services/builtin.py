@@ -5,13 +5,15 @@ from mk2.plugins import Plugin
 
 class Builtin(Plugin):
     def setup(self):
-        self.register(self.handle_cmd_help,          events.Hook, public=True, name="help", doc="displays this message")
-        self.register(self.handle_cmd_events,        events.Hook, public=True, name="events", doc="lists events")
-        self.register(self.handle_cmd_plugins,       events.Hook, public=True, name="plugins", doc="lists running plugins")
+        self.register(self.handle_cmd_help,          events.Hook, public=True, name="help", readonly=True, doc="displays this message")
+        self.register(self.handle_cmd_events,        events.Hook, public=True, name="events", readonly=True, doc="lists events")
+        self.register(self.handle_cmd_plugins,       events.Hook, public=True, name="plugins", readonly=True, doc="lists running plugins")
         self.register(self.handle_cmd_reload_plugin, events.Hook, public=True, name="reload-plugin", doc="reload a plugin")
         self.register(self.handle_cmd_rehash,        events.Hook, public=True, name="rehash", doc="reload config and any plugins that changed")
         self.register(self.handle_cmd_reload,        events.Hook, public=True, name="reload", doc="reload config and all plugins")
         self.register(self.handle_cmd_jar,           events.Hook, public=True, name="jar", doc="wrap a different server jar")
+        self.register(self.handle_cmd_tasks,         events.Hook, public=True, name="tasks", readonly=True, doc="lists scheduled tasks")
+        self.register(self.handle_cmd_profile,       events.Hook, public=True, name="profile", doc="shows the slowest event handlers [reset|top N]")
     
     def table(self, v):
         m = 0
@@ -22,11 +24,8 @@ class Builtin(Plugin):
             self.console(" ~{} | {}".format(name.ljust(m), doc))
 
     def handle_cmd_help(self, event):
-        o = []
-        for _, callback, args in self.parent.events.get(events.Hook):
-            if args.get('public', False):
-                o.append((args['name'], args.get('doc', '')))
-        
+        o = self.parent.events.get(events.Hook).commands()
+
         self.console("The following commands are available:")
         self.console("A \".\" can be used instead of \"~\".")
         self.table(o)
@@ -35,6 +34,38 @@ class Builtin(Plugin):
         self.console("The following events are available:")
         self.table([(n, c.doc) for n, c in events.get_all()])
 
+    def handle_cmd_tasks(self, event):
+        scheduler = self.parent.events.scheduler
+        now = scheduler.clock.seconds()
+        o = []
+        for t in scheduler.pending():
+            when = "in {:.0f}s".format(max(0, t.when - now))
+            if t.interval is not None:
+                when += ", every {:g}s".format(t.interval)
+            o.append((t.name, when))
+
+        if o:
+            self.console("The following tasks are scheduled:")
+            self.table(o)
+        else:
+            self.console("No tasks are scheduled.")
+
+    def handle_cmd_profile(self, event):
+        profiler = self.parent.events.profiler
+        if profiler is None:
+            self.console("profiling is disabled (mark2.profile.enabled)")
+            return
+
+        args = (event.args or "").split()
+        if args == ['reset']:
+            profiler.reset()
+            self.console("profile reset.")
+        elif not args or (len(args) == 2 and args[0] == 'top' and args[1].isdigit()):
+            for line in profiler.report(int(args[1]) if args else 10):
+                self.console(line)
+        else:
+            self.console("usage: ~profile [reset|top N]")
+
     def handle_cmd_plugins(self, events):
         self.console("These plugins are running: " + ", ".join(sorted(self.parent.plugins.keys())))
 
@@ -46,9 +77,14 @@ class Builtin(Plugin):
             self.console("unknown plugin.")
 
     def handle_cmd_rehash(self, event):
-        # make a dict of old and new plugin list
-        plugins_old = dict(self.parent.config.get_plugins())
+        # make a dict of old and new plugin list. if none of the config
+        # files have changed, load_config gives us the same config back
+        config_old = self.parent.config
         self.parent.load_config()
+        if self.parent.config is config_old:
+            self.console("config unchanged, no plugins reloaded.")
+            return
+        plugins_old = dict(config_old.get_plugins())
         plugins_new = dict(self.parent.config.get_plugins())
         # reload the union of old plugins and new plugins
         requires_reload = set(plugins_old.keys()) | set(plugins_new.keys())
@@ -56,12 +92,11 @@ class Builtin(Plugin):
         for k in list(requires_reload):
             if plugins_old.get(k, False) == plugins_new.get(k, False):
                 requires_reload.remove(k)
-        requires_reload = list(requires_reload)
+        requires_reload = sorted(requires_reload)
         # actually reload
         for p in requires_reload:
             self.parent.plugins.reload(p)
-        reloaded = filter(None, requires_reload)
-        self.console("{} plugins reloaded: {}".format(len(reloaded), ", ".join(reloaded)))
+        self.console("{} plugins reloaded: {}".format(len(requires_reload), ", ".join(requires_reload)))
 
     def handle_cmd_reload(self, event):
         self.parent.plugins.unload_all()
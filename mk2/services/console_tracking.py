@@ -1,23 +1,120 @@
+import os
 import re
 
 from mk2 import properties
 from mk2.events import (PlayerChat, PlayerDeath, PlayerJoin, PlayerQuit,
                         ServerOutput)
+from mk2.langcache import LangCache
 from mk2.plugins import Plugin
 
 
+class DeathMatcher:
+    """Matches a line against the death messages from Lang.get_deaths,
+    picking the same one a linear search through them would.
+
+    Death messages are bucketed by their first literal word, either at the
+    start of the message or after a leading player name, and each
+    combination of buckets a line can fall into gets one alternation regex.
+    Most lines aren't deaths, and are turned away by two dict lookups."""
+
+    placeholder = re.compile(r"\{(?:username|killer|weapon)\}")
+    name = re.compile(r"[A-Za-z0-9]*")
+
+    def __init__(self, deaths):
+        self.deaths = []
+        self.leading = {}
+        self.after_name = {}
+        self.fallback = []
+        self._compiled = {}
+
+        for i, (name, (pattern, format)) in enumerate(deaths):
+            groups = re.findall(r"\(\?P<(\w+)>", pattern)
+            pattern = re.sub(r"\(\?P<(\w+)>", r"(?P<_{}_\1>".format(i), pattern)
+            self.deaths.append(("(?P<_{}>{})".format(i, pattern),
+                                [("_{}_{}".format(i, g), g) for g in groups],
+                                format))
+
+            m = self.placeholder.match(format)
+            if m:
+                index, rest = self.after_name, format[m.end():]
+                # a player name is alphanumeric, so it's only delimited if
+                # something else follows it
+                if not rest or rest[0].isalnum():
+                    rest = None
+            else:
+                index, rest = self.leading, format
+            word = self._word(rest) if rest else None
+            if not word or '{' in word:
+                self.fallback.append(i)
+            else:
+                index.setdefault(word, []).append(i)
+
+    @staticmethod
+    def _word(text):
+        text = text.lstrip(' ')
+        end = text.find(' ')
+        return text if end == -1 else text[:end]
+
+    def _regex(self, leading, after_name):
+        key = (leading, after_name)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            candidates = sorted(set(self.leading.get(leading, ()))
+                                | set(self.after_name.get(after_name, ()))
+                                | set(self.fallback))
+            if candidates:
+                compiled = (re.compile("|".join(self.deaths[i][0] for i in candidates)),
+                            {"_{}".format(i): self.deaths[i] for i in candidates})
+            else:
+                compiled = (None, None)
+            self._compiled[key] = compiled
+        return compiled
+
+    def match(self, line):
+        """Returns (format, groups) for the first death message that
+        matches all of `line`, or None."""
+        leading = self._word(line)
+        if leading not in self.leading:
+            leading = None
+        after_name = None
+        end = self.name.match(line).end()
+        if 0 < end <= 32:
+            after_name = self._word(line[end:])
+            if after_name not in self.after_name:
+                after_name = None
+
+        regex, deaths = self._regex(leading, after_name)
+        if regex is None:
+            return None
+        m = regex.match(line)
+        if m is None:
+            return None
+        _, groups, format = deaths[m.lastgroup]
+        return format, {arg: m.group(g) for g, arg in groups}
+
+
 class ConsoleTracking(Plugin):
     lang_file_path = Plugin.Property(default=None)
-    deaths = tuple()
+    lang_cache     = Plugin.Property(default=True)
+    deaths = None
     chat_events = tuple()
 
     def setup(self):
-        if self.lang_file_path is None:
-            lang = properties.load_jar(self.parent.jar_file, 'assets/minecraft/lang/en_US.lang', 'lang/en_US.lang', "assets/minecraft/lang/en_us.json")
+        if not self.lang_file_path:
+            source = self.parent.jar_file
+            load = lambda: properties.load_jar(source, 'assets/minecraft/lang/en_US.lang', 'lang/en_US.lang', "assets/minecraft/lang/en_us.json")
         else:
-            lang = properties.load(properties.Lang, self.lang_file_path)
-        if lang is not None:
-            self.deaths = tuple(lang.get_deaths())
+            source = self.lang_file_path
+            load = lambda: properties.load(properties.Lang, source)
+
+        if self.lang_cache:
+            deaths = LangCache(os.path.join(self.parent.shared_path, 'lang-cache')).deaths(source, load)
+        else:
+            lang = load()
+            deaths = None if lang is None else lang.get_deaths()
+
+        if deaths is not None:
+            self.deaths = DeathMatcher(deaths)
             self.register(self.death_handler, ServerOutput, pattern=".*")
 
         self.register_chat()
@@ -38,10 +135,9 @@ class ConsoleTracking(Plugin):
         self.chat_events = tuple(ev)
 
     def death_handler(self, event):
-        for name, (pattern, format) in self.deaths:
-            m = re.match(pattern, event.data)
-            if m:
-                self.dispatch(PlayerDeath(cause=None,
-                                          format=format,
-                                          **m.groupdict()))
-                break
+        m = self.deaths.match(event.data)
+        if m:
+            format, groups = m
+            self.dispatch(PlayerDeath(cause=None,
+                                      format=format,
+                                      **groups))
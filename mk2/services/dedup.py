@@ -0,0 +1,133 @@
+import re
+
+from twisted.internet import reactor
+from twisted.python import log
+
+from mk2.events import Console, Event, EventPriority
+from mk2.plugins import Plugin
+
+
+class Budget:
+    """Lets through at most `limit` lines matching `pattern` every `period`
+    seconds, counting the ones it holds back."""
+
+    def __init__(self, name, pattern, limit, period):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.limit = limit
+        self.period = period
+        self.start = None
+        self.used = 0
+        self.suppressed = 0
+
+    def allow(self, now):
+        if self.start is None or now - self.start >= self.period:
+            self.start = now
+            self.used = 0
+        if self.used < self.limit:
+            self.used += 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+class Dedup(Plugin):
+    """Collapses runs of identical (or same-template) server lines, and lines
+    over their budget, before they are rendered, logged and sent to clients.
+    ServerOutput is untouched, so pattern handlers still see every line."""
+
+    interval = Plugin.Property(default=10)
+    template = Plugin.Property(default='')
+
+    clock = reactor
+
+    # how many of the parts that differed are listed in the summary
+    variants_shown = 10
+
+    def setup(self):
+        self.template_exp = re.compile(self.template) if self.template else None
+        self.last = None
+        self.last_data = None
+        self.repeats = 0
+        self.variants = []
+        self.differed = False
+        self.since = 0
+        self.flush_call = None
+        self.budgets = []
+
+        for name, pattern in self.parent.config.get_by_prefix('mark2.dedup.pattern.'):
+            spec = self.parent.config.get('mark2.dedup.budget.' + name)
+            try:
+                limit, period = str(spec).split('/')
+                period = int(period) if period.isdigit() else self.parse_time(period)[1]
+                self.budgets.append(Budget(name, pattern, int(limit), period))
+            except Exception:
+                return self.fatal_error(reason="mark2.dedup.budget.{} isn't valid (expected e.g. 5/60s)".format(name))
+
+        self.register(self.handle_console, Console, priority=EventPriority.HIGHEST)
+
+    def teardown(self):
+        self.flush()
+
+    def handle_console(self, event):
+        if event.source != 'server':
+            return
+        now = self.clock.seconds()
+        data = event.data
+
+        for budget in self.budgets:
+            if budget.pattern.search(data):
+                if budget.allow(now):
+                    break
+                self.schedule_flush()
+                return Event.EAT
+
+        if self.template_exp is None:
+            key = (event.level, data)
+        else:
+            key = (event.level, self.template_exp.sub('#', data))
+        if key == self.last:
+            self.repeats += 1
+            if self.template_exp is not None:
+                # keep what made it different, for the summary
+                self.variants.append(", ".join(self.template_exp.findall(data)))
+                self.differed = self.differed or data != self.last_data
+            if now - self.since >= self.interval:
+                self.flush()
+            else:
+                self.schedule_flush()
+            return Event.EAT
+
+        self.flush()
+        self.last = key
+        self.last_data = data
+
+    def schedule_flush(self):
+        if self.flush_call is None:
+            self.flush_call = self.clock.callLater(self.interval, self.flush)
+
+    def flush(self):
+        if self.flush_call is not None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
+        self.since = self.clock.seconds()
+        if self.repeats:
+            repeats, self.repeats = self.repeats, 0
+            variants, self.variants = self.variants, []
+            differed, self.differed = self.differed, False
+            if not differed:
+                self.console("last message repeated {} time{}".format(repeats, "s" if repeats > 1 else ""))
+            else:
+                shown = "; ".join(variants[:self.variants_shown])
+                if len(variants) > self.variants_shown:
+                    shown += "; and {} more".format(len(variants) - self.variants_shown)
+                    # the summary is kept short, but the rest aren't lost
+                    log.msg("lines like {!r} with: {}".format(self.last_data, "; ".join(variants)), system="dedup")
+                self.console("{} more line{} like the last, with: {}".format(
+                    repeats, "s" if repeats > 1 else "", shown))
+        for budget in self.budgets:
+            if budget.suppressed:
+                suppressed, budget.suppressed = budget.suppressed, 0
+                self.console("suppressed {} line{} matching '{}'".format(
+                    suppressed, "s" if suppressed > 1 else "", budget.name))
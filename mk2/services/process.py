@@ -1,4 +1,8 @@
 import locale
+import os
+import re
+from collections import deque
+from datetime import datetime
 from twisted.internet import protocol, reactor, error, defer, task
 import glob
 import psutil
@@ -10,33 +14,151 @@ from mk2.events import EventPriority
 from mk2.plugins import Plugin
 
 
+class LineSplitter:
+    """Turns chunks of process output into complete lines. Bytes are
+    buffered until a newline arrives, so only whole lines are ever decoded
+    and a multibyte character split across two chunks comes out intact."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.buff = bytearray()
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        if data[:1] == b'\b':
+            data = data.lstrip(b' \b')
+        buff = self.buff
+        buff += data
+        end = buff.rfind(b'\n', len(buff) - len(data))
+        if end == -1:
+            return []
+        with memoryview(buff) as view:
+            text = str(view[:end], self.encoding, 'replace')
+        del buff[:end + 1]
+        return [l.rstrip('\r') for l in text.split('\n')]
+
+    def flush(self):
+        if not self.buff:
+            return []
+        line = self.buff.decode(self.encoding, 'replace').rstrip('\r')
+        self.buff.clear()
+        return [line]
+
+
+class LineCoalescer:
+    """Folds continuation lines (stack trace frames, "Caused by:" and so on)
+    into the line before them. The head line is held until a line that isn't
+    a continuation arrives, or until `timeout` seconds pass without one, and
+    is then emitted along with its continuation lines."""
+
+    continuation = r'(?:\s|Caused by: |[\w$]+(?:\.[\w$]+)+(?:Exception|Error|Throwable)\b)'
+    limit = 1000
+
+    def __init__(self, emit, timeout, pattern=None, clock=reactor):
+        self.emit = emit
+        self.timeout = timeout
+        self.pattern = re.compile(pattern or self.continuation)
+        self.clock = clock
+        self.head = None
+        self.lines = []
+        self.call = None
+
+    def feed(self, line):
+        if self.head is not None and self.pattern.match(line):
+            self.lines.append(line)
+            if len(self.lines) >= self.limit:
+                self.flush()
+            else:
+                self.call.reset(self.timeout)
+            return
+        self.flush()
+        self.head = line
+        self.call = self.clock.callLater(self.timeout, self.flush)
+
+    def flush(self):
+        if self.call is not None:
+            if self.call.active():
+                self.call.cancel()
+            self.call = None
+        if self.head is not None:
+            head, lines = self.head, self.lines
+            self.head, self.lines = None, []
+            self.emit(head, lines)
+
+
 class ProcessProtocol(protocol.ProcessProtocol):
-    obuff = ""
     alive = True
+    recorder = None
 
-    def __init__(self, dispatch, locale):
+    def __init__(self, dispatch, locale, batch_size=0, coalesce_timeout=0,
+                 coalesce_pattern=None, clock=reactor):
         self.dispatch = dispatch
         self.locale = locale
+        self.splitter = LineSplitter(locale)
+        # with a batch size, lines are queued and handed out at most
+        # batch_size per reactor turn so a flood of output can't starve
+        # everything else
+        self.batch_size = batch_size
+        self.clock = clock
+        self.pending = deque()
+        self.drain_call = None
+        self.coalescer = None
+        if coalesce_timeout:
+            self.coalescer = LineCoalescer(self.output_lines, coalesce_timeout,
+                                           coalesce_pattern, clock)
 
     def output(self, line):
-        self.dispatch(events.ServerOutput(line=line))
+        if self.coalescer:
+            self.coalescer.feed(line)
+        else:
+            self.dispatch(events.ServerOutput(line=line))
+
+    def output_lines(self, line, lines):
+        if lines:
+            self.dispatch(events.ServerOutput(line=line, lines=lines))
+        else:
+            self.dispatch(events.ServerOutput(line=line))
 
     def childDataReceived(self, fd, data):
-        if data[0] == '\b':
-            data = data.lstrip(' \b')
-        if type(data) == bytes:
-            data = data.decode(self.locale)
-        data = data.split("\n")
-        data[0] = self.obuff + data[0]
-        self.obuff = data.pop()
-        for l in data:
-            self.output(l.strip('\r'))
+        if self.recorder:
+            self.recorder.write(data)
+        lines = self.splitter.feed(data)
+        if not self.batch_size:
+            for l in lines:
+                self.output(l)
+        elif lines:
+            self.pending.extend(lines)
+            if self.drain_call is None:
+                self.drain_call = self.clock.callLater(0, self.drain)
+
+    def drain(self):
+        self.drain_call = None
+        pending = self.pending
+        for _ in range(min(self.batch_size, len(pending))):
+            self.output(pending.popleft())
+        if pending:
+            self.drain_call = self.clock.callLater(0, self.drain)
+
+    def flush(self):
+        if self.drain_call is not None:
+            self.drain_call.cancel()
+            self.drain_call = None
+        self.pending.extend(self.splitter.flush())
+        while self.pending:
+            self.output(self.pending.popleft())
+        if self.coalescer:
+            self.coalescer.flush()
 
     def makeConnection(self, transport):
         self.dispatch(events.ServerStarting(pid=transport.pid))
 
     def processEnded(self, reason):
         self.alive = False
+        self.flush()
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
         if isinstance(reason.value, error.ProcessTerminated) and reason.value.exitCode:
             self.dispatch(events.ServerEvent(cause='server/error/exit-failure',
                                              data="server exited abnormally: {}".format(reason.getErrorMessage()),
@@ -58,6 +180,10 @@ class Process(Plugin):
     stop_cmd = Plugin.Property(default='stop\n')
     java_path = Plugin.Property(default='java')
     server_args = Plugin.Property(default='')
+    batch_size = Plugin.Property(default=0)
+    coalesce_timeout = Plugin.Property(default=0.0)
+    coalesce_pattern = Plugin.Property(default='')
+    record_path = Plugin.Property(default='')
 
     def setup(self):
         self.register(self.server_input,    events.ServerInput,    priority=EventPriority.MONITOR)
@@ -72,7 +198,12 @@ class Process(Plugin):
 
     def build_command(self):
         cmd = []
-        cmd.append(self.java_path)
+        # java_path can be a command line (e.g. to run mk2.fakeserver), but
+        # a path to an existing file is used as-is even if it has spaces
+        if os.path.exists(self.java_path):
+            cmd.append(self.java_path)
+        else:
+            cmd.extend(shlex.split(self.java_path))
         cmd.extend(self.parent.config.get_jvm_options())
         cmd.append('-jar')
         cmd.append(self.parent.jar_file)
@@ -87,10 +218,18 @@ class Process(Plugin):
         else:
             self.parent.console("starting %s" % self.parent.server_name)
             self.locale = locale.getpreferredencoding()
-            self.protocol = ProcessProtocol(self.parent.events.dispatch, self.locale)
+            self.protocol = ProcessProtocol(self.parent.events.dispatch, self.locale, self.batch_size,
+                                            self.coalesce_timeout, self.coalesce_pattern)
             cmd = self.build_command()
     
-            self.transport = reactor.spawnProcess(self.protocol, cmd[0], cmd, env=None)
+            if self.record_path:
+                # imported here as mk2.replay needs the manager, which needs us
+                from mk2.replay import Recorder
+                path = self.record_path.format(timestamp=datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
+                self.protocol.recorder = Recorder(path)
+                self.parent.console("recording server output to %s" % os.path.realpath(path))
+
+            self.transport = self.parent.spawn_process(self.protocol, cmd)
         
         if e:
             e.handled = True
@@ -1,49 +1,298 @@
+import binascii
 import json
 import os
+import re
+from collections import deque
+from itertools import chain
 
 from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Factory
 from twisted.protocols.basic import LineReceiver
+from zope.interface import implementer
 
-from mk2 import events
+from mk2 import events, framing
 from mk2.plugins import Plugin
 
 
 class Scrollback:
+    """The last `length` console lines, kept already encoded as json in a
+    ring buffer, along with the compact form from mk2.framing once there's
+    been a client that wants it. Lines are numbered from 1 in the order they
+    arrive, so a client can ask for just the ones after the last it saw."""
+
     def __init__(self, length):
         self.length = length
-        self.data = []
+        self.data = [None] * length
+        self.compact = [None] * length
+        self.seq = 0
+
+    def put(self, line, compact=None):
+        seq = self.seq = self.seq + 1
+        if self.length:
+            i = seq % self.length
+            self.data[i] = line
+            self.compact[i] = compact
+        return seq
 
-    def put(self, line):
-        self.data.append(line)
-        if len(self.data) > self.length:
-            self.data.pop(0)
+    @property
+    def first(self):
+        """The number of the oldest line still held."""
+        return max(1, self.seq - self.length + 1)
 
-    def get(self, max_items=None):
-        if max_items is None:
-            return self.data[:]
+    def get(self, since=None, last=None, compact=False):
+        """Returns the lines numbered after `since` (all of them if it's
+        None), or at most the `last` most recent of those."""
+        start = self.first
+        if since is not None:
+            start = max(start, since + 1)
+        if last is not None:
+            start = max(start, self.seq - last + 1)
+        if start > self.seq:
+            return []
+        i, j = start % self.length, (self.seq + 1) % self.length
+        if compact:
+            self.pack(i, j)
+            data = self.compact
         else:
-            return self.data[-max_items:]
+            data = self.data
+        if i < j:
+            return data[i:j]
+        return data[i:] + data[:j]
+
+    def pack(self, i, j):
+        # lines put while no client wanted them compact are packed the
+        # first time one does, and kept
+        compact, data = self.compact, self.data
+        for k in (range(i, j) if i < j else chain(range(i, self.length), range(j))):
+            if compact[k] is None:
+                compact[k] = framing.compact_line(json.loads(data[k].decode("utf-8")))
+
+
+@implementer(IPushProducer)
+class ClientBuffer:
+    """Registered with a client's transport as its producer, so the
+    transport tells us when its buffer is full. Until it's drained again,
+    everything for that client is queued, and console lines are handled by
+    `policy`:
+
+    coalesce    keep the latest `backlog` lines, and send them once the
+                client catches up, after a note of how many were skipped
+    drop        just send the note
+    disconnect  drop the connection, unless it was the client's own
+                scrollback that filled the buffer; then it gets the same
+                leeway as coalesce until that's been sent
+
+    A client can ask for another policy, or a smaller backlog, but not for
+    more than the `backlog` it was set up with. Other packets are never
+    dropped, but a client that lets `max_held` of them pile up is
+    disconnected. Either way, what mark2 holds for a slow client is
+    bounded."""
+
+    policies = ('coalesce', 'drop', 'disconnect')
+    max_held = 1000
+
+    def __init__(self, protocol, policy='coalesce', backlog=500):
+        self.protocol = protocol
+        # (data, is a console line)
+        self.queue = deque()
+        self.console = 0
+        self.held = 0
+        self.paused = False
+        self.stopped = False
+        self.draining = False
+        self.skipped = 0
+        self.sent = 0
+        self.pauses = 0
+        self.max_backlog = int(backlog)
+        self.configure(policy, backlog)
+
+    def configure(self, policy, backlog):
+        if policy not in self.policies:
+            raise ValueError("unknown backpressure policy: {}".format(policy))
+        if isinstance(backlog, bool) or not isinstance(backlog, (int, str)):
+            raise ValueError("backlog should be a number of lines: {!r}".format(backlog))
+        try:
+            backlog = int(backlog)
+        except ValueError:
+            raise ValueError("backlog should be a number of lines: {!r}".format(backlog))
+        if backlog < 0:
+            raise ValueError("backlog can't be negative: {}".format(backlog))
+        self.policy = policy
+        self.limit = min(backlog, self.max_backlog)
+        self.trim()
+
+    def keep(self):
+        return 0 if self.policy == 'drop' else self.limit
+
+    def trim(self):
+        # drops the oldest console lines over the limit
+        drop = self.console - self.keep()
+        if drop <= 0:
+            return
+        self.skipped += drop
+        self.console -= drop
+        queue = deque()
+        for entry in self.queue:
+            if entry[1] and drop:
+                drop -= 1
+            else:
+                queue.append(entry)
+        self.queue = queue
+
+    def write(self, data, lines):
+        """Sends a batch of console lines."""
+        if self.stopped:
+            return
+        if not self.paused:
+            self.sent += len(lines)
+            self.protocol.write(data)
+            return
+        if self.policy == 'disconnect' and not self.draining:
+            self.protocol.disconnect()
+            return
+        keep = self.keep()
+        if keep == 0:
+            self.skipped += len(lines)
+            return
+        self.queue.extend((line, True) for line in lines)
+        self.console += len(lines)
+        if self.policy == 'disconnect' and self.console > keep:
+            self.protocol.disconnect()
+        elif self.console > 2 * keep:
+            # trimmed in bulk so it's not a scan of the queue per line
+            self.trim()
+
+    def send(self, data):
+        """Sends anything else, which is queued behind console lines."""
+        if self.stopped:
+            return
+        if not self.paused:
+            self.protocol.write(data)
+            return
+        self.queue.append((data, False))
+        self.held += 1
+        if self.held > self.max_held:
+            self.protocol.disconnect()
+
+    def pauseProducing(self):
+        if not self.paused:
+            self.paused = True
+            self.pauses += 1
+
+    def resumeProducing(self):
+        if not self.paused:
+            return
+        self.paused = False
+        self.draining = False
+        self.trim()
+        data = [d for d, _ in self.queue]
+        self.sent += self.console
+        self.queue.clear()
+        self.console = self.held = 0
+        if self.skipped:
+            line = "skipped {} console line{} while this client was too slow to keep up".format(
+                self.skipped, "" if self.skipped == 1 else "s")
+            note = events.Console(source='mark2', kind='error', line=line).serialize()
+            note.update(type="console", skipped=self.skipped)
+            self.skipped = 0
+            data.insert(0, self.protocol.console_unit(json.dumps(note).encode("utf-8") + b'\n'))
+        if data:
+            self.protocol.write(b''.join(data))
+
+    def stopProducing(self):
+        self.stopped = True
+        self.queue.clear()
+
+    def recode(self, console, other):
+        self.queue = deque((console(d) if c else other(d), c) for d, c in self.queue)
+
+
+class Subscription:
+    """The console lines a client has asked for with a `subscribe` packet.
+    Each field is a list, and a line has to match all the ones given:
+
+    sources     e.g. "server", "user" or "mark2"
+    kinds       e.g. "error" or "joinpart"
+    levels      e.g. "INFO" or "WARN"
+    patterns    regexes, any of which has to match the whole of its data
+
+    Clients that ask for the same thing share a Subscription, so each
+    line is only checked once per distinct filter however many clients
+    use it."""
+
+    fields = ('sources', 'kinds', 'levels', 'patterns')
+
+    def __init__(self, sources=None, kinds=None, levels=None, patterns=None):
+        self.sources  = frozenset(sources) if sources else None
+        self.kinds    = frozenset(kinds) if kinds else None
+        self.levels   = frozenset(levels) if levels else None
+        self.patterns = [re.compile(p) for p in patterns] if patterns else None
+        self.key = (self.sources, self.kinds, self.levels, tuple(patterns) if patterns else None)
+        self.everything = self.key == (None, None, None, None)
+        self.clients = []
+        self.pending = []
+        self.pending_compact = []
+
+    @classmethod
+    def from_packet(cls, msg):
+        k = {}
+        for name in cls.fields:
+            value = msg.get(name)
+            if isinstance(value, str):
+                value = [value]
+            if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                raise ValueError("{} should be a list of strings".format(name))
+            k[name] = value
+        try:
+            return cls(**k)
+        except re.error as e:
+            raise ValueError("bad pattern: {}".format(e))
+
+    def match(self, source, kind, level, data):
+        if self.everything:
+            return True
+        if self.sources is not None and source not in self.sources:
+            return False
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if self.levels is not None and level not in self.levels:
+            return False
+        if self.patterns is not None:
+            data = data or ''
+            return any(p.fullmatch(data) for p in self.patterns)
+        return True
 
 
 class UserServerProtocol(LineReceiver):
     MAX_LENGTH = 999999
     delimiter = b'\n'
+    # bytes of scrollback lines per packet, which leaves room under the
+    # client's MAX_LENGTH for the rest of the packet
+    chunk_size = 1 << 19
     
     tab_last = None
     tab_index = 0
     
     attached_user = None
+    subscription = None
+    push = frozenset()
+    framer = None
     
     def connectionMade(self):
+        config = self.factory.parent.config
+        self.buffer = ClientBuffer(self, config.get('mark2.client.policy', 'coalesce'),
+                                   config.get('mark2.client.backlog', 500))
+        self.transport.registerProducer(self.buffer, True)
         self._handlers = []
         for callback, ty in (
-            (self.console_helper, events.Console),
             (self.handle_attach,  events.UserAttach),
             (self.handle_detach,  events.UserDetach)):
             self._handlers.append(self.register(callback, ty))
+        self.factory.add_client(self)
     
     def connectionLost(self, reason):
+        self.factory.remove_client(self)
         if self.attached_user:
             self.dispatch(events.UserDetach(user=self.attached_user))
 
@@ -56,15 +305,35 @@ class UserServerProtocol(LineReceiver):
         ty = msg["type"]
         
         if ty == "attach":
+            if 'policy' in msg or 'backlog' in msg:
+                try:
+                    self.buffer.configure(msg.get('policy', self.buffer.policy),
+                                          msg.get('backlog', self.buffer.limit))
+                except ValueError as e:
+                    self.factory.parent.console("{}: {}".format(msg['user'], e))
             self.attached_user = msg['user']
+            if 'framing' in msg:
+                self.set_framing(msg['framing'])
+            if 'push' in msg:
+                self.factory.set_push(self, msg['push'])
             self.dispatch(events.UserAttach(user=msg['user']))
 
+        elif ty == "subscribe":
+            try:
+                self.factory.subscribe(self, Subscription.from_packet(msg))
+            except ValueError as e:
+                self.factory.parent.console("subscribe: {}".format(e))
+
         elif ty == "input":
             self.dispatch(events.UserInput(user=msg['user'], line=msg['line']))
         
         elif ty == "get_scrollback":
             self.send_helper("regex", patterns=dict(self.factory.parent.config.get_by_prefix('mark2.regex.')))
-            self.send_helper("scrollback", lines=[e.serialize() for e in self.factory.scrollback.get()])
+            since = msg.get("since")
+            # sequence numbers start again when mark2 does
+            if msg.get("session", self.factory.session) != self.factory.session:
+                since = None
+            self.send_scrollback(since, msg.get("last"))
 
         elif ty == "get_users":
             for u in self.factory.users:
@@ -81,10 +350,115 @@ class UserServerProtocol(LineReceiver):
         
     def send_helper(self, ty, **k):
         k["type"] = ty
+        # console lines waiting to go out were from before this
+        self.factory.flush()
         self.sendLine(json.dumps(k).encode("utf-8"))
     
-    def console_helper(self, event):
-        self.send_helper("console", **event.serialize())
+    def send_scrollback(self, since=None, last=None):
+        # the lines are already json, so they're spliced straight in.
+        # 'skipped' counts lines after `since` that aren't sent, because
+        # they've fallen out of the scrollback or are before the `last`, and
+        # 'since' is null if these lines aren't a continuation of what the
+        # client had
+        self.factory.flush()
+        scrollback = self.factory.scrollback
+        compact = self.framer is not None and self.framer.compact
+        lines = scrollback.get(since, last)
+        skipped = max(0, scrollback.seq - since - len(lines)) if since is not None else 0
+        sent = scrollback.get(since, last, compact=True) if compact else lines
+        subscription = self.subscription
+        if subscription is not None and not subscription.everything:
+            def match(line):
+                m = json.loads(line.decode("utf-8"))
+                return subscription.match(m.get('source'), m.get('kind'), m.get('level'), m.get('data'))
+            sent = [s for l, s in zip(lines, sent) if match(l)]
+
+        # a long scrollback goes in several packets, each well within the
+        # line length clients accept, and the ones after the first are
+        # marked as continuing it
+        head = (b'{"type": "scrollback", "session": "' + self.factory.session.encode() +
+                b'", "seq": ' + str(scrollback.seq).encode() +
+                b', "since": ' + (b'null' if since is None else str(since).encode()) +
+                b', "skipped": ' + str(skipped).encode())
+        # a slow client shouldn't be dropped for being paused by this
+        self.buffer.draining = True
+        separator = b',' if compact else b', '
+        for i, chunk in enumerate(self.chunks(sent)):
+            self.sendLine(b''.join((head, b', "continued": true' if i else b'', b', "lines": [',
+                                    separator.join(chunk), b']}')))
+        if not self.buffer.paused:
+            self.buffer.draining = False
+
+    def chunks(self, lines):
+        """Splits lines into lists of at most `chunk_size` bytes. A line
+        that's too long on its own is left out."""
+        if sum(map(len, lines)) + 2 * len(lines) <= self.chunk_size:
+            yield lines
+            return
+        chunk, size = [], 0
+        for line in lines:
+            if len(line) + 2 > self.chunk_size:
+                continue
+            if size + len(line) + 2 > self.chunk_size:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line) + 2
+        yield chunk
+
+    def set_framing(self, options):
+        if self.framer is not None:
+            return
+        # the reply is the last plain json line, and goes ahead of anything
+        # still queued, which is sent as frames after it
+        self.factory.flush()
+        options = options if isinstance(options, dict) else {}
+        compact, compress = bool(options.get('compact')), bool(options.get('zlib'))
+        self.write(json.dumps({'type': 'framing', 'compact': compact, 'zlib': compress}).encode("utf-8") + b'\n')
+        self.framer = framing.Framer(compact, compress)
+        if compact:
+            self.factory.compact_clients += 1
+        self.buffer.recode(self.console_unit, lambda line: framing.frame(line[:-1]))
+
+    def sendLine(self, line):
+        if self.framer is None:
+            self.buffer.send(line + self.delimiter)
+        else:
+            self.buffer.send(framing.frame(line))
+
+    def write(self, data):
+        if self.framer is not None:
+            data = self.framer.encode(data)
+        self.transport.write(data)
+
+    def console_unit(self, line):
+        """Returns a console packet (json, with a newline) as this client
+        is sent it."""
+        if self.framer is None:
+            return line
+        if self.framer.compact:
+            return framing.frame(framing.pack_console(line[:-1]))
+        return framing.frame(line[:-1])
+
+    def write_console(self, lines, compact, framed):
+        # `framed` has what's written, worked out once for each kind of
+        # framing: None for plain json lines, False for frames of json, and
+        # True for frames of compact json
+        key = None if self.framer is None else self.framer.compact
+        if key not in framed:
+            if key:
+                units = [framing.frame(l) for l in compact]
+            else:
+                units = [framing.frame(l[:-1]) for l in lines]
+            framed[key] = (b''.join(units), units)
+        self.buffer.write(*framed[key])
+
+    def disconnect(self):
+        abort = getattr(self.transport, 'abortConnection', None)
+        if abort is not None:
+            abort()
+        else:
+            self.transport.loseConnection()
     
     def handle_attach(self, event):
         self.send_helper("user_status", user=event.user, online=True)
@@ -94,12 +468,32 @@ class UserServerProtocol(LineReceiver):
 
 
 class UserServerFactory(Factory):
+    """Console lines are encoded once, here, as json (and compact json too,
+    while there's a client that uses it), and the bytes written to every
+    connected client that subscribes to them. Lines that arrive in the same
+    reactor turn go out together in one write.
+
+    Clients that ask for it in their attach packet are sent changes to the
+    stats and player list as they happen, at most once every
+    mark2.client.push-interval seconds, rather than polling for them."""
+
     players = []
+    clock = reactor
+    pushable = ('stats', 'players')
     
     def __init__(self, parent):
         self.parent     = parent
         self.scrollback = Scrollback(self.parent.config['mark2.scrollback.length'])
+        self.session    = binascii.hexlify(os.urandom(8)).decode()
         self.users      = set()
+        self.clients    = []
+        self.subscriptions = {}
+        self.flush_call = None
+        self.compact_clients = 0
+        self.push_interval = self.parent.config.get('mark2.client.push_interval', 1)
+        self.push_call  = None
+        self.pushed_at  = None
+        self.pushed     = None
         
         self.parent.events.register(self.handle_console, events.Console)
         self.parent.events.register(self.handle_attach,  events.UserAttach)
@@ -119,9 +513,116 @@ class UserServerFactory(Factory):
         p.factory    = self
         return p
 
+    def add_client(self, protocol):
+        # it gets everything up to now from the scrollback
+        self.clients.append(protocol)
+        self.subscribe(protocol, Subscription())
+
+    def remove_client(self, protocol):
+        if protocol in self.clients:
+            self.clients.remove(protocol)
+            self.unsubscribe(protocol)
+            if protocol.framer is not None and protocol.framer.compact:
+                self.compact_clients -= 1
+        protocol.push = frozenset()
+
+    def subscribe(self, protocol, subscription):
+        self.flush()
+        self.unsubscribe(protocol)
+        subscription = self.subscriptions.setdefault(subscription.key, subscription)
+        subscription.clients.append(protocol)
+        protocol.subscription = subscription
+
+    def unsubscribe(self, protocol):
+        subscription = protocol.subscription
+        if subscription is None:
+            return
+        subscription.clients.remove(protocol)
+        if not subscription.clients:
+            del self.subscriptions[subscription.key]
+        protocol.subscription = None
+
     def handle_console(self, event):
-        self.scrollback.put(event)
+        serialized = event.serialize()
+        line = json.dumps(serialized).encode("utf-8")
+        compact = framing.compact_line(serialized) if self.compact_clients else None
+        seq = self.scrollback.put(line, compact)
+        packet = None
+        for subscription in self.subscriptions.values():
+            if subscription.match(event.source, event.kind, event.level, event.data):
+                if packet is None:
+                    # the console packet is the same object with a type and
+                    # its sequence number added
+                    packet = b'{"type": "console", "seq": ' + str(seq).encode() + b', ' + line[1:] + b'\n'
+                    compact_packet = compact and framing.compact_console(seq, compact)
+                subscription.pending.append(packet)
+                subscription.pending_compact.append(compact_packet)
+        if packet is not None and self.flush_call is None:
+            self.flush_call = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        if self.flush_call is not None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
+        for subscription in list(self.subscriptions.values()):
+            lines = subscription.pending
+            if not lines:
+                continue
+            compact = subscription.pending_compact
+            subscription.pending, subscription.pending_compact = [], []
+            framed = {None: (b''.join(lines), lines)}
+            for protocol in list(subscription.clients):
+                protocol.write_console(lines, compact, framed)
     
+    def set_push(self, protocol, kinds):
+        protocol.push = frozenset(kinds) & frozenset(self.pushable)
+        protocol.send_helper("capabilities", push=sorted(protocol.push))
+        if 'stats' in protocol.push:
+            protocol.send_helper("stats", stats=self.stats)
+        if 'players' in protocol.push:
+            protocol.send_helper("players", players=self.players)
+        if protocol.push and self.pushed is None:
+            self.pushed = {'stats': dict(self.stats), 'players': list(self.players)}
+
+    def changed(self):
+        if self.pushed is None or self.push_call is not None:
+            return
+        delay = 0
+        if self.pushed_at is not None:
+            delay = max(0, self.pushed_at + self.push_interval - self.clock.seconds())
+        self.push_call = self.clock.callLater(delay, self.push)
+
+    def push(self):
+        self.push_call = None
+        self.pushed_at = self.clock.seconds()
+        clients = [p for p in self.clients if p.push]
+        if not clients:
+            # nobody's listening, so start from scratch with the next one
+            self.pushed = None
+            return
+
+        # only what's changed since the last push
+        packets = {}
+        stats = {k: v for k, v in self.stats.items() if self.pushed['stats'].get(k) != v}
+        if stats:
+            packets['stats'] = {'type': 'stats', 'delta': True, 'stats': stats}
+        old, new = set(self.pushed['players']), set(self.players)
+        if old != new:
+            packets['players'] = {'type': 'players', 'delta': True,
+                                  'added': sorted(new - old, key=str.lower),
+                                  'removed': sorted(old - new, key=str.lower)}
+        self.pushed = {'stats': dict(self.stats), 'players': list(self.players)}
+        if not packets:
+            return
+
+        self.flush()
+        packets = {k: json.dumps(v).encode("utf-8") for k, v in packets.items()}
+        for protocol in clients:
+            for kind in self.pushable:
+                if kind in packets and kind in protocol.push:
+                    protocol.sendLine(packets[kind])
+
     def handle_attach(self, event):
         self.users.add(event.user)
     
@@ -132,13 +633,16 @@ class UserServerFactory(Factory):
     def handle_player_count(self, event):
         self.stats['players_current'] = event.players_current
         self.stats['players_max']     = event.players_max
+        self.changed()
         
     def handle_players(self, event):
         self.players = sorted(event.players, key=str.lower)
+        self.changed()
     
     def handle_process(self, event):
         for n in ('cpu', 'memory'):
             self.stats[n] = '{:.2f}'.format(event[n])
+        self.changed()
 
 
 class UserServer(Plugin):
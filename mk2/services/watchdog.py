@@ -0,0 +1,97 @@
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.python import log
+
+from mk2 import events
+from mk2.plugins import Plugin
+from mk2.profiler import describe
+
+
+class Watchdog(Plugin):
+    """Measures how late the reactor runs a call scheduled every `interval`
+    seconds. A helper thread watches for the reactor falling more than
+    `threshold` ms behind and, while it's still stuck, grabs the main
+    thread's stack and the event handler that was running."""
+
+    interval  = Plugin.Property(default=0.5)
+    threshold = Plugin.Property(default=250)
+    history   = Plugin.Property(default=600)
+
+    clock = reactor
+    # the clock lag is measured with, which tests can replace
+    monotonic = staticmethod(time.monotonic)
+
+    def setup(self):
+        self.lags = deque(maxlen=self.history)
+        self.stalls = deque(maxlen=5)
+        self.stall_count = 0
+        self.captured = None
+
+        self.main_ident = threading.get_ident()
+        self.last_tick = self.monotonic()
+        self.expected = self.last_tick + self.interval
+        self.call = self.clock.callLater(self.interval, self.tick)
+
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name="mark2 watchdog", daemon=True)
+        self.thread.start()
+
+        self.register(self.handle_lag, events.Hook, public=True, name="lag", readonly=True, doc="shows how far behind mark2 is running")
+
+    def teardown(self):
+        self.stopping.set()
+        if self.call.active():
+            self.call.cancel()
+
+    # reactor thread
+    def tick(self):
+        now = self.monotonic()
+        lag = max(0.0, now - self.expected) * 1000
+        self.lags.append(lag)
+
+        captured, self.captured = self.captured, None
+        if lag > self.threshold:
+            self.stall_count += 1
+            handler, stack = captured[1:] if captured else (None, None)
+            self.stalls.append((time.time(), lag, handler, stack))
+            log.msg("reactor was blocked for {:.0f}ms{}".format(
+                lag, " in " + handler if handler else ""), system="mark2")
+            if stack:
+                log.msg(stack, system="mark2")
+            self.dispatch(events.StatLag(source='watchdog', lag=lag, handler=handler, stack=stack))
+
+        self.last_tick = now
+        self.expected = now + self.interval
+        self.call = self.clock.callLater(self.interval, self.tick)
+
+    # watchdog thread
+    def watch(self):
+        limit = self.interval + self.threshold / 1000.0
+        while not self.stopping.wait(self.threshold / 2000.0):
+            stuck = self.monotonic() - self.last_tick
+            if stuck > limit and self.captured is None:
+                frame = sys._current_frames().get(self.main_ident)
+                current = self.parent.events.current
+                handler = None
+                if current is not None:
+                    handler = "{} {}".format(current[0].__class__.__name__, describe(current[1]))
+                stack = "".join(traceback.format_stack(frame)) if frame else None
+                self.captured = (stuck, handler, stack)
+
+    def handle_lag(self, event):
+        if not self.lags:
+            self.console("no lag measurements yet.")
+            return
+        lags = sorted(self.lags)
+        self.console("reactor lag over the last {:.0f}s: now {:.0f}ms, median {:.0f}ms, max {:.0f}ms".format(
+            len(lags) * self.interval, self.lags[-1], lags[len(lags) // 2], lags[-1]))
+        self.console("{} stall{} over {}ms since startup".format(
+            self.stall_count, "" if self.stall_count == 1 else "s", self.threshold))
+        for when, lag, handler, stack in self.stalls:
+            self.console("  {} {:.0f}ms {}".format(
+                time.strftime("%H:%M:%S", time.localtime(when)), lag, handler or "(no handler running)"))
@@ -0,0 +1,144 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+from mk2 import fakeserver, properties
+from mk2.langcache import LangCache
+from mk2.services.console_tracking import DeathMatcher
+
+from twisted.trial import unittest
+
+
+# a selection of en_us.json, with the awkward cases: messages that don't
+# start with a name, names followed by punctuation, and repeated words
+DEATHS = {
+    "death.attack.anvil": "%1$s was squashed by a falling anvil",
+    "death.attack.anvil.player": "%1$s was squashed by a falling anvil while fighting %2$s",
+    "death.attack.arrow": "%1$s was shot by %2$s",
+    "death.attack.arrow.item": "%1$s was shot by %2$s using %3$s",
+    "death.attack.badRespawnPoint.message": "%1$s was killed by %2$s",
+    "death.attack.cactus": "%1$s was pricked to death",
+    "death.attack.drown": "%1$s drowned",
+    "death.attack.explosion.player": "%1$s was blown up by %2$s",
+    "death.attack.fall": "%1$s hit the ground too hard",
+    "death.attack.generic": "%1$s died",
+    "death.attack.message_too_long": "Actually, the message was too long to deliver fully. Sorry! Here's a stripped version: %s",
+    "death.attack.mob": "%1$s was slain by %2$s",
+    "death.attack.player.item": "%1$s was slain by %2$s using %3$s",
+    "death.attack.sting": "%1$s was stung to death",
+    "death.attack.thorns": "%1$s was killed trying to hurt %2$s",
+    "death.attack.outOfWorld": "%1$s fell out of the world",
+    "death.fell.accident.generic": "%1$s fell from a high place",
+    "death.fell.finish": "%1$s fell too far and was finished by %2$s",
+    "death.attack.possessive": "%1$s's luck ran out",
+    "death.attack.glued": "%1$swas glued",
+    "death.attack.prefixed": "Alas, %1$s is no more",
+    "death.attack.killer_first": "%2$s finished off %1$s",
+    "death.attack.bare": "%1$s",
+}
+
+
+def lang(deaths):
+    f = io.StringIO(json.dumps(deaths))
+    f.name = "en_us.json"
+    return properties.Lang(f)
+
+
+def linear(deaths, line):
+    for name, (pattern, format) in deaths:
+        m = re.match(pattern, line)
+        if m:
+            return format, m.groupdict()
+    return None
+
+
+class DeathMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.deaths = list(lang(DEATHS).get_deaths())
+        self.matcher = DeathMatcher(self.deaths)
+
+    def test_same_as_linear(self):
+        lines = ["Actually, the message was too long to deliver fully. Sorry! Here's a stripped version: %s",
+                 "Steve joined the game",
+                 "<Steve> Alex was slain by Zombie",
+                 "",
+                 " ",
+                 "Steve",
+                 "Steve was slain by",
+                 "Steve_ drowned",
+                 "A" * 33 + " drowned",
+                 "A" * 32 + " drowned",
+                 "Can't keep up! Is the server overloaded?"]
+        for template in DEATHS.values():
+            for names in (("Steve", "Zombie", "Stabby"), ("was", "by", "using"), ("a", "Alex", "fell")):
+                line = template
+                for i, n in enumerate(names):
+                    line = line.replace("%{}$s".format(i + 1), n)
+                lines.append(line)
+                lines.append(line + " again")
+                lines.append("[Server] " + line)
+
+        for line in lines:
+            self.assertEqual(self.matcher.match(line), linear(self.deaths, line), line)
+
+    def test_match(self):
+        self.assertEqual(self.matcher.match("Steve was shot by Skeleton using Bow"),
+                         ("{username} was shot by {killer} using {weapon}",
+                          {"username": "Steve", "killer": "Skeleton", "weapon": "Bow"}))
+        self.assertEqual(self.matcher.match("Steve's luck ran out"),
+                         ("{username}'s luck ran out", {"username": "Steve"}))
+        self.assertIsNone(self.matcher.match("Steve joined the game"))
+
+
+class LangCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.jar = os.path.join(self.path, 'server.jar')
+        fakeserver.make_jar(self.jar)
+        self.cache = LangCache(os.path.join(self.path, 'cache'))
+        self.loads = []
+
+    def deaths(self, jar):
+        def load():
+            self.loads.append(jar)
+            return properties.load_jar(jar, 'assets/minecraft/lang/en_us.json')
+        return self.cache.deaths(jar, load)
+
+    def test_cached(self):
+        first = self.deaths(self.jar)
+        self.assertEqual(len(first), len(fakeserver.DEATHS))
+        self.assertEqual(self.deaths(self.jar), first)
+        self.assertEqual(self.loads, [self.jar])
+
+        # another server running the same jar
+        other = os.path.join(self.path, 'other.jar')
+        shutil.copy(self.jar, other)
+        self.assertEqual(self.deaths(other), first)
+        self.assertEqual(self.loads, [self.jar])
+
+    def test_changed(self):
+        self.deaths(self.jar)
+        with open(self.jar, 'ab') as f:
+            f.write(b'\0')
+        self.deaths(self.jar)
+        self.assertEqual(self.loads, [self.jar, self.jar])
+
+    def test_corrupt(self):
+        self.deaths(self.jar)
+        for name in os.listdir(self.cache.path):
+            with open(os.path.join(self.cache.path, name), 'wb') as f:
+                f.write(b'nonsense')
+        self.assertEqual(len(self.deaths(self.jar)), len(fakeserver.DEATHS))
+        self.assertEqual(self.loads, [self.jar, self.jar])
+
+    def test_no_lang(self):
+        empty = os.path.join(self.path, 'empty.jar')
+        zipfile.ZipFile(empty, 'w').close()
+        self.assertIsNone(self.deaths(empty))
+        self.assertIsNone(self.deaths(empty))
+        self.assertEqual(self.loads, [empty])
@@ -0,0 +1,91 @@
+import re
+
+from mk2 import events
+from mk2.events import EventPriority
+from mk2.services import dedup
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+
+class DedupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = events.EventDispatcher(lambda *a: None)
+        self.config = Config({'mark2.dedup.pattern.wrongly': '.* moved wrongly!',
+                              'mark2.dedup.budget.wrongly': '2/30'})
+        self.shown = []
+        self.events.register(lambda e: self.shown.append(e.data), events.Console,
+                             priority=EventPriority.MONITOR)
+
+        self.clock = Clock()
+        dedup.Dedup.clock = self.clock
+        self.addCleanup(setattr, dedup.Dedup, 'clock', dedup.reactor)
+        self.plugin = dedup.Dedup(self, 'dedup', interval=10)
+
+    def fatal_error(self, *a, **k):
+        self.fail("fatal error: {} {}".format(a, k))
+
+    def console(self, line, **k):
+        self.events.dispatch(events.Console(line=line, **k))
+
+    def server(self, data):
+        self.events.dispatch(events.Console(source='server', line=data, level='WARN', data=data))
+
+    def test_repeats(self):
+        for i in range(5):
+            self.server("Can't keep up! Running 2000ms behind")
+        self.assertEqual(len(self.shown), 1)
+
+        self.server("something else")
+        self.assertEqual(self.shown[1:], ["last message repeated 4 times", "something else"])
+
+        self.server("something else")
+        self.clock.advance(10)
+        self.assertEqual(self.shown[3:], ["last message repeated 1 time"])
+
+    def test_different(self):
+        # only exact repeats are collapsed without a template
+        self.server("<Steve> I have 5 diamonds")
+        self.server("<Steve> I have 64 diamonds")
+        self.server("Player1 joined the game")
+        self.server("Player2 joined the game")
+        self.assertEqual(self.shown, ["<Steve> I have 5 diamonds", "<Steve> I have 64 diamonds",
+                                      "Player1 joined the game", "Player2 joined the game"])
+
+    def test_template(self):
+        self.plugin.template_exp = re.compile(r'\d+')
+        self.plugin.variants_shown = 2
+        for i in range(4):
+            self.server("Can't keep up! Running {}ms behind".format(2000 + i))
+        self.server("something else")
+        self.assertEqual(self.shown, ["Can't keep up! Running 2000ms behind",
+                                      "3 more lines like the last, with: 2001; 2002; and 1 more",
+                                      "something else"])
+
+        self.server("something else")
+        self.server("something else 2")
+        self.assertEqual(self.shown[3:], ["last message repeated 1 time", "something else 2"])
+
+    def test_budget(self):
+        for name in ('a', 'b', 'c', 'd'):
+            self.server("{} moved wrongly!".format(name))
+        self.assertEqual(self.shown, ["a moved wrongly!", "b moved wrongly!"])
+
+        self.clock.advance(10)
+        self.assertEqual(self.shown[2:], ["suppressed 2 lines matching 'wrongly'"])
+
+        self.clock.advance(20)
+        self.server("e moved wrongly!")
+        self.assertEqual(self.shown[3:], ["e moved wrongly!"])
+
+    def test_other_sources(self):
+        for i in range(3):
+            self.console("mark2 line")
+        self.assertEqual(self.shown, ["mark2 line"] * 3)
+
+
+class Config(dict):
+    def get_by_prefix(self, prefix):
+        for k, v in self.items():
+            if k.startswith(prefix):
+                yield k[len(prefix):], v
@@ -1,6 +1,10 @@
+import time
+
 from .. import events
 from ..events import Event, EventPriority
+from ..profiler import DispatchProfiler
 
+from twisted.internet.defer import Deferred
 from twisted.trial import unittest
 
 
@@ -136,6 +140,121 @@ class EventsTestCase(unittest.TestCase):
         handled = self.events.dispatch(TestEvent())
         self.assertFalse(self.successResultOf(handled))
 
+    def test_registration_order(self):
+        """
+        Test that handlers of the same priority run in the order they were registered.
+        """
+        order = []
+        for i in range(5):
+            self.events.register(lambda event, i=i: order.append(i), TestEvent,
+                                 priority=EventPriority.HIGH if i % 2 else EventPriority.LOW)
+
+        self.events.dispatch(TestEvent())
+
+        self.assertEqual(order, [1, 3, 0, 2, 4])
+
+    def test_unregister_during_dispatch(self):
+        """
+        Test (un)registering handlers while an event is being dispatched.
+        """
+        order = []
+
+        def first(event):
+            order.append('first')
+            self.events.unregister(id_)
+            self.events.register(lambda event: order.append('new'), TestEvent)
+            return Event.UNREGISTER
+
+        self.events.register(first, TestEvent, priority=EventPriority.HIGH)
+        id_ = self.events.register(lambda event: order.append('second'), TestEvent)
+
+        self.events.dispatch(TestEvent())
+        self.assertEqual(order, ['first', 'second'])
+
+        order = []
+        self.events.dispatch(TestEvent())
+        self.assertEqual(order, ['new'])
+
+    def test_handler_error(self):
+        """
+        Test that a failing handler goes to the error handler and dispatch carries on.
+        """
+        errors = []
+        self.events = events.EventDispatcher(lambda *a: errors.append(a))
+        self.hit = False
+
+        def bad_handler(event):
+            raise ValueError("oops")
+
+        def handler(event):
+            self.hit = True
+
+        self.events.register(bad_handler, TestEvent, priority=EventPriority.HIGH)
+        self.events.register(handler, TestEvent, priority=EventPriority.LOW)
+
+        handled = self.events.dispatch(TestEvent())
+
+        self.assertTrue(self.successResultOf(handled))
+        self.assertTrue(self.hit)
+        self.assertEqual(len(errors), 1)
+        self.assertIs(errors[0][1], bad_handler)
+        errors[0][2].trap(ValueError)
+
+    def test_deferred_handler(self):
+        """
+        Test that a handler returning a Deferred holds up the handlers after it.
+        """
+        d = Deferred()
+        self.hit = False
+
+        def handler(event):
+            self.hit = True
+
+        self.events.register(lambda event: d, TestEvent, priority=EventPriority.HIGH)
+        self.events.register(handler, TestEvent, priority=EventPriority.LOW)
+
+        handled = self.events.dispatch(TestEvent())
+        self.assertNoResult(handled)
+        self.assertFalse(self.hit)
+
+        d.callback(Event.EAT)
+        self.assertTrue(self.successResultOf(handled))
+        self.assertFalse(self.hit)
+
+    def test_profiler(self):
+        """
+        Test that the profiler counts calls and prefilter rejections
+        """
+        def handle_a(event):
+            pass
+
+        def handle_b(event):
+            pass
+
+        self.events.profiler = DispatchProfiler(sample=2)
+        self.events.register(handle_a, TestEvent, name='a')
+        self.events.register(handle_b, TestEvent, name='b')
+
+        for i in range(8):
+            self.events.dispatch(TestEvent(name='a'))
+
+        self.assertEqual(self.events.profiler.dispatches, 4)
+        a, b = sorted(self.events.profiler.stats.values(), key=lambda s: -s.calls)
+        self.assertEqual((a.offered, a.calls, a.reject_rate), (4, 4, 0))
+        self.assertEqual((b.offered, b.calls, b.reject_rate), (4, 0, 1))
+        self.assertEqual(len(self.events.profiler.report()), 4)
+
+        # a handler that's registered again is still the same handler
+        for i in range(4):
+            id_ = self.events.register(handle_a, TestEvent, name='a')
+            self.events.dispatch(TestEvent(name='a'))
+            self.events.dispatch(TestEvent(name='a'))
+            self.events.unregister(id_)
+        self.assertEqual(len(self.events.profiler.stats), 2)
+
+        self.events.profiler.reset()
+        self.assertEqual(self.events.profiler.stats, {})
+
     def test_event_args(self):
         """
         Test Event.Arg
@@ -143,6 +262,40 @@ class EventsTestCase(unittest.TestCase):
         self.assertRaises(Exception, EventWithArgs)
         ev = EventWithArgs(required=True)
         self.assertEqual(ev.default, 'foo')
+        self.assertRaises(Exception, EventWithArgs, required=True, bogus=1)
+
+    def test_server_output_parse(self):
+        """
+        Test that ServerOutput fills in time, level and data from the line
+        """
+        ev = events.ServerOutput(line='[12:00:00] [Server thread/WARN]: hello ')
+        self.assertEqual(ev.level, 'WARN')
+        self.assertEqual(ev.data, 'hello ')
+        self.assertEqual(ev.stripped, 'hello')
+        self.assertTrue(ev.time.endswith(' 12:00:00'))
+
+        ev = events.ServerOutput(line='garbage')
+        self.assertEqual((ev.level, ev.data), ('RAW', 'garbage'))
+
+        ev = events.ServerOutput(line='[12:00:00] [Server thread/INFO]: hi', level='SEVERE')
+        self.assertEqual((ev.level, ev.data), ('SEVERE', 'hi'))
+
+    def test_server_output_time(self):
+        """
+        Test that ServerOutput's time is when it was made, not when it's read
+        """
+        now = [1000000000.0]
+        self.patch(time, 'time', lambda: now[0])
+        raw = events.ServerOutput(line='garbage')
+        parsed = events.ServerOutput(line='[12:00:00] [Server thread/INFO]: hi')
+        given = events.ServerOutput(line='garbage', time='13:00:00')
+        given_full = events.ServerOutput(line='garbage', time='2001-01-01 13:00:00')
+        made = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now[0]))
+        now[0] += 86400 * 2
+        self.assertEqual(raw.time, made)
+        self.assertEqual(parsed.time, made[:11] + '12:00:00')
+        self.assertEqual(given.time, made[:11] + '13:00:00')
+        self.assertEqual(given_full.time, '2001-01-01 13:00:00')
 
     def test_prefilter_check(self):
         """
@@ -164,3 +317,163 @@ class EventsTestCase(unittest.TestCase):
                           require='foo', optional='bar', fooarg='excess argument')
         self.events.register(handler, PrefilterTest_2,
                              require='foo', optional='bar', fooarg='excess argument')
+
+
+class PatternDispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = events.EventDispatcher(lambda *a: None)
+        self.hits = []
+
+    def handler(self, name, result=None):
+        def _handler(event):
+            self.hits.append(name)
+            return result
+        return _handler
+
+    def dispatch(self, line):
+        self.hits = []
+        return self.successResultOf(self.events.dispatch(events.ServerOutput(line=line)))
+
+    def test_literal_screen(self):
+        """
+        Test the literal prefix/substring worked out for patterns.
+        """
+        screen = events.literal_screen
+        self.assertEqual(screen(r'Done \(([0-9\.]+)s\)!.*'), ('Done (', ''))
+        self.assertEqual(screen(r'.*fatal error:.*'), ('', 'fatal error:'))
+        self.assertEqual(screen(r'abc?d'), ('ab', ''))
+        self.assertEqual(screen(r'ab|cd'), ('', ''))
+        self.assertEqual(screen(r'x[|]y'), ('x', ''))
+        self.assertEqual(screen(r'.*'), ('', ''))
+
+    def test_pattern_match(self):
+        """
+        Test that only handlers whose pattern matches are called.
+        """
+        self.events.register(self.handler('done'), events.ServerOutput, pattern=r'Done \(([0-9\.]+)s\)!.*')
+        self.events.register(self.handler('fatal'), events.ServerOutput, pattern=r'.*fatal error.*')
+        self.events.register(self.handler('branch'), events.ServerOutput, pattern=r'Don|fat')
+        self.events.register(self.handler('all'), events.ServerOutput, pattern=r'')
+
+        self.dispatch('[12:00:00] [Server thread/INFO]: Done (1.5s)! For help, type "help"')
+        self.assertEqual(self.hits, ['done', 'branch', 'all'])
+
+        self.dispatch('[12:00:00] [Server thread/INFO]: a fatal error occurred')
+        self.assertEqual(self.hits, ['fatal', 'all'])
+
+        self.dispatch('[12:00:00] [Server thread/INFO]: fatal')
+        self.assertEqual(self.hits, ['branch', 'all'])
+
+    def test_pattern_level(self):
+        """
+        Test that handlers with a level only see lines of that level.
+        """
+        self.events.register(self.handler('severe'), events.ServerOutput, level='SEVERE', pattern='oom')
+        self.events.register(self.handler('any'), events.ServerOutput, pattern='oom')
+
+        self.dispatch('[12:00:00] [Server thread/INFO]: oom')
+        self.assertEqual(self.hits, ['any'])
+
+        self.dispatch('[12:00:00] [Server thread/SEVERE]: oom')
+        self.assertEqual(self.hits, ['severe', 'any'])
+
+    def test_pattern_priority(self):
+        """
+        Test priority ordering and Event.EAT across prefixed and unprefixed patterns.
+        """
+        self.events.register(self.handler('low'), events.ServerOutput, pattern='foo', priority=EventPriority.LOW)
+        self.events.register(self.handler('high'), events.ServerOutput, pattern='.*', priority=EventPriority.HIGH)
+        self.events.register(self.handler('medium', Event.EAT), events.ServerOutput, pattern='f')
+
+        self.assertTrue(self.dispatch('foo'))
+        self.assertEqual(self.hits, ['high', 'medium'])
+
+        self.dispatch('bar')
+        self.assertEqual(self.hits, ['high'])
+
+    def test_pattern_unregister(self):
+        """
+        Test Event.UNREGISTER and unregistering with indexed patterns.
+        """
+        self.events.register(self.handler('once', Event.UNREGISTER), events.ServerOutput, pattern='foo')
+        id_ = self.events.register(self.handler('kept'), events.ServerOutput, pattern='foo')
+
+        self.dispatch('foo')
+        self.assertEqual(self.hits, ['once', 'kept'])
+
+        self.dispatch('foo')
+        self.assertEqual(self.hits, ['kept'])
+
+        self.events.unregister(id_)
+        self.assertFalse(self.dispatch('foo'))
+        self.assertEqual(self.hits, [])
+
+    def test_pattern_match_object(self):
+        """
+        Test that handlers still get the match object for their own pattern.
+        """
+        groups = []
+        self.events.register(lambda e: groups.append(e.match.groups()), events.ServerOutput,
+                             pattern=r'<(\w+)> (.*)')
+        self.dispatch('[12:00:00] [Server thread/INFO]: <Notch> hello')
+        self.assertEqual(groups, [('Notch', 'hello')])
+
+
+class HookDispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = events.EventDispatcher(lambda *a: None)
+        self.hits = []
+
+    def register(self, name, **kw):
+        return self.events.register(lambda e: self.hits.append(name), events.Hook, name=name, **kw)
+
+    def test_hook_by_name(self):
+        """
+        Test that a hook only reaches the handlers registered for its name
+        """
+        self.register('foo')
+        id_ = self.register('bar')
+        self.register('bar', public=True)
+
+        self.events.dispatch(events.Hook(name='bar'))
+        self.assertEqual(self.hits, ['bar', 'bar'])
+
+        self.events.unregister(id_)
+        self.hits = []
+        self.events.dispatch(events.Hook(name='bar'))
+        self.assertEqual(self.hits, ['bar'])
+
+        self.hits = []
+        self.assertFalse(self.successResultOf(self.events.dispatch(events.Hook(line='~foo'))))
+        self.assertEqual(self.hits, [])
+
+    def test_commands(self):
+        """
+        Test the command table and prefix lookup
+        """
+        self.register('reload', public=True, doc='reload everything')
+        self.register('reload-plugin', public=True, doc='reload a plugin')
+        self.register('rehash', public=True)
+        self.register('task')
+
+        hooks = self.events.get(events.Hook)
+        self.assertEqual([n for n, _ in hooks.commands()], ['rehash', 'reload', 'reload-plugin'])
+        self.assertEqual(hooks.commands('reload-'), [('reload-plugin', 'reload a plugin')])
+        self.assertEqual(len(hooks.commands('re')), 3)
+        self.assertEqual(hooks.commands('x'), [])
+
+    def test_command_lookup(self):
+        """
+        Test that only read-only commands run by a prefix of their name
+        """
+        self.register('reload', public=True)
+        self.register('help', public=True, readonly=True)
+
+        hooks = self.events.get(events.Hook)
+        self.assertEqual(hooks.lookup('he'), ('help', ['help']))
+        self.assertEqual(hooks.lookup('rel'), (None, ['reload']))
+        self.assertEqual(hooks.lookup(''), (None, []))
+        self.assertEqual(hooks.lookup('x'), (None, []))
+
+        # a bare ~ isn't a command
+        self.assertEqual(events.Hook(line='~').name, '')
@@ -0,0 +1,58 @@
+import os
+import re
+import struct
+import tempfile
+
+from mk2 import fakeserver, properties
+
+from twisted.trial import unittest
+
+
+class FakeServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeserver.FakeServer(seed=1)
+        self.lines = []
+        self.server.write = self.lines.extend
+
+    def test_deaths_match_lang(self):
+        fd, path = tempfile.mkstemp(suffix='.jar')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        fakeserver.make_jar(path)
+        lang = properties.load_jar(path, 'assets/minecraft/lang/en_us.json')
+        deaths = [re.compile(pattern) for _, (pattern, _) in lang.get_deaths()]
+        self.assertEqual(len(deaths), len(fakeserver.DEATHS))
+
+        for template in fakeserver.DEATHS.values():
+            line = fakeserver.format_death(template, username="Steve", killer="Zombie", weapon="Stabby")
+            self.assertTrue(any(d.match(line) for d in deaths), line)
+
+    def test_commands(self):
+        self.server.online = ["Alex", "Steve"]
+        self.server.command("list")
+        self.server.command("save-off")
+        self.server.command("")
+        self.assertEqual(len(self.lines), 2)
+        self.assertTrue(self.lines[0].endswith("There are 2 of a max of 20 players online: Alex, Steve"))
+        self.assertFalse(self.server.saving)
+
+    def test_activity(self):
+        for _ in range(1000):
+            lines = self.server.activity()
+            self.assertTrue(lines)
+            self.assertTrue(len(self.server.online) <= self.server.max_players)
+
+    def test_ping(self):
+        self.server.online = ["Alex"]
+        protocol = fakeserver.LegacyPingProtocol()
+        protocol.factory = type('Factory', (), {'server': self.server})
+        written = []
+        protocol.transport = type('Transport', (), {'write': lambda s, d: written.append(d),
+                                                    'loseConnection': lambda s: None})()
+        protocol.dataReceived(b'\xfe\x01')
+        data = b''.join(written)
+        self.assertEqual(data[:1], b'\xff')
+        length, = struct.unpack('>h', data[1:3])
+        fields = data[3:].decode('utf-16be').split('\x00')
+        self.assertEqual(length, len(data[3:]) // 2)
+        self.assertEqual(fields[4:], ["1", "20"])
@@ -0,0 +1,41 @@
+import json
+
+from mk2 import events, framing
+
+from twisted.trial import unittest
+
+
+class FramingTestCase(unittest.TestCase):
+    def test_pack(self):
+        line = events.Console(source='server', line="<Steve> hi", time='12:00:00').serialize()
+        self.assertEqual(framing.unpack(framing.pack(line)), line)
+        line['data'] = "something else"
+        line['skipped'] = 3
+        self.assertEqual(framing.unpack(framing.pack(line)), line)
+
+        packet = dict(line, type='console', seq=5)
+        compact = framing.pack_console(json.dumps(packet).encode())
+        self.assertEqual(framing.expand(json.loads(compact.decode())), packet)
+
+    def test_stream(self):
+        packets = [{'type': 'stats', 'stats': {'cpu': '1.00'}},
+                   {'type': 'scrollback', 'lines': [[None, 'mark2', None, None, '', 'x', None, 'Console']]},
+                   [7, None, 'server', None, None, '', 'y', 'z', 'Console']]
+        data = b''.join(framing.frame(json.dumps(p).encode()) for p in packets)
+
+        for compress in (False, True):
+            framer = framing.Framer(compress=compress)
+            deframer = framing.Deframer(compress)
+            # split one write awkwardly, and make another after it
+            out = framer.encode(data) + framer.encode(framing.frame(b'{"type": "end"}'))
+            got = []
+            for i in range(0, len(out), 7):
+                got.extend(deframer.feed(out[i:i + 7]))
+            self.assertEqual([p['type'] for p in got], ['stats', 'scrollback', 'console', 'end'])
+            self.assertEqual(got[1]['lines'][0]['data'], 'x')
+            self.assertEqual((got[2]['seq'], got[2]['data']), (7, 'z'))
+            self.assertEqual(deframer.buffer, b'')
+
+    def test_too_long(self):
+        deframer = framing.Deframer()
+        self.assertRaises(ValueError, deframer.feed, framing.header.pack(framing.MAX_FRAME + 1))
@@ -2,25 +2,15 @@ from mk2 import events, plugins
 
 import sys
 
-from twisted.internet import task
 from twisted.internet.task import Clock
 from twisted.trial import unittest
 
 
 class TestEventDispatcher(events.EventDispatcher):
     def __init__(self):
-        events.EventDispatcher.__init__(self, lambda a: None)
         self.clock = Clock()
         self.advance = self.clock.advance
-
-    def dispatch_delayed(self, event, delay):
-        return self.clock.callLater(delay, self.dispatch, event)
-
-    def dispatch_repeating(self, event, interval, now=False):
-        t = task.LoopingCall(self.dispatch, event)
-        t.clock = self.clock
-        t.start(interval, now)
-        return t
+        events.EventDispatcher.__init__(self, lambda a: None, clock=self.clock)
 
 
 class TestPlugin(plugins.Plugin):
@@ -196,3 +186,19 @@ class PluginTestCase(PluginTestBase, unittest.TestCase):
             self.events.advance(10)
 
         self.assertEqual(calls[0], 100)
+
+    def test_task_cleanup(self):
+        def task(ev):
+            pass
+
+        self.plugin.delayed_task(task, 10)
+        self.plugin.repeating_task(task, 10)
+        self.assertEqual(len(self.events.get(events.Hook)), 2)
+
+        self.events.advance(10)
+        self.assertEqual(len(self.events.get(events.Hook)), 1)
+        self.assertEqual(len(self.events.scheduler), 1)
+
+        self.plugins.unload('test')
+        self.assertEqual(len(self.events.get(events.Hook)), 0)
+        self.assertEqual(len(self.events.scheduler), 0)
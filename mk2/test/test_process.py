@@ -1,9 +1,9 @@
-from mk2 import events
+from mk2 import events, replay
 from mk2.services import process
 
 import random
 
-from twisted.internet import error
+from twisted.internet import error, task
 from twisted.python.failure import Failure
 
 from twisted.trial import unittest
@@ -40,6 +40,81 @@ this line is incomplete'''
 
         self.assertEqual(len(lines), 1)  # the data after the final \n
 
+    def test_output_multibyte(self):
+        data = 'caf\u00e9 \u2603\n\u00fcber\r\n'.encode('utf8')
+
+        for i in range(len(data)):
+            self.proto.childDataReceived(1, data[i:i + 1])
+
+        self.assertEqual([e.data for e in self.dispatched], ['caf\u00e9 \u2603', '\u00fcber'])
+
+    def test_output_backspace(self):
+        self.proto.childDataReceived(1, b'\b\b  > hello\n')
+
+        self.assertEqual([e.data for e in self.dispatched], ['> hello'])
+
+    def test_output_batched(self):
+        clock = task.Clock()
+        self.proto = process.ProcessProtocol(self.dispatch, 'utf8', batch_size=2, clock=clock)
+        batches = []
+        def drain(drain=self.proto.drain):
+            before = len(self.dispatched)
+            drain()
+            batches.append([e.data for e in self.dispatched[before:]])
+        self.proto.drain = drain
+
+        self.proto.childDataReceived(1, b'1\n2\n3\n4\n5\n6')
+        self.assertEqual(self.dispatched, [])
+
+        # two lines a turn
+        clock.advance(0)
+        self.assertEqual(batches, [['1', '2'], ['3', '4'], ['5']])
+        self.assertFalse(clock.getDelayedCalls())
+
+        # what's still queued goes out at once when the server stops
+        self.proto.childDataReceived(1, b'\n7\n8')
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.proto.processEnded(Failure(error.ProcessDone(None)))
+        self.assertEqual([e.data for e in self.dispatched[:8]], ['1', '2', '3', '4', '5', '6', '7', '8'])
+        self.assertIsInstance(self.dispatched[-1], events.ServerStopped)
+        self.assertFalse(clock.getDelayedCalls())
+
+    def test_output_coalesced(self):
+        clock = task.Clock()
+        self.proto = process.ProcessProtocol(self.dispatch, 'utf8', coalesce_timeout=0.5, clock=clock)
+
+        self.proto.childDataReceived(1, b'[12:00:00] [Server thread/ERROR]: Could not pass event\n'
+                                        b'java.lang.NullPointerException: oops\n'
+                                        b'\tat foo.Bar.baz(Bar.java:1)\n'
+                                        b'Caused by: java.lang.IllegalStateException\n'
+                                        b'\t... 3 more\n'
+                                        b'[12:00:01] [Server thread/INFO]: next\n')
+
+        self.assertEqual(len(self.dispatched), 1)
+        event = self.dispatched[0]
+        self.assertEqual(event.data, 'Could not pass event')
+        self.assertEqual(event.level, 'ERROR')
+        self.assertEqual(len(event.lines), 4)
+
+        clock.advance(0.5)
+        self.assertEqual(len(self.dispatched), 2)
+        self.assertEqual(self.dispatched[1].data, 'next')
+        self.assertEqual(self.dispatched[1].lines, ())
+
+    def test_record(self):
+        path = self.mktemp()
+        t = [0.0]
+        self.proto.recorder = replay.Recorder(path, clock=lambda: t[0])
+
+        for delay, chunk in ((0, b'first li'), (0.25, b'ne\nsecond line\n'), (1.5, b'last')):
+            t[0] += delay
+            self.proto.childDataReceived(1, chunk)
+        self.proto.processEnded(Failure(error.ProcessDone(None)))
+
+        self.assertEqual(list(replay.read_frames(path)),
+                         [(0, b'first li'), (0.25, b'ne\nsecond line\n'), (1.5, b'last')])
+        self.assertEqual([e.data for e in self.dispatched[:3]], ['first line', 'second line', 'last'])
+
     def test_process_success(self):
         fail = Failure(error.ProcessDone(None))
 
@@ -0,0 +1,247 @@
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from mk2 import properties
+from mk2.shared import open_resource
+
+from twisted.trial import unittest
+
+
+# The parser as it was before it was rewritten, to check the new one against.
+class LegacyProperties(OrderedDict):
+    def __init__(self, f, parent=None):
+        OrderedDict.__init__(self)
+
+        if parent:
+            self.update(parent)
+            self.types = OrderedDict(parent.types)
+        else:
+            self.types = {}
+
+        decoder = {
+            'int': int,
+            'bool': lambda a: a == 'true',
+            'string': lambda a: a
+        }
+
+        c_seperator  = (':', '=')
+        c_whitespace = (' ', '\t', '\f')
+        c_escapes    = ('t','n','r','f')
+        c_comment    = ('#','!')
+
+        r_unescaped  = '(?<!\\\\)(?:\\\\\\\\)*'
+        r_whitespace = '[' + re.escape(''.join(c_whitespace)) + ']*'
+        r_seperator  = r_unescaped + r_whitespace + r_unescaped + '[' + re.escape(''.join(c_seperator + c_whitespace)) + ']'
+
+        #This handles backslash escapes in keys/values
+        def parse(inp):
+            token = list(inp)
+            out = ""
+            while len(token) > 0:
+                c = token.pop(0)
+                if c == '\\':
+                    try:
+                        c = token.pop(0)
+                        if c in c_escapes:
+                            out += ('\\' + c).encode('latin1') \
+                                             .decode('unicode-escape') \
+                                             .encode('latin1') \
+                                             .decode('utf-8')
+                        elif c == 'u':
+                            b = ""
+                            for i in range(4):
+                                b += token.pop(0)
+                            out += chr(int(b, 16))
+                            uni = True
+                        else:
+                            out += c
+                    except IndexError:
+                        raise ValueError("Invalid escape sequence in input: %s" % inp)
+                else:
+                    out += c
+
+            return out
+        
+        # Try to load the file as json
+        if f.name.endswith(".json"):
+            try:
+                _json = json.load(f)
+                for k, v in _json.items():
+                    self[k] = v
+                print("Loaded properties from input file as json")
+                f.close()
+                return
+            except json.JSONDecodeError:
+                pass
+        
+        if f.mode == "rb":
+            d = f.read().decode('utf-8')
+        else:
+            d = f.read()
+
+        #Deal with Windows / Mac OS linebreaks
+        d = d.replace('\r\n', '\n')
+        d = d.replace('\r', '\n')
+        #Strip leading whitespace
+        d = re.sub('(?m)\n\\s*', '\n', d)
+        #Split logical lines
+        d = re.split('(?m)' + r_unescaped + '\n', d)
+
+        for line in d:
+            #Strip comments and empty lines
+            if line == '' or line[0] in c_comment:
+                continue
+
+            #Strip escaped newlines
+            line = re.sub('(?m)' + r_unescaped + '(\\\\\n)', '', line)
+            assert not '\n' in line
+
+            #Split into k,v
+            x = re.split(r_seperator, line, maxsplit=1)
+
+            #No seperator, parse as empty value.
+            if len(x) == 1:
+                k, v = x[0], ""
+            else:
+                k, v = x
+
+            k = parse(k).replace('-', '_')
+            v = parse(v)
+
+            if re.match(r'^\-?\d+$', v):
+                ty = 'int'
+            elif v in ('true', 'false'):
+                ty = 'bool'
+            elif v != '':
+                ty = 'string'
+            elif k in self.types:
+                ty = self.types[k]
+            else:
+                ty = 'string'
+
+            self.types[k] = ty
+            self[k] = decoder[ty](v)
+        f.close()
+
+
+
+def parse(cls, text, name="test.properties"):
+    f = io.StringIO(text)
+    f.name = name
+    f.mode = "r"
+    try:
+        p = cls(f)
+    except ValueError as e:
+        return "error", str(e)
+    return list(p.items()), sorted(p.types.items())
+
+
+class PropertiesTestCase(unittest.TestCase):
+    def assertSameParse(self, text):
+        self.assertEqual(parse(properties.Properties, text), parse(LegacyProperties, text), repr(text))
+
+    def test_examples(self):
+        for text in ["a=b\nc:d\ne f\n",
+                     "key = value\nkey2   value2\n  indented=yes\n",
+                     "# comment\n! other comment\nx=1\ny=-2\nz=true\nw=false\nv=\n",
+                     "long=one \\\n    two \\\n    three\n",
+                     "escaped\\=key=value\\nwith\\tescapes\\u00e9\\\\\n",
+                     "trailing=backslashes\\\\\nodd=\\\\\\\nnext\n",
+                     "   \nfirst line whitespace\n",
+                     "a=1\na=\n",
+                     "bad=\\u12",
+                     "bad=\\",
+                     "a-b-c=dashes\n",
+                     "\\#not=comment\n#comment\\\nstill comment\nafter=1\n",
+                     "windows=1\r\nmac=2\rdone=3",
+                     "\n\n\n",
+                     "",
+                     "\\\n",
+                     "k \\\\ = v\n",
+                     "k\\\\=v\nk\\ =v\nk\\\\\\=v\n"]:
+            self.assertSameParse(text)
+
+    def test_resources(self):
+        for name in ('resources/mark2.default.properties', 'resources/mark2rc.default.properties'):
+            with open_resource(name) as f:
+                text = f.read()
+            if isinstance(text, bytes):
+                text = text.decode('utf8')
+            self.assertSameParse(text)
+
+    def test_parent(self):
+        # an empty value keeps the type it had in the parent
+        f = io.StringIO("a=1\nb=true\n")
+        f.name, f.mode = "parent.properties", "r"
+        parent = properties.Properties(f)
+        f = io.StringIO("b=\nc=x\n")
+        f.name, f.mode = "child.properties", "r"
+        child = properties.Properties(f, parent)
+        self.assertEqual(list(child.items()), [('a', 1), ('b', False), ('c', 'x')])
+        self.assertEqual(child.types['b'], 'bool')
+
+    def test_random(self):
+        rng = random.Random(2)
+        alphabet = ['a', 'b', '1', '-', '\\', '\\', '=', ':', ' ', '\t', '\f', '\n', '\n', '\r',
+                    '#', '!', 'u', 'n', 't', '0', 'e', '\x0b', '\x1c', '\xa0', '\u2003', 'é']
+        for _ in range(3000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+            self.assertSameParse(text)
+
+
+class LoadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.files = [os.path.join(self.path, n) for n in ('default.properties', 'mark2.properties')]
+        self.write(0, "plugin.a.enabled=true\nplugin.a.x=1\nplugin.b.enabled=false\n"
+                      "mark2.service.process.a=1\nmark2.service.process.b-c=x\nmark2.service.ping=no\n"
+                      "java.cli.X.mx=1G\njava.cli.XX.UseG1GC=true\njava.cli.D.foo.bar=baz\n"
+                      "java.cli_extra=--extra\n")
+        self.write(1, "plugin.b.enabled=true\nplugin.b.y=\n")
+
+        self.reads = []
+        read = properties._Parsed.read.__func__
+
+        def counting(cls, f):
+            self.reads.append(os.path.basename(f.name))
+            return read(cls, f)
+        self.patch(properties._Parsed, 'read', classmethod(counting))
+
+    def write(self, i, text):
+        with open(self.files[i], 'w') as f:
+            f.write(text)
+
+    def load(self):
+        return properties.load(properties.Mark2Properties, *(self.files + [os.path.join(self.path, 'missing')]))
+
+    def test_snapshot(self):
+        first = self.load()
+        self.assertIs(self.load(), first)
+        self.assertEqual(self.reads, ['default.properties', 'mark2.properties'])
+        self.assertRaises(TypeError, first.__setitem__, 'a', 1)
+        self.assertRaises(TypeError, first.update, {'a': 1})
+        self.assertRaises(TypeError, first.pop, 'plugin.a.x')
+
+        # only the file that changed is parsed again
+        self.write(1, "plugin.b.enabled=true\nplugin.b.y=2\n")
+        second = self.load()
+        self.assertIsNot(second, first)
+        self.assertEqual(self.reads, ['default.properties', 'mark2.properties', 'mark2.properties'])
+        self.assertEqual(second['plugin.b.y'], 2)
+        self.assertEqual(first['plugin.b.y'], '')
+
+    def test_namespaces(self):
+        config = self.load()
+        self.assertEqual(config.get_plugins(), [('a', {'x': 1}), ('b', {'y': ''})])
+        config.get_plugins()[0][1]['x'] = 2
+        self.assertEqual(config.get_plugins()[0], ('a', {'x': 1}))
+        self.assertEqual(dict(config.get_service('process')), {'a': 1, 'b_c': 'x'})
+        self.assertEqual(dict(config.get_service('ping')), {})
+        self.assertEqual(config.get_jvm_options(), ['-Xmx1G', '-XX:+UseG1GC', '-Dfoo.bar=baz', '--extra'])
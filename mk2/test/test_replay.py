@@ -0,0 +1,84 @@
+import gzip
+import os
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from mk2.replay import Recorder, ReplayManager, read_frames
+
+
+class ReplayTestCase(unittest.TestCase):
+    timeout = 10
+
+    # the last line is split across two chunks
+    chunks = [
+        (0.0,  b"[12:00:00] [Server thread/INFO]: Starting minecraft server version 1.12.2\n"),
+        (0.25, b"[12:00:01] [Server thread/INFO]: Preparing level \"world\"\n"
+               b"[12:00:02] [Server thread/INFO]: Done (1.5s)! For help, type \"help\"\n[12:00:03] [Ser"),
+        (1.5,  b"ver thread/INFO]: <Steve> hello\n"),
+    ]
+    lines = ["[12:00:00] [Server thread/INFO]: Starting minecraft server version 1.12.2",
+             "[12:00:01] [Server thread/INFO]: Preparing level \"world\"",
+             "[12:00:02] [Server thread/INFO]: Done (1.5s)! For help, type \"help\"",
+             "[12:00:03] [Server thread/INFO]: <Steve> hello"]
+
+    def record(self):
+        path = os.path.abspath(self.mktemp())
+        now = [0.0]
+        recorder = Recorder(path, clock=lambda: now[0])
+        for delay, data in self.chunks:
+            now[0] += delay
+            recorder.write(data)
+        recorder.close()
+        return path
+
+    def unload(self, mgr):
+        # the reactor isn't stopped at the end, so stop what they started
+        for plugins in ('plugins', 'services'):
+            if hasattr(mgr, plugins):
+                getattr(mgr, plugins).unload_all()
+
+    def test_frames(self):
+        self.assertEqual(list(read_frames(self.record())), self.chunks)
+
+    def test_not_a_recording(self):
+        path = self.mktemp()
+        with gzip.open(path, 'wb') as f:
+            f.write(b'[12:00:00] [Server thread/INFO]: a log\n')
+        self.assertRaises(ValueError, list, read_frames(path))
+
+    @defer.inlineCallbacks
+    def test_replay(self):
+        recording = self.record()
+        config = os.path.abspath(self.mktemp())
+        with open(config, 'w') as f:
+            f.write("mark2.service.user_server.enabled=false\n")
+
+        self.addCleanup(os.chdir, os.getcwd())
+        mgr = ReplayManager(recording, config)
+        self.addCleanup(mgr.cleanup)
+        # a replay normally has the process to itself: it logs to a file,
+        # and stops the reactor (or signals itself, if something's wrong)
+        # when it's done
+        mgr.start_logging = lambda: open(os.path.join(mgr.scratch, 'replay.log'), 'w').close()
+        self.patch(reactor, 'addSystemEventTrigger', lambda *a, **k: None)
+        stopped = defer.Deferred()
+        mgr.shutdown = lambda: stopped.errback(Exception("mark2 shut down"))
+
+        console = []
+        handle_console = mgr.handle_console
+        def capture(event):
+            if event.source == 'server':
+                console.append(event.line)
+            return handle_console(event)
+        mgr.handle_console = capture
+
+        mgr.startup()
+        self.addCleanup(self.unload, mgr)
+        # the process service fires this when the server stops, instead of
+        # stopping the reactor, as it does when mark2 itself is stopping
+        mgr.services['process'].service_stopping = stopped
+        yield stopped
+
+        self.assertEqual(console, self.lines)
+        self.assertEqual(mgr.results()['lines'], len(self.lines))
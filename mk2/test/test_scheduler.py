@@ -0,0 +1,65 @@
+from mk2.scheduler import Scheduler
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = Scheduler(self.clock)
+        self.calls = []
+
+    def call(self, name):
+        self.calls.append((name, self.clock.seconds()))
+
+    def test_order(self):
+        self.scheduler.call_later(3, self.call, 'c')
+        self.scheduler.call_later(1, self.call, 'a')
+        self.scheduler.call_later(2, self.call, 'b')
+
+        self.clock.pump([1] * 5)
+
+        self.assertEqual(self.calls, [('a', 1), ('b', 2), ('c', 3)])
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_cancel(self):
+        t = self.scheduler.call_later(1, self.call, 'a')
+        self.assertTrue(t.active())
+        t.cancel()
+        self.assertFalse(t.active())
+        self.assertFalse(self.clock.getDelayedCalls())
+
+        self.clock.advance(2)
+        self.assertEqual(self.calls, [])
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_repeating(self):
+        t = self.scheduler.call_repeating(10, self.call, 'a', now=True)
+        self.clock.pump([10] * 3)
+        self.assertEqual([s for _, s in self.calls], [0, 10, 20, 30])
+
+        # intervals that were missed are skipped, not run in a burst
+        self.clock.advance(35)
+        self.assertEqual([s for _, s in self.calls[4:]], [65])
+        self.assertEqual(t.getTime(), 70)
+
+        t.stop()
+        self.assertFalse(t.running)
+        self.clock.advance(100)
+        self.assertEqual(len(self.calls), 5)
+
+    def test_owner(self):
+        done = []
+        owner = object()
+        self.scheduler.call_later(1, self.call, 'a', owner=owner, on_done=lambda: done.append('a'))
+        self.scheduler.call_repeating(1, self.call, 'b', owner=owner, name='b')
+        self.scheduler.call_later(2, self.call, 'c')
+
+        self.assertEqual([t.name for t in self.scheduler.pending(owner)], [self.call.__qualname__, 'b'])
+
+        self.scheduler.cancel_owner(owner)
+        self.assertEqual(done, ['a'])
+        self.clock.pump([1] * 5)
+        self.assertEqual(self.calls, [('c', 2)])
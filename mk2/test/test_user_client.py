@@ -0,0 +1,117 @@
+import json
+
+from mk2 import framing
+from mk2.user_client import UI, UserClientFactory, UserClientProtocol
+
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+
+class FakeUI:
+    def __init__(self):
+        self.lines = []
+
+    def set_output(self, lines=None):
+        if lines is not None:
+            self.lines = lines
+
+    def append_output(self, line):
+        self.lines.append(line)
+
+
+class Factory(UserClientFactory):
+    # just the parts that deal with the connection
+    def __init__(self):
+        self.config = {}
+        self.ui = FakeUI()
+        self.sessions = {}
+        self.client = None
+
+    def server_connected(self, client):
+        pass
+
+    def server_output(self, line):
+        self.ui.append_output(line)
+
+
+class ResumeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.factory = Factory()
+
+    def connect(self, name='a'):
+        protocol = UserClientProtocol(name, 'alice', self.factory)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        self.factory.client = protocol
+        return protocol, [json.loads(l) for l in transport.value().splitlines()]
+
+    def receive(self, protocol, **msg):
+        protocol.lineReceived(json.dumps(msg).encode())
+
+    def lines(self):
+        return [l['data'] for l in self.factory.ui.lines]
+
+    def test_resume(self):
+        protocol, sent = self.connect()
+        self.assertNotIn('since', sent[1])
+        self.assertEqual(sent[1]['last'], UI.length)
+        # sent before the scrollback, so it's in there
+        self.receive(protocol, type='console', seq=1, data="one")
+        self.receive(protocol, type='scrollback', session='s1', seq=1, since=None, skipped=0,
+                     lines=[{'data': "one"}])
+        self.receive(protocol, type='console', seq=2, data="two")
+        self.assertEqual(self.lines(), ["one", "two"])
+
+        self.factory.save_session(protocol)
+        protocol, sent = self.connect('b')
+        self.receive(protocol, type='scrollback', session='s2', seq=9, since=None, skipped=0,
+                     lines=[{'data': "elsewhere"}])
+        self.assertEqual(self.lines(), ["elsewhere"])
+
+        self.factory.save_session(protocol)
+        protocol, sent = self.connect('a')
+        self.assertEqual((sent[1]['session'], sent[1]['since'], sent[1]['last']), ('s1', 2, UI.length))
+        self.receive(protocol, type='scrollback', session='s1', seq=5, since=2, skipped=1,
+                     lines=[{'data': "four"}, {'data': "five"}])
+        self.assertEqual(self.lines(), ["one", "two", "... 1 line missed ...", "four", "five"])
+        self.assertEqual(protocol.seq, 5)
+
+    def test_continued(self):
+        protocol, sent = self.connect()
+        self.receive(protocol, type='scrollback', session='s1', seq=3, since=None, skipped=0,
+                     lines=[{'data': "one"}, {'data': "two"}])
+        self.receive(protocol, type='scrollback', session='s1', seq=3, since=None, skipped=0, continued=True,
+                     lines=[{'data': "three"}])
+        self.assertEqual(self.lines(), ["one", "two", "three"])
+
+    def test_restarted(self):
+        protocol, sent = self.connect()
+        self.receive(protocol, type='scrollback', session='s1', seq=1, since=None, skipped=0,
+                     lines=[{'data': "one"}])
+        self.factory.save_session(protocol)
+        protocol, sent = self.connect()
+        self.receive(protocol, type='scrollback', session='s2', seq=1, since=None, skipped=0,
+                     lines=[{'data': "new"}])
+        self.assertEqual(self.lines(), ["new"])
+
+
+class FramingTestCase(unittest.TestCase):
+    def test_framing(self):
+        factory = Factory()
+        factory.config = {'socket.zlib': True}
+        protocol = UserClientProtocol('a', 'alice', factory)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        attach = json.loads(transport.value().splitlines()[0])
+        self.assertEqual(attach['framing'], {'compact': False, 'zlib': True})
+
+        framer = framing.Framer(compact=True, compress=True)
+        frames = framer.encode(
+            framing.frame(b'{"type": "scrollback", "session": "s", "seq": 1, "since": null, "skipped": 0, '
+                          b'"lines": [[null, "server", null, null, "", "one", null, "Console"]]}') +
+            framing.frame(b'[2, null, "server", null, null, "", "two", null, "Console"]'))
+        # the rest of the same read is frames
+        protocol.dataReceived(b'{"type": "framing", "compact": true, "zlib": true}\n' + frames[:10])
+        protocol.dataReceived(frames[10:])
+        self.assertEqual([l['data'] for l in factory.ui.lines], ["one", "two"])
+        self.assertEqual(protocol.seq, 2)
@@ -0,0 +1,379 @@
+import json
+
+from mk2 import events, framing
+from mk2.services.user_server import Scrollback, UserServerFactory, UserServerProtocol
+
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+
+class ScrollbackTestCase(unittest.TestCase):
+    def test_ring(self):
+        s = Scrollback(3)
+        self.assertEqual(s.get(), [])
+        self.assertEqual([s.put(c) for c in "ab"], [1, 2])
+        self.assertEqual(s.get(), ["a", "b"])
+        for c in "cde":
+            s.put(c)
+        self.assertEqual(s.first, 3)
+        self.assertEqual(s.get(), ["c", "d", "e"])
+        self.assertEqual(s.get(since=3), ["d", "e"])
+        self.assertEqual(s.get(since=0), ["c", "d", "e"])
+        self.assertEqual(s.get(since=5), [])
+        self.assertEqual(s.get(last=2), ["d", "e"])
+        self.assertEqual(s.get(since=3, last=5), ["d", "e"])
+        self.assertEqual(s.get(last=0), [])
+
+    def test_empty(self):
+        s = Scrollback(0)
+        s.put("a")
+        self.assertEqual(s.get(), [])
+        self.assertEqual(s.seq, 1)
+
+
+class FakeConfig(dict):
+    def get_by_prefix(self, prefix):
+        return [(k[len(prefix):], v) for k, v in self.items() if k.startswith(prefix)]
+
+
+class FakeManager:
+    def __init__(self):
+        self.events = events.EventDispatcher(lambda *a: None)
+        self.config = FakeConfig({'mark2.scrollback.length': 3,
+                                  'mark2.regex.join': 'join'})
+
+    def console(self, line, **k):
+        self.events.dispatch(events.Console(line=line, **k))
+
+
+class UserServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(UserServerFactory, 'clock', self.clock)
+        self.manager = FakeManager()
+        self.factory = UserServerFactory(self.manager)
+
+    def connect(self):
+        protocol = self.factory.buildProtocol(None)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        self.addCleanup(protocol.connectionLost, None)
+        return protocol, transport
+
+    def received(self, transport):
+        msgs = [json.loads(l) for l in transport.value().splitlines()]
+        transport.clear()
+        return msgs
+
+    def console(self, line):
+        self.manager.events.dispatch(events.Console(source='server', line=line, time='12:00:00'))
+
+    def test_scrollback(self):
+        for i in range(5):
+            self.console("line {}".format(i))
+        protocol, transport = self.connect()
+        self.received(transport)
+
+        protocol.lineReceived(b'{"type": "get_scrollback"}')
+        regex, scrollback = self.received(transport)
+        self.assertEqual(regex, {'type': 'regex', 'patterns': {'join': 'join'}})
+        self.assertEqual([l['line'] for l in scrollback['lines']], ["line 2", "line 3", "line 4"])
+        self.assertEqual((scrollback['seq'], scrollback['skipped']), (5, 0))
+
+        protocol.lineReceived(b'{"type": "get_scrollback", "since": 1}')
+        scrollback = self.received(transport)[1]
+        self.assertEqual([l['line'] for l in scrollback['lines']], ["line 2", "line 3", "line 4"])
+        self.assertEqual(scrollback['skipped'], 1)
+
+        protocol.lineReceived(b'{"type": "get_scrollback", "since": 4}')
+        self.assertEqual([l['line'] for l in self.received(transport)[1]['lines']], ["line 4"])
+
+        protocol.lineReceived(b'{"type": "get_scrollback", "last": 2}')
+        self.assertEqual([l['line'] for l in self.received(transport)[1]['lines']], ["line 3", "line 4"])
+
+    def test_broadcast(self):
+        clients = [self.connect() for _ in range(3)]
+        writes = []
+        for protocol, transport in clients:
+            self.received(transport)
+            transport.write = lambda data, write=transport.write: (writes.append(data), write(data))
+
+        self.assertEqual(len(self.manager.events.registered[events.Console]), 1)
+        self.console("one")
+        self.console("two")
+        self.assertEqual(writes, [])
+        self.clock.advance(0)
+
+        # one write of the same bytes to each client
+        self.assertEqual(len(writes), 3)
+        self.assertTrue(all(w is writes[0] for w in writes))
+        for protocol, transport in clients:
+            msgs = self.received(transport)
+            self.assertEqual([(m['type'], m['line']) for m in msgs], [('console', 'one'), ('console', 'two')])
+
+    def test_broadcast_order(self):
+        protocol, transport = self.connect()
+        self.received(transport)
+        self.console("one")
+        protocol.lineReceived(b'{"type": "get_stats"}')
+        self.console("two")
+        self.clock.advance(0)
+        self.assertEqual([m['type'] for m in self.received(transport)], ['console', 'stats', 'console'])
+
+        # a client that connects mid-turn gets earlier lines from the scrollback only
+        self.console("three")
+        late, late_transport = self.connect()
+        self.clock.advance(0)
+        self.assertEqual([m['line'] for m in self.received(transport)], ['three'])
+        self.assertEqual(self.received(late_transport), [])
+
+    def slow_client(self, policy, backlog=2):
+        protocol, transport = self.connect()
+        self.received(transport)
+        protocol.lineReceived(json.dumps({'type': 'attach', 'user': 'alice',
+                                          'policy': policy, 'backlog': backlog}).encode())
+        self.received(transport)
+        self.assertIs(transport.producer, protocol.buffer)
+        protocol.buffer.pauseProducing()
+        for i in range(5):
+            self.console("line {}".format(i))
+        self.clock.advance(0)
+        self.assertEqual(transport.value(), b'')
+        return protocol, transport
+
+    def test_slow_client_coalesce(self):
+        protocol, transport = self.slow_client('coalesce')
+        protocol.buffer.resumeProducing()
+        note, *lines = self.received(transport)
+        self.assertEqual((note['source'], note['skipped']), ('mark2', 3))
+        self.assertEqual([l['line'] for l in lines], ["line 3", "line 4"])
+
+        # and back to normal once it has caught up
+        self.console("line 5")
+        self.clock.advance(0)
+        self.assertEqual([l['line'] for l in self.received(transport)], ["line 5"])
+
+    def test_slow_client_drop(self):
+        protocol, transport = self.slow_client('drop')
+        protocol.buffer.resumeProducing()
+        msgs = self.received(transport)
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0]['skipped'], 5)
+
+    def test_slow_client_disconnect(self):
+        protocol, transport = self.slow_client('disconnect')
+        self.assertTrue(transport.disconnecting)
+
+    def test_slow_client_order(self):
+        protocol, transport = self.slow_client('coalesce')
+        protocol.lineReceived(b'{"type": "get_stats"}')
+        self.console("line 5")
+        self.clock.advance(0)
+        self.assertEqual(transport.value(), b'')
+        protocol.buffer.resumeProducing()
+        msgs = self.received(transport)
+        # the latest two lines are kept, either side of the stats
+        self.assertEqual([m['type'] for m in msgs], ['console', 'console', 'stats', 'console'])
+        self.assertEqual(msgs[0]['skipped'], 4)
+        self.assertEqual([m.get('line') for m in msgs[1:]], ["line 4", None, "line 5"])
+
+    def test_slow_client_scrollback(self):
+        # a client paused by its own scrollback isn't dropped for it
+        for i in range(3):
+            self.console("old {}".format(i))
+        protocol, transport = self.connect()
+        protocol.lineReceived(b'{"type": "attach", "user": "alice", "policy": "disconnect", "backlog": 2}')
+        def write(data, write=transport.write):
+            write(data)
+            if b'"scrollback"' in data:
+                protocol.buffer.pauseProducing()
+        transport.write = write
+        protocol.lineReceived(b'{"type": "get_scrollback"}')
+        self.received(transport)
+        self.console("new")
+        self.clock.advance(0)
+        self.assertFalse(transport.disconnecting)
+        protocol.buffer.resumeProducing()
+        self.assertEqual([m['line'] for m in self.received(transport)], ["new"])
+
+        # but it is once that's been sent
+        protocol.buffer.pauseProducing()
+        self.console("newer")
+        self.clock.advance(0)
+        self.assertTrue(transport.disconnecting)
+
+    def test_unknown_policy(self):
+        protocol, transport = self.connect()
+        protocol.lineReceived(b'{"type": "attach", "user": "alice", "policy": "hoard"}')
+        self.assertEqual(protocol.buffer.policy, 'coalesce')
+        self.clock.advance(0)
+        self.assertIn("unknown backpressure policy", transport.value().decode())
+
+    def test_backlog_limit(self):
+        protocol, transport = self.connect()
+        self.assertEqual(protocol.buffer.limit, 500)
+        protocol.lineReceived(b'{"type": "attach", "user": "alice", "backlog": 1000000000}')
+        self.assertEqual(protocol.buffer.limit, 500)
+        protocol.lineReceived(b'{"type": "attach", "user": "alice", "backlog": 20}')
+        self.assertEqual(protocol.buffer.limit, 20)
+        for backlog in (b'-1', b'null', b'[1]', b'"lots"'):
+            protocol.lineReceived(b'{"type": "attach", "user": "alice", "backlog": ' + backlog + b'}')
+            self.assertEqual(protocol.buffer.limit, 20)
+        self.clock.advance(0)
+        errors = [m['line'] for m in self.received(transport) if m['type'] == 'console']
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(e.startswith("alice: backlog") for e in errors))
+
+    def test_subscribe(self):
+        everything, t_everything = self.connect()
+        chat, t_chat = self.connect()
+        chat2, t_chat2 = self.connect()
+        for protocol in (chat, chat2):
+            protocol.lineReceived(b'{"type": "subscribe", "sources": ["server"], "patterns": ["<\\\\w+> .*"]}')
+        self.assertIs(chat.subscription, chat2.subscription)
+        self.assertEqual(len(self.factory.subscriptions), 2)
+
+        self.console("<Steve> hi")
+        self.console("Steve joined the game")
+        self.manager.events.dispatch(events.Console(source='user', line="<Steve> not from the server"))
+        self.clock.advance(0)
+        self.assertEqual(len(self.received(t_everything)), 3)
+        for transport in (t_chat, t_chat2):
+            self.assertEqual([m['line'] for m in self.received(transport)], ["<Steve> hi"])
+
+        # the scrollback is filtered too
+        chat.lineReceived(b'{"type": "get_scrollback"}')
+        self.assertEqual([l['line'] for l in self.received(t_chat)[1]['lines']], ["<Steve> hi"])
+
+        # an empty subscription is everything again
+        chat.lineReceived(b'{"type": "subscribe"}')
+        self.assertIs(chat.subscription, everything.subscription)
+        chat2.connectionLost(None)
+        self.assertEqual(len(self.factory.subscriptions), 1)
+
+    def test_subscribe_invalid(self):
+        protocol, transport = self.connect()
+        protocol.lineReceived(b'{"type": "subscribe", "patterns": ["("]}')
+        protocol.lineReceived(b'{"type": "subscribe", "levels": [1]}')
+        self.assertTrue(protocol.subscription.everything)
+        self.clock.advance(0)
+        self.assertEqual([m['line'][:10] for m in self.received(transport)], ["subscribe:"] * 2)
+
+    def test_push(self):
+        poller, t_poller = self.connect()
+        poller.lineReceived(b'{"type": "attach", "user": "bob"}')
+        protocol, transport = self.connect()
+        protocol.lineReceived(b'{"type": "attach", "user": "alice", "push": ["stats", "players", "weather"]}')
+        msgs = self.received(transport)
+        self.assertEqual(msgs[0], {'type': 'capabilities', 'push': ['players', 'stats']})
+        self.assertEqual([m['type'] for m in msgs[1:3]], ['stats', 'players'])
+        self.received(t_poller)
+
+        dispatch = self.manager.events.dispatch
+        dispatch(events.StatPlayers(players=["Steve", "alex"]))
+        dispatch(events.StatProcess(cpu=1.5, memory=20))
+        self.clock.advance(0)
+        stats, players = self.received(transport)
+        self.assertEqual(stats, {'type': 'stats', 'delta': True, 'stats': {'cpu': '1.50', 'memory': '20.00'}})
+        self.assertEqual(players, {'type': 'players', 'delta': True, 'added': ['alex', 'Steve'], 'removed': []})
+
+        # changes within the interval are coalesced, and no change means nothing is sent
+        dispatch(events.StatProcess(cpu=2, memory=20))
+        dispatch(events.StatProcess(cpu=3, memory=20))
+        dispatch(events.StatPlayers(players=["Steve", "alex"]))
+        self.clock.advance(0.5)
+        self.assertEqual(self.received(transport), [])
+        self.clock.advance(0.5)
+        self.assertEqual(self.received(transport), [{'type': 'stats', 'delta': True, 'stats': {'cpu': '3.00'}}])
+
+        dispatch(events.StatPlayers(players=["alex"]))
+        self.clock.advance(1)
+        self.assertEqual(self.received(transport)[0]['removed'], ['Steve'])
+
+        # clients that didn't ask still poll
+        self.assertEqual(self.received(t_poller), [])
+        poller.lineReceived(b'{"type": "get_players"}')
+        self.assertEqual(self.received(t_poller)[0]['players'], ['alex'])
+
+    def test_resume(self):
+        protocol, transport = self.connect()
+        self.console("one")
+        self.clock.advance(0)
+        one, = self.received(transport)
+        self.assertEqual(one['seq'], 1)
+        protocol.connectionLost(None)
+
+        for line in ("two", "three"):
+            self.console(line)
+        protocol, transport = self.connect()
+        session = self.factory.session
+        protocol.lineReceived(json.dumps({'type': 'get_scrollback', 'session': session, 'since': 1}).encode())
+        scrollback = self.received(transport)[1]
+        self.assertEqual((scrollback['session'], scrollback['since'], scrollback['skipped']), (session, 1, 0))
+        self.assertEqual([l['line'] for l in scrollback['lines']], ["two", "three"])
+
+        # lines that have fallen out of the scrollback are counted
+        for i in range(4):
+            self.console(str(i))
+        self.clock.advance(0)
+        self.received(transport)
+        protocol.lineReceived(json.dumps({'type': 'get_scrollback', 'session': session, 'since': 3}).encode())
+        scrollback = self.received(transport)[1]
+        self.assertEqual((scrollback['since'], scrollback['skipped']), (3, 1))
+
+        # and so are the ones left out by 'last'
+        protocol.lineReceived(json.dumps({'type': 'get_scrollback', 'session': session, 'since': 4, 'last': 1}).encode())
+        scrollback = self.received(transport)[1]
+        self.assertEqual((scrollback['skipped'], len(scrollback['lines'])), (2, 1))
+
+        # from a different run of mark2, it's the whole scrollback
+        protocol.lineReceived(b'{"type": "get_scrollback", "session": "0123", "since": 1}')
+        scrollback = self.received(transport)[1]
+        self.assertEqual((scrollback['since'], scrollback['skipped'], scrollback['seq']), (None, 0, 7))
+        self.assertEqual(len(scrollback['lines']), 3)
+
+    def test_framing(self):
+        self.console("before")
+        protocol, transport = self.connect()
+        protocol.buffer.pauseProducing()
+        self.console("while paused")
+        self.clock.advance(0)
+        protocol.lineReceived(b'{"type": "attach", "user": "alice", "framing": {"compact": true, "zlib": true}}')
+        protocol.lineReceived(b'{"type": "get_scrollback"}')
+        protocol.buffer.resumeProducing()
+        self.console("after")
+        self.clock.advance(0)
+
+        data = transport.value()
+        line, data = data.split(b'\n', 1)
+        self.assertEqual(json.loads(line.decode()), {'type': 'framing', 'compact': True, 'zlib': True})
+        packets = framing.Deframer(True).feed(data)
+        # what was held back for the paused client still comes first
+        self.assertEqual([p['type'] for p in packets],
+                         ['console', 'user_status', 'regex', 'scrollback', 'console'])
+        self.assertEqual([l['line'] for l in packets[3]['lines']], ["before", "while paused"])
+        self.assertEqual([(p['seq'], p['line']) for p in packets[::4]], [(2, "while paused"), (3, "after")])
+
+        # lines are packed for compact clients once: older ones when they're
+        # first asked for, and new ones as they arrive
+        self.assertEqual(self.factory.compact_clients, 1)
+        self.assertEqual([framing.unpack(json.loads(l.decode()))['line'] for l in self.factory.scrollback.compact],
+                         ["after", "before", "while paused"])
+        protocol.connectionLost(None)
+        self.assertEqual(self.factory.compact_clients, 0)
+
+    def test_scrollback_chunks(self):
+        self.manager.config['mark2.scrollback.length'] = 10000
+        self.factory = UserServerFactory(self.manager)
+        for i in range(10000):
+            self.console("line {} {}".format(i, "x" * 200))
+        protocol, transport = self.connect()
+        protocol.lineReceived(b'{"type": "get_scrollback"}')
+        packets = transport.value().splitlines()[1:]
+        self.assertTrue(len(packets) > 1)
+        self.assertTrue(all(len(p) < UserServerProtocol.MAX_LENGTH for p in packets))
+        packets = [json.loads(p) for p in packets]
+        self.assertEqual([p.get('continued', False) for p in packets], [False] + [True] * (len(packets) - 1))
+        lines = [l['line'] for p in packets for l in p['lines']]
+        self.assertEqual(lines, ["line {} {}".format(i, "x" * 200) for i in range(10000)])
@@ -0,0 +1,69 @@
+import time
+
+from mk2 import events
+from mk2.profiler import DispatchProfiler
+from mk2.services import watchdog
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+
+class WatchdogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = events.EventDispatcher(lambda *a: None)
+        self.config = {}
+        self.lags = []
+        self.lines = []
+        self.events.register(self.lags.append, events.StatLag)
+
+        # stalls are made by moving this on, rather than by really blocking
+        self.now = 0.0
+        self.patch(watchdog.Watchdog, 'clock', Clock())
+        self.patch(watchdog.Watchdog, 'monotonic', staticmethod(lambda: self.now))
+        self.plugin = watchdog.Watchdog(self, 'watchdog', threshold=50)
+        self.addCleanup(self.plugin.teardown)
+
+    def console(self, line, **k):
+        self.lines.append(line)
+
+    def fatal_error(self, *a, **k):
+        self.fail("fatal error: {} {}".format(a, k))
+
+    def stall(self, seconds):
+        # the reactor thread is stuck for `seconds`, as far as the watchdog
+        # can tell, until its thread has caught it in the act
+        self.now += seconds
+        deadline = time.monotonic() + 5
+        while self.plugin.captured is None and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def test_stall(self):
+        def slow(event):
+            self.stall(1)
+
+        self.events.register(slow, events.UserInput)
+        self.events.dispatch(events.UserInput(user='foo', line='bar'))
+        self.plugin.tick()
+
+        self.assertEqual(len(self.lags), 1)
+        self.assertEqual(self.lags[0].lag, 500)
+        self.assertIn('test_stall.<locals>.slow', self.lags[0].handler)
+        self.assertIn('self.stall(1)', self.lags[0].stack)
+
+        self.events.dispatch(events.Hook(line='~lag'))
+        self.assertIn('1 stall over 50ms since startup', self.lines)
+
+    def test_stall_profiled(self):
+        # the handler running is the profiler's wrapper around it
+        class P:
+            name = 'backup'
+
+            def handle(p, event):
+                self.stall(1)
+
+        self.events.profiler = DispatchProfiler(sample=1)
+        self.events.register(P().handle, events.UserInput)
+        self.events.dispatch(events.UserInput(user='foo', line='bar'))
+        self.plugin.tick()
+
+        self.assertEqual(self.lags[0].handler, 'UserInput backup:WatchdogTestCase.test_stall_profiled.<locals>.P.handle')
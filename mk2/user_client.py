@@ -4,6 +4,7 @@ import glob
 import json
 import os
 import re
+import zlib
 from string import Template
 
 import psutil
@@ -14,7 +15,7 @@ from twisted.internet.protocol import ClientFactory, ProcessProtocol
 from twisted.internet.task import LoopingCall
 from twisted.protocols.basic import LineReceiver
 
-from . import properties
+from . import framing, properties
 from .shared import console_repr, open_resource, decode_if_bytes, encode_if_str
 
 
@@ -208,6 +209,8 @@ class PMenuWrap(urwid.WidgetPlaceholder):
 
 class UI:
     loop = None
+    # lines of output kept
+    length = 999
 
     def __init__(self, palette, get_players, run_command, switch_server, connect_to_server, pmenu_actions, pmenu_reasons):
         self.palette = palette
@@ -430,7 +433,7 @@ class UI:
             line = line_dict
 
         scroll = False
-        del self.lines[:-999]
+        del self.lines[:-self.length]
         self.lines.append(line)
 
         if not self.filter(line):
@@ -445,19 +448,27 @@ class UI:
         except IndexError:  # nothing in listbox
             pass
 
-        self.g_output_list.append(urwid.Text(colorize(line)))
+        self.g_output_list.append(self.render(line))
         if scroll:
             self.g_output.focus_position += 1
 
+    def render(self, line):
+        # kept with the line, so switching back to a server or filter
+        # doesn't colorize everything again
+        text = line.get('_text')
+        if text is None:
+            text = line['_text'] = urwid.Text(colorize(line))
+        return text
+
     def set_output(self, lines=None):
         contents = self.g_output_list
         del contents[0:len(contents)]
 
-        lines = lines or self.lines
-        lines = [l for l in lines if self.filter(l)]
+        if lines is not None:
+            self.lines = lines[-self.length:]
+        lines = [l for l in self.lines if self.filter(l)]
 
-        for line in lines:
-            contents.append(urwid.Text(colorize(line)))
+        contents.extend(self.render(line) for line in lines)
 
         try:
             self.g_output.focus_position = len(lines) - 1
@@ -554,6 +565,8 @@ class UserClientFactory(ClientFactory):
 
         self.client = None
         self.stats = {}
+        # server name: (session, seq, lines) for servers we've switched away from
+        self.sessions = {}
         self.system_users = SystemUsers()
 
         #read the config
@@ -609,6 +622,7 @@ class UserClientFactory(ClientFactory):
 
     def connect_to_server(self, name):
         if self.client:
+            self.save_session(self.client)
             self.client.close()
         reactor.connectUNIX(self.socket_to(name), self)
 
@@ -626,11 +640,12 @@ class UserClientFactory(ClientFactory):
             self.client.get_users()
 
     def update_players(self):
-        if self.client:
+        # servers that push changes don't need asking
+        if self.client and 'players' not in self.client.pushed:
             self.client.get_players()
 
     def update_stats(self):
-        if self.client:
+        if self.client and 'stats' not in self.client.pushed:
             self.client.get_stats()
 
     def app_update(self, name, data):
@@ -650,12 +665,34 @@ class UserClientFactory(ClientFactory):
         pass
 
     def server_disconnected(self, client):
+        self.save_session(client)
         self.switch_server()
 
     def server_output(self, line):
         self.ui.append_output(line)
 
-    def server_scrollback(self, lines):
+    def save_session(self, client):
+        if client.session and client.seq is not None:
+            self.sessions[client.name] = (client.session, client.seq, list(self.ui.lines))
+
+    def scrollback_cursor(self, name):
+        """Returns the (session, seq) of the last line we saw from `name`,
+        so only what's been missed since is asked for."""
+        if name in self.sessions:
+            return self.sessions[name][:2]
+
+    def server_scrollback(self, name, msg):
+        lines = msg['lines']
+        if msg.get('continued'):
+            return self.ui.set_output(self.ui.lines + lines)
+        saved = self.sessions.pop(name, None)
+        if saved and msg.get('since') is not None and msg.get('session') == saved[0]:
+            old = saved[2]
+            if msg.get('skipped'):
+                old = old + [{'source': 'mark2',
+                              'data': "... {} line{} missed ...".format(msg['skipped'], "" if msg['skipped'] == 1 else "s"),
+                              'time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}]
+            lines = old + lines
         self.ui.set_output(lines)
 
     def server_players(self, players):
@@ -727,6 +764,9 @@ class UserClientProtocol(LineReceiver):
         self.user = user
         self.users = set()
         self.players = list()
+        self.pushed = frozenset()
+        self.session = None
+        self.seq = None
         self.factory = factory
 
     def close(self):
@@ -735,8 +775,17 @@ class UserClientProtocol(LineReceiver):
 
     def connectionMade(self):
         self.alive = 1
-        self.send("attach", user=self.user)
-        self.send("get_scrollback")
+        attach = {'user': self.user, 'push': ["stats", "players"]}
+        wanted = {k: self.factory.config.get('socket.' + k, False) for k in ('compact', 'zlib')}
+        if any(wanted.values()):
+            attach['framing'] = wanted
+        self.send("attach", **attach)
+        # no more than will be shown
+        cursor = self.factory.scrollback_cursor(self.name)
+        if cursor:
+            self.send("get_scrollback", session=cursor[0], since=cursor[1], last=UI.length)
+        else:
+            self.send("get_scrollback", last=UI.length)
         self.factory.server_connected(self)
 
     def connectionLost(self, reason):
@@ -745,14 +794,32 @@ class UserClientProtocol(LineReceiver):
 
     def lineReceived(self, line):
         #log.msg(line)
-        msg = json.loads(line)
+        self.packetReceived(json.loads(line))
+
+    def rawDataReceived(self, data):
+        try:
+            packets = self.deframer.feed(data)
+        except (ValueError, zlib.error) as e:
+            self.factory.log("bad data from the server: {}".format(e))
+            self.transport.loseConnection()
+            return
+        for msg in packets:
+            self.packetReceived(msg)
+
+    def packetReceived(self, msg):
         ty = msg["type"]
 
-        if ty == "console":    
+        if ty == "console":
+            # anything sent before the scrollback is in it
+            if self.session is None:
+                return
+            self.seq = msg.get('seq', self.seq)
             self.factory.server_output(msg)
 
         elif ty == "scrollback":
-            self.factory.server_scrollback(msg['lines'])
+            self.session = msg.get('session', '')
+            self.seq = msg.get('seq')
+            self.factory.server_scrollback(self.name, msg)
 
         elif ty == "user_status":
             user = str(msg["user"])
@@ -763,7 +830,11 @@ class UserClientProtocol(LineReceiver):
             self.factory.server_users(list(self.users))
 
         elif ty == "players":
-            self.players = msg['players']
+            if msg.get('delta'):
+                players = set(self.players).difference(msg['removed']).union(msg['added'])
+                self.players = sorted(players, key=str.lower)
+            else:
+                self.players = msg['players']
             self.factory.server_players(self.players)
 
         elif ty == "stats":
@@ -772,6 +843,14 @@ class UserClientProtocol(LineReceiver):
         elif ty == "regex":
             self.factory.server_regex(msg['patterns'])
 
+        elif ty == "capabilities":
+            self.pushed = frozenset(msg.get('push', ()))
+
+        elif ty == "framing":
+            # everything after this is frames
+            self.deframer = framing.Deframer(msg['zlib'])
+            self.setRawMode()
+
         else:
             self.factory.log("wat")
 